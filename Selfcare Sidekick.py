@@ -16,21 +16,38 @@ from discord import app_commands
 
 import sys
 import asyncio
+import hashlib
+import heapq
 import json
+import mmap
 import os
+import sqlite3
+import struct
 import pytz
+import re
+import unicodedata
 
 import random
-from datetime import datetime, time, timedelta
+import secrets
+import threading
+import traceback
+import weakref
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial, wraps
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+
+# Installed with discord.py; only used for the optional metrics endpoint.
+from aiohttp import web
 
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 
-# Global dictionary to store pending buddy requests:
-# Key: generated code, Value: dict with "inviter" (user id) and "expires" (datetime)
-buddy_requests = {}
-
 CONFIG_FILE = "config.json"
 DATA_FILE = "users.json"
 
@@ -67,56 +84,2593 @@ def load_config():
 
 config = load_config()
 
-def load_data():
-    if os.path.exists(DATA_FILE):
+def load_data(path=DATA_FILE):
+    if not os.path.exists(path):
+        return {}
+    started = perf_counter()
+    with open(path, "r") as f:
+        raw = f.read()
+    metrics.inc("ssk_storage_read_bytes_total", len(raw), file=os.path.basename(path))
+    if not raw.strip():
+        # A brand-new, still-empty data file.
+        return {}
+    try:
+        return json.loads(raw)
+    except json.decoder.JSONDecodeError as e:
+        # Never fall back to an empty dict here: the next save would then wipe
+        # every registered user.
+        raise RuntimeError(f"{path} is not valid JSON ({e}). Restore it from a backup before starting the bot.")
+    finally:
+        metrics.observe("ssk_storage_read_seconds", perf_counter() - started, op="load_data")
+
+def fsync_directory(path):
+    # Make a rename inside the directory durable. Not supported on Windows.
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_atomic(path, text):
+    # Write to a temporary file next to the target and rename it over the old
+    # one, so a crash leaves either the old or the new document, never half.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        # Everything written is JSON with non-ASCII escaped, so characters are bytes.
+        metrics.inc("ssk_storage_write_bytes_total", len(text), file=os.path.basename(path))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(path)
+
+def append_text(path, text):
+    with open(path, "a") as f:
+        f.write(text)
+        metrics.inc("ssk_storage_write_bytes_total", len(text), file=os.path.basename(path))
+        f.flush()
+        os.fsync(f.fileno())
+
+def save_data(data, path=DATA_FILE):
+    write_atomic(path, json.dumps(data, indent=4))
+
+def encode(value):
+    # Compact JSON, for journal lines and other machine-read text.
+    return json.dumps(value, separators=(",", ":"))
+
+###############################################################################
+# --- Metrics ---
+###############################################################################
+# Upper bounds (seconds) of the histogram buckets: from a cached /list up to
+# a whole reminder burst.
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        # counts[i] holds observations <= METRIC_BUCKETS[i]; the last is +Inf.
+        self.counts = [0] * (len(METRIC_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(METRIC_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation.
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(METRIC_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Metrics:
+    """Counters and latency histograms kept in process.
+
+    Series are keyed by name and a sorted tuple of labels. The writer thread
+    records too, hence the lock. render() returns the Prometheus text format
+    served on METRICS_PORT (see start_metrics_server).
+    """
+
+    def __init__(self):
+        self.counters = {}    # (name, labels) -> number
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}      # name -> function returning the current value
+        self.started = datetime.now(pytz.utc)
+        self.lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, func):
+        # Read when rendered, on the event loop.
+        self.gauges[name] = func
+
+    def timed(self, name, **labels):
+        # Decorator for coroutine functions: observes how long each call took,
+        # whether it returned or raised.
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.observe(name, perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def labels(pairs, extra=()):
+        pairs = list(pairs) + list(extra)
+        if not pairs:
+            return ""
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(h.counts), h.sum, h.count) for key, h in self.histograms.items())
+        lines = []
+        for name, func in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {func()}")
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{self.labels(labels)} {value}")
+        for (name, labels), counts, total, count in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket in zip(METRIC_BUCKETS + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{self.labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{self.labels(labels)} {total}")
+            lines.append(f"{name}_count{self.labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def counter_totals(self, name, label):
+        # {label value: total} for one counter, e.g. DMs sent per event.
+        totals = {}
+        with self.lock:
+            for (series, labels), value in self.counters.items():
+                if series == name:
+                    key = dict(labels).get(label)
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def latencies(self, name, label):
+        # [(label value, count, p50, p95, max bucket)] for one histogram, busiest first.
+        with self.lock:
+            rows = [
+                (dict(labels).get(label), h.count, h.quantile(0.5), h.quantile(0.95), h.quantile(1))
+                for (series, labels), h in self.histograms.items() if series == name and h.count
+            ]
+        return sorted(rows, key=lambda row: -row[1])
+
+metrics = Metrics()
+
+###############################################################################
+# --- Background Writer ---
+###############################################################################
+# Every disk write runs on this one thread, in the order it was submitted, so
+# the event loop never waits on open/write/fsync. Callers hand over text they
+# encoded on the loop (or a copy), never a live record.
+disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-writer")
+
+def write_behind(func, *args, done=None):
+    """Run func(*args) on the writer thread.
+
+    Inside the bot this returns at once and `done`, if given, is called on the
+    event loop with func's result (None if it failed) when the write has
+    finished. Outside a running loop (startup, shutdown, maintenance scripts)
+    it waits, behind any writes still queued, and raises if the write fails.
+    """
+    future = disk_writer.submit(timed_write, func, perf_counter(), *args)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        result = future.result()
+        if done is not None:
+            done(result)
+        return
+
+    def finished(future):
+        error = future.exception()
+        if error is not None:
+            print(f"Background write {func.__qualname__} failed: {error!r}")
+        if done is not None:
+            done(None if error is not None else future.result())
+
+    future.add_done_callback(lambda future: loop.call_soon_threadsafe(finished, future))
+
+def timed_write(func, submitted, *args):
+    # Runs on the writer thread: how long the write queued, then how long it took.
+    started = perf_counter()
+    metrics.observe("ssk_storage_queue_seconds", started - submitted)
+    try:
+        return func(*args)
+    finally:
+        metrics.observe("ssk_storage_write_seconds", perf_counter() - started, op=func.__qualname__)
+
+class BatchedLog:
+    """An append-only JSON-lines file written in batches.
+
+    Entries are encoded when appended and handed to the writer thread
+    `delay` seconds after the first one (at once outside the event loop).
+    """
+
+    def __init__(self, path, delay=1):
+        self.path = path
+        self.delay = delay
+        self._lines = []
+        self._handle = None
+
+    def append(self, entry):
+        self._lines.append(encode(entry) + "\n")
+        if self._handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+                return
+            self._handle = loop.call_later(self.delay, self.flush)
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if not self._lines:
+            return
+        payload = "".join(self._lines)
+        self._lines.clear()
+        write_behind(append_text, self.path, payload)
+
+###############################################################################
+# --- Journaled Storage ---
+###############################################################################
+JOURNAL_FILE = "users.journal"
+# Journal entries written before the snapshot in DATA_FILE is rewritten.
+COMPACT_EVERY = 1000
+
+class JournalStorage:
+    """Snapshot plus append-only journal for the user data.
+
+    DATA_FILE holds a full snapshot that is only ever replaced atomically.
+    Every flush appends one JSON line per changed user to JOURNAL_FILE:
+
+        {"op": "set", "user": "<id>", "fields": {...}}   update some fields
+        {"op": "put", "user": "<id>", "record": {...}}   replace a record
+        {"op": "del", "user": "<id>"}                    remove a record
+
+    A dotted field name such as "stats.tasks.d1" sets one value inside nested
+    dicts. Entries carry absolute values, so replaying one that is already
+    part of the snapshot is harmless. After COMPACT_EVERY entries the snapshot is
+    rewritten and the journal truncated.
+
+    write() and compact() take already-encoded text and run on the writer
+    thread; journaled() is the event loop's bookkeeping.
+    """
+
+    # Every user is loaded at startup; see SqliteStorage for the lazy variant.
+    lazy = False
+    # Files are only ever written by one process.
+    shared = False
+
+    def __init__(self, data_path=DATA_FILE, journal_path=JOURNAL_FILE, compact_every=COMPACT_EVERY):
+        self.data_path = data_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.entries_since_compact = 0
+
+    def load(self):
+        users = load_data(self.data_path)
+        replayed = self.replay(partial(apply_journal_entry, users))
+        if replayed:
+            print(f"Recovered {replayed} journal entries from {self.journal_path}.")
+        return users
+
+    def replay(self, apply):
+        # Passes every intact journal entry to apply(entry), in order.
+        if not os.path.exists(self.journal_path):
+            return 0
+        replayed = 0
+        good_offset = 0
+        with open(self.journal_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn write from a crash; everything before it is intact.
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    break
+                apply(entry)
+                replayed += 1
+                good_offset += len(line)
+        metrics.inc("ssk_storage_read_bytes_total", good_offset, file=os.path.basename(self.journal_path))
+        if good_offset != os.path.getsize(self.journal_path):
+            print(f"Discarding a damaged tail of {self.journal_path} after {replayed} entries.")
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good_offset)
+                f.flush()
+                os.fsync(f.fileno())
+        self.entries_since_compact = replayed
+        return replayed
+
+    def write(self, lines):
+        append_text(self.journal_path, "".join(lines))
+
+    def journaled(self, count):
+        # Count entries handed to write(); True when it is time to compact.
+        self.entries_since_compact += count
+        if self.entries_since_compact < self.compact_every:
+            return False
+        self.entries_since_compact = 0
+        return True
+
+    def compact(self, encoded):
+        # `encoded` maps user id -> JSON text of the record, so the snapshot
+        # is assembled here instead of re-encoding every user on the loop.
+        write_atomic(self.data_path, "{" + ",".join(f"{json.dumps(user_id)}:{text}" for user_id, text in encoded.items()) + "}")
+        # The snapshot now contains every journaled change.
+        with open(self.journal_path, "w") as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+def set_fields(record, fields):
+    # Apply the fields of a "set" entry, following dotted names into nested dicts.
+    for field, value in fields.items():
+        *parents, name = field.split(".")
+        target = record
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[name] = value
+
+def field_value(record, field, default=None):
+    for name in field.split("."):
+        if not isinstance(record, dict) or name not in record:
+            return default
+        record = record[name]
+    return record
+
+def apply_journal_entry(users, entry):
+    user_id = entry["user"]
+    op = entry["op"]
+    if op == "set":
+        if user_id in users:
+            set_fields(users[user_id], entry["fields"])
+    elif op == "put":
+        users[user_id] = entry["record"]
+    elif op == "del":
+        users.pop(user_id, None)
+
+def journal_entry(users, user_id, fields):
+    # Build the smallest journal entry describing the current state of a user.
+    record = users.get(user_id)
+    if record is None:
+        return {"op": "del", "user": user_id}
+    if fields is None:
+        return {"op": "put", "user": user_id, "record": record}
+    missing = object()
+    values = ((field, field_value(record, field, missing)) for field in fields)
+    return {"op": "set", "user": user_id, "fields": {field: value for field, value in values if value is not missing}}
+
+###############################################################################
+# --- Task Catalog and Task IDs ---
+###############################################################################
+# Every task offered at registration, by catalog id. User records hold these
+# ids instead of copies of the text, so a description or points value is
+# edited here once. Ids are never renumbered or reused: to retire a task,
+# drop it from the lists below but keep its entry for the users who have it.
+# Bump TASK_CATALOG_VERSION after adding entries, so records still holding
+# copies that match a new entry are switched to its id when next loaded.
+TASK_CATALOG_VERSION = 1
+TASK_CATALOG = {
+    "t1": {"description": "Rise and shine - enjoy a refreshing glass of water!", "difficulty": 1},
+    "t2": {"description": "Splash your face and greet the day with a smile.", "difficulty": 1},
+    "t3": {"description": "Brush your teefs until they sparkle.", "difficulty": 1},
+    "t4": {"description": "Hop in the shower if you're feeling a bit groggy.", "difficulty": 1},
+    "t5": {"description": "Quickly brush your hair for a neat look.", "difficulty": 1},
+    "t6": {"description": "Change into fresh undies and a comfy tee.", "difficulty": 1},
+    "t7": {"description": "Fuel up with a healthy meal or snack.", "difficulty": 1},
+    "t8": {"description": "Take a light walk or stretch to get moving.", "difficulty": 1},
+    "t9": {"description": "Do something fun that makes your heart sing.", "difficulty": 1},
+    "t10": {"description": "Check in with your mood and give yourself a high-five.", "difficulty": 1},
+    "t11": {"description": "Meditate for 5 magical minutes.", "difficulty": 2},
+    "t12": {"description": "Write one thing you're grateful for.", "difficulty": 2},
+    "t13": {"description": "Drink another glass of water - hydrate like a hero!", "difficulty": 1},
+    "t14": {"description": "Take 5 deep, mindful breaths.", "difficulty": 1},
+    "t15": {"description": "Step outside and soak up some sunshine.", "difficulty": 1},
+    "t16": {"description": "Play your favorite tune and dance a bit.", "difficulty": 2},
+    "t17": {"description": "Read a few pages of a good book.", "difficulty": 2},
+    "t18": {"description": "Do a quick, gentle stretch.", "difficulty": 1},
+    "t19": {"description": "Tidy up a small corner for a clear mind.", "difficulty": 2},
+    "t20": {"description": "Smile at yourself in the mirror.", "difficulty": 1},
+    "t21": {"description": "Whip up a tasty healthy snack.", "difficulty": 2},
+    "t22": {"description": "Take a short break from screens.", "difficulty": 1},
+    "t23": {"description": "Enjoy a warm cup of tea or coffee.", "difficulty": 1},
+    "t24": {"description": "Send a quick thank-you to someone.", "difficulty": 1},
+    "t25": {"description": "Jot down one positive thought.", "difficulty": 1},
+    "t26": {"description": "Do a 2-minute breathing exercise.", "difficulty": 1},
+    "t27": {"description": "Celebrate one small win today.", "difficulty": 2},
+    "t28": {"description": "Try a brief mindfulness exercise.", "difficulty": 2},
+    "t29": {"description": "Doodle something fun.", "difficulty": 2},
+    "t30": {"description": "Reach out with a kind word to a friend.", "difficulty": 1}
+}
+# Catalog (description, points) -> id, for converting copies to ids.
+_catalog_ids = {(task["description"], task["difficulty"]): task_id for task_id, task in TASK_CATALOG.items()}
+# Catalog ids, interned so the ids in every record share one string each.
+_interned_ids = {task_id: sys.intern(task_id) for task_id in TASK_CATALOG}
+
+# The stock default tasks, also used for users whose defaults are missing.
+DEFAULT_TASKS = [f"t{n}" for n in range(1, 11)]
+# Offered alongside DEFAULT_TASKS when a new user picks their first ten.
+REGISTRATION_EXTRA_TASKS = [f"t{n}" for n in range(11, 31)]
+
+def normalize_default(task):
+    # Personal defaults are catalog ids. Records from before the catalog may
+    # hold copies: dicts, or (from early registrations) plain strings worth 1 point.
+    if isinstance(task, dict):
+        return task
+    return TASK_CATALOG.get(task) or {"description": task, "difficulty": 1}
+
+def link_catalog(user_info):
+    # Replace copies of catalog tasks in personal_defaults with their ids.
+    # Returns the fields that changed.
+    user_info["catalog_version"] = TASK_CATALOG_VERSION
+    linked = []
+    for task in user_info.get("personal_defaults") or []:
+        task = normalize_default(task)
+        linked.append(_catalog_ids.get((task["description"], task.get("difficulty", 1)), task))
+    if linked:
+        user_info["personal_defaults"] = linked
+        return ["catalog_version", "personal_defaults"]
+    return ["catalog_version"]
+
+def intern_defaults(user_info):
+    # Loaded records get their own copy of every id string; share them instead.
+    defaults = user_info.get("personal_defaults")
+    if defaults:
+        user_info["personal_defaults"] = [_interned_ids.get(task, task) if isinstance(task, str) else task for task in defaults]
+
+def default_task_id(position):
+    # Default tasks are identified by their place in the user's defaults,
+    # which never change after registration.
+    return f"d{position + 1}"
+
+def new_task_id(user_info):
+    # Custom task ids come from a per-user counter and are never reused.
+    number = user_info.get("next_task_id", 1)
+    user_info["next_task_id"] = number + 1
+    return f"c{number}"
+
+###############################################################################
+# --- SQLite Storage (optional) ---
+###############################################################################
+# Enable with "STORAGE": "sqlite" in config.json. The first start imports the
+# existing users.json (and any pending journal) into DATABASE_FILE.
+DATABASE_FILE = "selfcare.db"
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    name TEXT,
+    registered TEXT,
+    points INTEGER NOT NULL DEFAULT 0,
+    weekly_points INTEGER NOT NULL DEFAULT 0,
+    timezone TEXT,
+    paused INTEGER NOT NULL DEFAULT 0,
+    last_journal TEXT,
+    accountability_buddy TEXT,
+    defaults_date TEXT,
+    extra TEXT,
+    revision INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_users_timezone ON users(timezone);
+CREATE INDEX IF NOT EXISTS idx_users_paused ON users(paused, timezone);
+CREATE TABLE IF NOT EXISTS custom_tasks (
+    user_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    type TEXT NOT NULL,
+    added TEXT,
+    deleted TEXT,
+    is_completed INTEGER NOT NULL DEFAULT 0,
+    difficulty INTEGER,
+    completed_on TEXT,
+    task_id TEXT,
+    PRIMARY KEY (user_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_custom_tasks_type ON custom_tasks(user_id, type);
+CREATE INDEX IF NOT EXISTS idx_custom_tasks_deleted ON custom_tasks(user_id, deleted);
+-- Rows with a catalog_id refer to TASK_CATALOG and leave description empty.
+CREATE TABLE IF NOT EXISTS personal_defaults (
+    user_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    difficulty INTEGER NOT NULL DEFAULT 1,
+    catalog_id TEXT,
+    PRIMARY KEY (user_id, position)
+);
+-- `description` holds the completed default's task id (see default_task_id());
+-- rows written before task ids existed hold its description.
+CREATE TABLE IF NOT EXISTS completions (
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    description TEXT NOT NULL,
+    PRIMARY KEY (user_id, date, description)
+);
+-- Shared databases only: the latest write of each user, in commit order, so
+-- other processes can pick up what changed since they last looked.
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL UNIQUE
+);
+"""
+
+# Record fields stored as plain columns of the users table.
+USER_COLUMNS = ("name", "registered", "points", "weekly_points", "timezone", "paused", "last_journal", "accountability_buddy")
+# Record fields stored in their own tables; anything else goes into users.extra.
+TABLE_FIELDS = ("tasks", "personal_defaults", "daily_defaults")
+
+class SqliteStorage:
+    """Indexed SQLite tables for users, custom tasks, defaults and completions.
+
+    Users are loaded on first access with primary-key lookups instead of at
+    startup, and schedulable_users() answers the reminder loops from the
+    (paused, timezone) index. Writes take the same journal lines as
+    JournalStorage and apply them in one transaction per flush, on the
+    writer thread's own connection.
+
+    Every write stamps the user's row with a new random revision. With
+    shared=True (several processes on one database) UserStore compares
+    revisions to notice records another process has changed, and each
+    write is also recorded in the changes table for scan_changes().
+    """
+
+    lazy = True
+
+    def __init__(self, path=DATABASE_FILE, json_path=DATA_FILE, journal_path=JOURNAL_FILE, shared=False):
+        self.path = path
+        self.shared = shared
+        # Reads on the event loop use self.db; writes use a second connection
+        # owned by the writer thread (WAL lets the two work side by side).
+        self.writer_db = None
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SQLITE_SCHEMA)
+        self.upgrade_schema()
+        self.migrate_from_json(json_path, journal_path)
+
+    def upgrade_schema(self):
+        # Columns added after the first release of the schema.
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(custom_tasks)")}
+        if "completed_on" not in columns:
+            self.db.execute("ALTER TABLE custom_tasks ADD COLUMN completed_on TEXT")
+        if "task_id" not in columns:
+            self.db.execute("ALTER TABLE custom_tasks ADD COLUMN task_id TEXT")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(users)")}
+        if "revision" not in columns:
+            self.db.execute("ALTER TABLE users ADD COLUMN revision INTEGER")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(personal_defaults)")}
+        if "catalog_id" not in columns:
+            self.db.execute("ALTER TABLE personal_defaults ADD COLUMN catalog_id TEXT")
+
+    def migrate_from_json(self, json_path, journal_path):
+        if self.db.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone():
+            return
+        users = JournalStorage(json_path, journal_path).load()
+        with self.db:
+            for user_id, record in users.items():
+                self._insert_user(self.db, user_id, record)
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('migrated_from', ?)", (json_path,))
+        print(f"Imported {len(users)} users from {json_path} into {self.path}.")
+
+    def load(self):
+        return {}
+
+    def load_user(self, user_id):
+        row = self.db.execute(
+            "SELECT name, registered, points, weekly_points, timezone, paused, last_journal, "
+            "accountability_buddy, defaults_date, extra FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        record = json.loads(row[9]) if row[9] else {}
+        for column, value in zip(USER_COLUMNS, row):
+            if column == "paused":
+                value = bool(value)
+            if value is not None or column in ("timezone", "last_journal"):
+                record[column] = value
+        record["tasks"] = []
+        for task_id, description, task_type, added, deleted, is_completed, difficulty, completed_on in self.db.execute(
+            "SELECT task_id, description, type, added, deleted, is_completed, difficulty, completed_on "
+            "FROM custom_tasks WHERE user_id = ? ORDER BY position", (user_id,)
+        ):
+            task = {"description": description, "type": task_type, "added": added, "deleted": deleted,
+                    "difficulty": difficulty, "completed_on": completed_on}
+            if task_id is not None:
+                task["id"] = task_id
+            if is_completed:
+                # Rows imported before completions were date-stamped.
+                task["is_completed"] = True
+            record["tasks"].append(task)
+        record["personal_defaults"] = [
+            catalog_id or {"description": description, "difficulty": difficulty}
+            for catalog_id, description, difficulty in self.db.execute(
+                "SELECT catalog_id, description, difficulty FROM personal_defaults WHERE user_id = ? ORDER BY position", (user_id,)
+            )
+        ]
+        if row[8] is not None:
+            record["daily_defaults"] = {
+                "date": row[8],
+                "completed": [description for (description,) in self.db.execute(
+                    "SELECT description FROM completions WHERE user_id = ? AND date = ? ORDER BY rowid", (user_id, row[8])
+                )]
+            }
+        return record
+
+    def user_ids(self):
+        return [user_id for (user_id,) in self.db.execute("SELECT user_id FROM users")]
+
+    def point_balances(self):
+        # (user id, record with just the fields the points ledger opens from).
+        rows = self.db.execute("SELECT user_id, points, weekly_points, registered, timezone, extra FROM users")
+        for user_id, points, weekly_points, registered, timezone, extra in rows:
+            record = {"points": points, "weekly_points": weekly_points, "registered": registered, "timezone": timezone}
+            record["points_week"] = json.loads(extra).get("points_week") if extra else None
+            if record["points_week"] is None:
+                # Not upgraded yet; see upgrade_record().
+                record["points_week"] = week_start(user_today(record)).isoformat()
+            yield user_id, record
+
+    def buddy_links(self):
+        # (user id, record with the fields last_activity() reads) for users with a buddy.
+        rows = self.db.execute("SELECT user_id, registered, extra FROM users WHERE accountability_buddy IS NOT NULL")
+        for user_id, registered, extra in rows:
+            extra = json.loads(extra) if extra else {}
+            yield user_id, {"registered": registered, "last_completed": extra.get("last_completed"), "buddy_since": extra.get("buddy_since")}
+
+    def revision(self, user_id):
+        row = self.db.execute("SELECT revision FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def data_version(self):
+        # Changes whenever another connection (or process) commits.
+        return self.db.execute("PRAGMA data_version").fetchone()[0]
+
+    def schedulable_users(self):
+        # (user id, time zone) for everyone who should receive reminders.
+        return self.db.execute(
+            "SELECT user_id, timezone FROM users WHERE paused = 0 AND timezone IS NOT NULL"
+        ).fetchall()
+
+    def last_change(self):
+        return self.db.execute("SELECT MAX(seq) FROM changes").fetchone()[0] or 0
+
+    def scan_changes(self, since):
+        # (last change seen, [(user id, time zone, paused)]) for users written
+        # after change `since`; a removed user comes back without a zone. Reads
+        # the seq index only, on a short-lived connection so it can run in an
+        # executor thread.
+        db = sqlite3.connect(self.path)
+        try:
+            rows = db.execute(
+                "SELECT changes.seq, changes.user_id, users.timezone, users.paused FROM changes "
+                "LEFT JOIN users ON users.user_id = changes.user_id WHERE changes.seq > ? ORDER BY changes.seq", (since,)
+            ).fetchall()
+        finally:
+            db.close()
+        if rows:
+            since = rows[-1][0]
+        return since, [(user_id, timezone, paused) for _, user_id, timezone, paused in rows]
+
+    def tombstoned_users(self, before):
+        # Ids of users with custom tasks removed before `before` (ISO time).
+        return [user_id for (user_id,) in self.db.execute(
+            "SELECT DISTINCT user_id FROM custom_tasks WHERE deleted IS NOT NULL AND deleted < ?", (before,)
+        )]
+
+    def write(self, lines):
+        # Returns user id -> new revision (None for removed users).
+        if self.writer_db is None:
+            self.writer_db = sqlite3.connect(self.path)
+            self.writer_db.execute("PRAGMA synchronous=NORMAL")
+        db = self.writer_db
+        revisions = {}
+        with db:
+            for line in lines:
+                entry = json.loads(line)
+                user_id = entry["user"]
+                if self.shared:
+                    # Replacing the row gives it the next seq.
+                    db.execute("INSERT OR REPLACE INTO changes (user_id) VALUES (?)", (user_id,))
+                if entry["op"] == "del":
+                    self._delete_user(db, user_id)
+                    revisions[user_id] = None
+                    continue
+                if entry["op"] == "put":
+                    self._delete_user(db, user_id)
+                    self._insert_user(db, user_id, entry["record"])
+                else:
+                    self._update_user(db, user_id, entry["fields"])
+                revisions[user_id] = random.getrandbits(62)
+                db.execute("UPDATE users SET revision = ? WHERE user_id = ?", (revisions[user_id], user_id))
+        return revisions
+
+    def journaled(self, count):
+        return False
+
+    def compact(self, encoded):
+        pass
+
+    def _delete_user(self, db, user_id):
+        for table in ("users", "custom_tasks", "personal_defaults", "completions"):
+            db.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+
+    def _insert_user(self, db, user_id, record):
+        extra = {k: v for k, v in record.items() if k not in USER_COLUMNS and k not in TABLE_FIELDS}
+        db.execute(
+            "INSERT INTO users (user_id, name, registered, points, weekly_points, timezone, paused, "
+            "last_journal, accountability_buddy, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, record.get("name"), record.get("registered"), record.get("points", 0),
+             record.get("weekly_points", 0), record.get("timezone"), int(bool(record.get("paused"))),
+             record.get("last_journal"), record.get("accountability_buddy"), json.dumps(extra) if extra else None)
+        )
+        self._update_user(db, user_id, {field: record[field] for field in TABLE_FIELDS if field in record})
+
+    def _update_user(self, db, user_id, fields):
+        extra = {}
+        for field, value in fields.items():
+            if field in USER_COLUMNS:
+                if field == "paused":
+                    value = int(bool(value))
+                db.execute(f"UPDATE users SET {field} = ? WHERE user_id = ?", (value, user_id))
+            elif field == "tasks":
+                db.execute("DELETE FROM custom_tasks WHERE user_id = ?", (user_id,))
+                db.executemany(
+                    "INSERT INTO custom_tasks (user_id, position, description, type, added, deleted, is_completed, difficulty, completed_on, task_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(user_id, i, t["description"], t["type"], t.get("added"), t.get("deleted"),
+                      int(bool(t.get("is_completed"))), t.get("difficulty", 2), t.get("completed_on"), t.get("id"))
+                     for i, t in enumerate(value)]
+                )
+            elif field == "personal_defaults":
+                db.execute("DELETE FROM personal_defaults WHERE user_id = ?", (user_id,))
+                rows = []
+                for i, task in enumerate(value):
+                    if isinstance(task, str) and task in TASK_CATALOG:
+                        rows.append((user_id, i, "", 0, task))
+                    else:
+                        task = normalize_default(task)
+                        rows.append((user_id, i, task["description"], task.get("difficulty", 1), None))
+                db.executemany(
+                    "INSERT INTO personal_defaults (user_id, position, description, difficulty, catalog_id) VALUES (?, ?, ?, ?, ?)", rows
+                )
+            elif field == "daily_defaults":
+                # Completions are kept as dated events; older days stay as history.
+                db.execute("UPDATE users SET defaults_date = ? WHERE user_id = ?", (value["date"], user_id))
+                db.execute("DELETE FROM completions WHERE user_id = ? AND date = ?", (user_id, value["date"]))
+                db.executemany(
+                    "INSERT OR IGNORE INTO completions (user_id, date, description) VALUES (?, ?, ?)",
+                    [(user_id, value["date"], task_id) for task_id in value.get("completed", [])]
+                )
+            else:
+                extra[field] = value
+        if extra:
+            row = db.execute("SELECT extra FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return
+            merged = json.loads(row[0]) if row[0] else {}
+            set_fields(merged, extra)
+            db.execute("UPDATE users SET extra = ? WHERE user_id = ?", (json.dumps(merged), user_id))
+
+###############################################################################
+# --- Snapshot Storage (optional) ---
+###############################################################################
+# "STORAGE": "snapshot" keeps the users in one binary file that is memory-mapped
+# instead of parsed, so startup does not depend on how many users there are:
+#
+#   header     magic, format version, user count, offset of the index
+#   records    compact JSON of each record, in user id order
+#   index      user ids (u64), record offsets (u64, one extra for the end),
+#              time zone numbers (u16) and flags (u8), little-endian
+#   zone names JSON list the time zone numbers refer to
+#
+# The time zone (NO_ZONE when paused or unset) and flags answer the reminder
+# scheduler, buddy watch and tombstone purge without decoding records.
+SNAPSHOT_FILE = "users.snap"
+SNAPSHOT_JOURNAL_FILE = "users.snap.journal"
+SNAPSHOT_MAGIC = b"SSKSNAP\0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<8sI4xQQ")
+NO_ZONE = 0xFFFF
+SNAPSHOT_BUDDY = 1
+SNAPSHOT_TOMBSTONES = 2
+
+def snapshot_summary(record):
+    # (time zone for reminders or None, flags) stored in the index.
+    tz_name = record.get("timezone") if not record.get("paused") else None
+    flags = 0
+    if record.get("accountability_buddy"):
+        flags |= SNAPSHOT_BUDDY
+    if any(task.get("deleted") is not None for task in record.get("tasks", [])):
+        flags |= SNAPSHOT_TOMBSTONES
+    return tz_name or None, flags
+
+def write_snapshot(path, entries):
+    """Write a snapshot file from (user id as int, JSON bytes, time zone or
+    None, flags) tuples sorted by user id."""
+    ids, offsets, zones, flags = array("Q"), array("Q"), array("H"), array("B")
+    zone_numbers = {}
+    with open(path, "wb") as f:
+        f.write(bytes(SNAPSHOT_HEADER.size))
+        position = SNAPSHOT_HEADER.size
+        for user_id, text, tz_name, user_flags in entries:
+            ids.append(user_id)
+            offsets.append(position)
+            if tz_name is None:
+                zones.append(NO_ZONE)
+            else:
+                zones.append(zone_numbers.setdefault(tz_name, len(zone_numbers)))
+            flags.append(user_flags)
+            f.write(text)
+            position += len(text)
+        if len(zone_numbers) >= NO_ZONE:
+            raise RuntimeError("Too many time zones for a snapshot.")
+        offsets.append(position)
+        # Align the index so its columns can be read in place.
+        f.write(bytes(-position % 8))
+        index_offset = position + -position % 8
+        for column in (ids, offsets, zones, flags):
+            if sys.byteorder == "big":
+                column.byteswap()
+            column.tofile(f)
+        f.write(encode(list(zone_numbers)).encode())
+        size = f.tell()
+        f.seek(0)
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(ids), index_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    metrics.inc("ssk_storage_write_bytes_total", size, file=os.path.basename(path))
+
+class SnapshotFile:
+    """A snapshot opened with mmap. Lookups binary-search the id column in
+    place; a record is only decoded when it is asked for."""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, index_offset = SNAPSHOT_HEADER.unpack_from(self.map)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self.close()
+            raise RuntimeError(f"{path} is not a version {SNAPSHOT_VERSION} snapshot.")
+        self.count = count
+        self.view = memoryview(self.map)
+        position = index_offset
+        columns = []
+        for fmt, size, length in (("Q", 8, count), ("Q", 8, count + 1), ("H", 2, count), ("B", 1, count)):
+            columns.append(self.column(position, position + size * length, fmt))
+            position += size * length
+        self.ids, self.offsets, self.zones, self.flags = columns
+        self.zone_names = json.loads(bytes(self.view[position:]))
+
+    def column(self, start, end, fmt):
+        column = self.view[start:end].cast(fmt)
+        if sys.byteorder == "big":
+            # Stored little-endian; swap a copy.
+            column = array(fmt, column.tobytes())
+            column.byteswap()
+        return column
+
+    def find(self, user_id):
+        # Position of the user in the index, or None.
+        key = int(user_id)
+        position = bisect_left(self.ids, key)
+        if position < self.count and self.ids[position] == key:
+            return position
+        return None
+
+    def raw(self, position):
+        return self.map[self.offsets[position]:self.offsets[position + 1]]
+
+    def get(self, user_id):
+        # JSON bytes of the record, or None.
+        position = self.find(user_id)
+        return None if position is None else self.raw(position)
+
+    def zone(self, position):
+        zone = self.zones[position]
+        return None if zone == NO_ZONE else self.zone_names[zone]
+
+    def close(self):
+        # Views into the map must be released before it can be closed.
+        for column in (getattr(self, name, None) for name in ("ids", "offsets", "zones", "flags", "view")):
+            if isinstance(column, memoryview):
+                column.release()
+        self.map.close()
+        self.file.close()
+
+class SnapshotStorage(JournalStorage):
+    """Memory-mapped snapshot plus the same journal as JournalStorage.
+
+    Users are decoded on first access, like SqliteStorage. Journaled changes
+    are kept as encoded records in `overlay` (user id -> JSON text, None
+    once removed), which takes precedence over the snapshot. compact() writes
+    a new snapshot on the writer thread, copying unchanged records without
+    decoding them. `lock` guards overlay and the open snapshot, which the
+    event loop reads while the writer thread changes them.
+
+    On the first start the snapshot is imported from users.json and its
+    journal; see export_json() for the way back.
+    """
+
+    lazy = True
+
+    def __init__(self, path=SNAPSHOT_FILE, journal_path=SNAPSHOT_JOURNAL_FILE, json_path=DATA_FILE, json_journal_path=JOURNAL_FILE, compact_every=COMPACT_EVERY):
+        super().__init__(path, journal_path, compact_every)
+        self.lock = threading.Lock()
+        self.overlay = {}
+        self.snapshot = None
+        if os.path.exists(path):
+            self.snapshot = SnapshotFile(path)
+        else:
+            self.import_json(json_path, json_journal_path)
+
+    def import_json(self, json_path, json_journal_path):
+        users = JournalStorage(json_path, json_journal_path).load()
+        entries = []
+        for user_id in sorted(users, key=int):
+            record = users[user_id]
+            entries.append((int(user_id), encode(record).encode(), *snapshot_summary(record)))
+        self.replace(entries)
+        print(f"Imported {len(users)} users from {json_path} into {self.data_path}.")
+
+    def replace(self, entries):
+        # Write a new snapshot from `entries` (see write_snapshot) and swap it
+        # in; it must contain every change in the overlay.
+        tmp_path = f"{self.data_path}.tmp"
+        write_snapshot(tmp_path, entries)
+        with self.lock:
+            if self.snapshot is not None:
+                # Windows cannot replace a file that is still mapped.
+                self.snapshot.close()
+            os.replace(tmp_path, self.data_path)
+            fsync_directory(self.data_path)
+            self.snapshot = SnapshotFile(self.data_path)
+            self.overlay.clear()
+
+    def load(self):
+        replayed = self.replay(self.apply)
+        if replayed:
+            print(f"Recovered {replayed} journal entries from {self.journal_path}.")
+        return {}
+
+    def apply(self, entry):
+        user_id = entry["user"]
+        if entry["op"] == "del":
+            text = None
+        elif entry["op"] == "put":
+            text = encode(entry["record"])
+        else:
+            record = self.load_user(user_id)
+            if record is None:
+                return
+            set_fields(record, entry["fields"])
+            text = encode(record)
+        with self.lock:
+            self.overlay[user_id] = text
+
+    def load_user(self, user_id):
+        with self.lock:
+            if user_id in self.overlay:
+                text = self.overlay[user_id]
+            else:
+                text = self.snapshot.get(user_id)
+        return None if text is None else json.loads(text)
+
+    def records(self, flag=None):
+        # Decoded (user id, record) pairs: from the snapshot, those whose
+        # flags include `flag` (all if None), plus every changed user.
+        with self.lock:
+            snapshot = self.snapshot
+            overlay = dict(self.overlay)
+            texts = [
+                (str(snapshot.ids[position]), snapshot.raw(position))
+                for position in range(snapshot.count) if flag is None or snapshot.flags[position] & flag
+            ]
+        texts = [(user_id, text) for user_id, text in texts if user_id not in overlay]
+        texts += [(user_id, text) for user_id, text in overlay.items() if text is not None]
+        return [(user_id, json.loads(text)) for user_id, text in texts]
+
+    def user_ids(self):
+        with self.lock:
+            stored = [str(user_id) for user_id in self.snapshot.ids]
+            overlay = dict(self.overlay)
+        return [user_id for user_id in stored if user_id not in overlay] + [user_id for user_id, text in overlay.items() if text is not None]
+
+    def schedulable_users(self):
+        with self.lock:
+            snapshot = self.snapshot
+            overlay = dict(self.overlay)
+            names = snapshot.zone_names
+            stored = [(str(user_id), names[zone]) for user_id, zone in zip(snapshot.ids, snapshot.zones) if zone != NO_ZONE]
+        result = [(user_id, tz_name) for user_id, tz_name in stored if user_id not in overlay]
+        for user_id, text in overlay.items():
+            if text is not None:
+                tz_name = snapshot_summary(json.loads(text))[0]
+                if tz_name:
+                    result.append((user_id, tz_name))
+        return result
+
+    def buddy_links(self):
+        return [(user_id, record) for user_id, record in self.records(SNAPSHOT_BUDDY) if record.get("accountability_buddy")]
+
+    def tombstoned_users(self, before):
+        return [
+            user_id for user_id, record in self.records(SNAPSHOT_TOMBSTONES)
+            if any(task["deleted"] is not None and task["deleted"] < before for task in record.get("tasks", []))
+        ]
+
+    def point_balances(self):
+        # Only read to open a new points ledger, so decoding everyone is fine;
+        # a generator, so nothing is decoded when the ledger already exists.
+        for user_id, record in self.records():
+            if record.get("points_week") is None:
+                # Not upgraded yet; see upgrade_record().
+                record["points_week"] = week_start(user_today(record)).isoformat()
+            yield user_id, record
+
+    def write(self, lines):
+        super().write(lines)
+        for line in lines:
+            self.apply(json.loads(line))
+
+    def compact(self, encoded=None):
+        # `encoded` is only kept for storages that load every user. write()
+        # runs on this same thread, so the overlay cannot change meanwhile.
+        snapshot = self.snapshot
+        overlay = dict(self.overlay)
+
+        def unchanged():
+            for position in range(snapshot.count):
+                user_id = snapshot.ids[position]
+                if str(user_id) not in overlay:
+                    yield user_id, snapshot.raw(position), snapshot.zone(position), snapshot.flags[position]
+
+        def changed():
+            for user_id in sorted(overlay, key=int):
+                text = overlay[user_id]
+                if text is not None:
+                    yield (int(user_id), text.encode(), *snapshot_summary(json.loads(text)))
+
+        self.replace(heapq.merge(unchanged(), changed(), key=lambda entry: entry[0]))
+        # The snapshot now contains every journaled change.
+        with open(self.journal_path, "w") as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+###############################################################################
+# --- Process Partitioning ---
+###############################################################################
+# The bot can run as several processes on one SQLite database:
+#
+#     "PROCESS_COUNT": 3, "PROCESS_INDEX": 0   (a different index per process)
+#
+# Process 0 connects to the gateway (with every shard, see SHARD_COUNT) and
+# handles all commands; the others only log in over REST. Each process sends
+# the scheduled messages of the users it owns. The gateway is not split across
+# processes because Discord delivers every DM to shard 0, and the
+# conversations started by /register, /remove, /journal etc. wait for DMs.
+PROCESS_COUNT = config.get("PROCESS_COUNT", 1)
+PROCESS_INDEX = config.get("PROCESS_INDEX", 0)
+if not 0 <= PROCESS_INDEX < PROCESS_COUNT:
+    raise RuntimeError(f"PROCESS_INDEX must be between 0 and {PROCESS_COUNT - 1}.")
+if PROCESS_COUNT > 1 and config.get("STORAGE", "json") != "sqlite":
+    raise RuntimeError('Running several processes needs "STORAGE": "sqlite" so they share one database.')
+
+def owns_user(user_id):
+    return int(user_id) % PROCESS_COUNT == PROCESS_INDEX
+
+def process_file(path):
+    # Files written by a single process get its index in the name.
+    if PROCESS_COUNT == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{PROCESS_INDEX}{ext}"
+
+def open_storage():
+    if config.get("STORAGE", "json") == "sqlite":
+        return SqliteStorage(config.get("DATABASE_FILE", DATABASE_FILE), shared=PROCESS_COUNT > 1)
+    if config.get("STORAGE", "json") == "snapshot":
+        return SnapshotStorage()
+    return JournalStorage()
+
+###############################################################################
+# --- Local Dates ---
+###############################################################################
+# Resolved pytz time zones, so each zone is only constructed once.
+_timezones = {}
+
+def get_timezone(tz_name):
+    tz = _timezones.get(tz_name)
+    if tz is None:
+        tz = _timezones[tz_name] = pytz.timezone(tz_name)
+    return tz
+
+def user_today(user_info):
+    # Completions are judged against the user's local date. Users without a
+    # (valid) time zone use UTC.
+    tz_name = user_info.get("timezone")
+    if tz_name:
         try:
-            with open(DATA_FILE, "r") as f:
-                return json.load(f)
-        except json.decoder.JSONDecodeError:
-            # File is empty or invalid JSON; return empty dict.
-            return {}
-    return {}
+            return datetime.now(get_timezone(tz_name)).date()
+        except pytz.UnknownTimeZoneError:
+            pass
+    return datetime.utcnow().date()
+
+def week_start(day):
+    # Weekly tasks run from Friday to Thursday, matching the Friday summary.
+    return day - timedelta(days=(day.weekday() - 4) % 7)
+
+def task_completed(task, today):
+    # Custom tasks carry the local date they were last completed on, so a
+    # completion simply stops counting once its day (or week) is over.
+    stamp = task.get("completed_on")
+    if stamp is None:
+        return False
+    if task["type"] == "weekly":
+        return stamp >= week_start(today).isoformat()
+    return stamp == today.isoformat()
+
+def upgrade_record(user_info):
+    # Bring a record written by an older version of the bot up to date.
+    # Returns the fields that changed and need to be written back.
+    changed = []
+    for task in user_info.get("tasks", []):
+        if "is_completed" in task:
+            # Completion used to be a flag cleared by a nightly sweep; keep
+            # credit for anything flagged by stamping it with today's date.
+            if task.pop("is_completed") and task.get("completed_on") is None:
+                task["completed_on"] = user_today(user_info).isoformat()
+            task.setdefault("completed_on", None)
+            if "tasks" not in changed:
+                changed.append("tasks")
+    if "points_week" not in user_info:
+        # weekly_points used to be zeroed by the Friday summary; count what
+        # it holds towards the current week.
+        user_info["points_week"] = week_start(user_today(user_info)).isoformat()
+        user_info.setdefault("weekly_points", 0)
+        changed += ["points_week", "weekly_points"]
+    if user_info.get("catalog_version", 0) < TASK_CATALOG_VERSION:
+        changed += link_catalog(user_info)
+    if "next_task_id" not in user_info:
+        changed += assign_task_ids(user_info)
+    intern_defaults(user_info)
+    return changed
+
+def assign_task_ids(user_info):
+    # Tasks used to be told apart by description (defaults) or by the time
+    # they were added (custom tasks). Give every custom task an id and switch
+    # default completions and per-task stats over to ids.
+    default_ids = {}
+    for position, task in enumerate(user_info.get("personal_defaults") or DEFAULT_TASKS):
+        default_ids.setdefault(normalize_default(task)["description"], default_task_id(position))
+    stat_ids = {f"default:{description}": task_id for description, task_id in default_ids.items()}
+    for task in user_info.get("tasks", []):
+        task["id"] = new_task_id(user_info)
+        stat_ids[f"custom:{task.get('added')}"] = task["id"]
+    changed = ["tasks", "next_task_id"]
+    daily_defaults = user_info.get("daily_defaults")
+    if daily_defaults and daily_defaults.get("completed"):
+        daily_defaults["completed"] = [default_ids[d] for d in daily_defaults["completed"] if d in default_ids]
+        changed.append("daily_defaults")
+    task_stats = user_info.get("stats", {}).get("tasks")
+    if task_stats:
+        user_info["stats"]["tasks"] = {stat_ids[key]: track for key, track in task_stats.items() if key in stat_ids}
+        changed.append("stats")
+    return changed
+
+###############################################################################
+# --- Time Zone Search ---
+###############################################################################
+# /settimezone autocompletes over every zone pytz knows, and registration
+# accepts a typed city. Zones are indexed by the prefixes of the words in
+# their names ("america", "new", "york"), their friendly names and a few
+# abbreviations; a UTC offset ("utc+5:30", "-8") is looked up in a table of
+# the zones' offsets today. Results are cached per query, so most keystrokes
+# cost one dict lookup.
+AUTOCOMPLETE_LIMIT = 25  # Discord shows at most 25 suggestions (and menu options).
+TIMEZONE_SEARCH_CACHE = 2048
+
+# (label, zone) offered in the registration menu and before anything is typed.
+POPULAR_TIMEZONES = [
+    ("Eastern Time (US)", "America/New_York"),
+    ("Central Time (US)", "America/Chicago"),
+    ("Mountain Time (US)", "America/Denver"),
+    ("Arizona (US)", "America/Phoenix"),
+    ("Pacific Time (US)", "America/Los_Angeles"),
+    ("Alaska (US)", "America/Anchorage"),
+    ("Hawaii (US)", "Pacific/Honolulu"),
+    ("Atlantic Time (Canada)", "America/Halifax"),
+    ("Mexico City", "America/Mexico_City"),
+    ("São Paulo", "America/Sao_Paulo"),
+    ("Buenos Aires", "America/Argentina/Buenos_Aires"),
+    ("Greenwich Mean Time", "Etc/Greenwich"),
+    ("London", "Europe/London"),
+    ("Paris", "Europe/Paris"),
+    ("Berlin", "Europe/Berlin"),
+    ("Athens", "Europe/Athens"),
+    ("Moscow", "Europe/Moscow"),
+    ("Lagos", "Africa/Lagos"),
+    ("Johannesburg", "Africa/Johannesburg"),
+    ("Dubai", "Asia/Dubai"),
+    ("India", "Asia/Kolkata"),
+    ("Singapore", "Asia/Singapore"),
+    ("Tokyo", "Asia/Tokyo"),
+    ("Sydney", "Australia/Sydney"),
+    ("New Zealand", "Pacific/Auckland"),
+]
+
+# Abbreviations people type; ambiguous ones go to the zone most users mean.
+TIMEZONE_ALIASES = {
+    "est": "America/New_York", "edt": "America/New_York",
+    "cst": "America/Chicago", "cdt": "America/Chicago",
+    "mst": "America/Denver", "mdt": "America/Denver",
+    "pst": "America/Los_Angeles", "pdt": "America/Los_Angeles",
+    "akst": "America/Anchorage", "hst": "Pacific/Honolulu",
+    "gmt": "Etc/Greenwich", "bst": "Europe/London",
+    "cet": "Europe/Paris", "cest": "Europe/Paris", "eet": "Europe/Athens",
+    "msk": "Europe/Moscow", "ist": "Asia/Kolkata", "sgt": "Asia/Singapore",
+    "jst": "Asia/Tokyo", "aest": "Australia/Sydney", "nzst": "Pacific/Auckland",
+    "eastern": "America/New_York", "central": "America/Chicago",
+    "mountain": "America/Denver", "pacific": "America/Los_Angeles",
+}
+
+# Deprecated link names and the zone each points to. Typing a city offers
+# the canonical zone; the links still match, ranked after it.
+TIMEZONE_LINKS = {
+    "US/Alaska": "America/Anchorage", "US/Aleutian": "America/Adak",
+    "US/Arizona": "America/Phoenix", "US/Central": "America/Chicago",
+    "US/East-Indiana": "America/Indiana/Indianapolis", "US/Eastern": "America/New_York",
+    "US/Hawaii": "Pacific/Honolulu", "US/Indiana-Starke": "America/Indiana/Knox",
+    "US/Michigan": "America/Detroit", "US/Mountain": "America/Denver",
+    "US/Pacific": "America/Los_Angeles", "US/Samoa": "Pacific/Pago_Pago",
+    "Canada/Atlantic": "America/Halifax", "Canada/Central": "America/Winnipeg",
+    "Canada/Eastern": "America/Toronto", "Canada/Mountain": "America/Edmonton",
+    "Canada/Newfoundland": "America/St_Johns", "Canada/Pacific": "America/Vancouver",
+    "Canada/Saskatchewan": "America/Regina", "Canada/Yukon": "America/Whitehorse",
+}
+
+def fold(text):
+    # Lower case without accents or separators: "São_Paulo" -> "sao paulo".
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    for separator in "/_-(),.":
+        text = text.replace(separator, " ")
+    return text
+
+def parse_utc_offset(word):
+    # Minutes east of UTC for "utc+5", "gmt-3:30", "+0530" etc., else None.
+    match = re.fullmatch(r"(?:utc|gmt)?([+-])(\d{1,2})(?::?(\d{2}))?", word)
+    if match is None:
+        return None
+    minutes = int(match[2]) * 60 + int(match[3] or 0)
+    return minutes if match[1] == "+" else -minutes
+
+def utc_offset_label(tz_name):
+    offset = datetime.now(get_timezone(tz_name)).strftime("%z")
+    return f"UTC{offset[:3]}:{offset[3:]}"
+
+class TimezoneIndex:
+    """Word-prefix index over time zone names.
+
+    Zones are numbered common zones first (then links such as "US/Eastern"
+    and other rarely used names), alphabetically. Results put zones whose city starts with the first word
+    typed first, then the popular zones, then go by number.
+    """
+
+    def __init__(self, names=pytz.all_timezones, common=pytz.common_timezones_set, labels=POPULAR_TIMEZONES,
+                 aliases=TIMEZONE_ALIASES, links=TIMEZONE_LINKS):
+        self.names = sorted(names, key=lambda name: (name not in common or name in links, name))
+        numbers = {name: number for number, name in enumerate(self.names)}
+        self.cities = [fold(name.rsplit("/", 1)[-1]) for name in self.names]
+        # Folded zone name, label or alias -> zone, for exact answers.
+        self.exact = {}
+        self.prefixes = {}  # word prefix -> set of zone numbers
+        for name, number in numbers.items():
+            self.add(fold(name), number)
+            self.exact[" ".join(fold(name).split())] = links.get(name, name)
+        for name, city in zip(self.names, self.cities):
+            # "indianapolis" means the common zone, not its older link. Etc/
+            # zones are left out: "gmt-3" must not mean Etc/GMT-3 (UTC+3).
+            if not name.startswith("Etc/"):
+                self.exact.setdefault(" ".join(city.split()), links.get(name, name))
+        for label, name in labels:
+            self.add(fold(label), numbers[name])
+            self.exact[" ".join(fold(label).split())] = name
+        for alias, name in aliases.items():
+            self.add(alias, numbers[name])
+            self.exact[alias] = name
+        self.popular = [name for _, name in labels]
+        self.popular_numbers = {numbers[name] for name in self.popular}
+        self.offsets = {}  # minutes east of UTC -> set of zone numbers, for offsets_day
+        self.offsets_day = None
+        self.cache = OrderedDict()
+
+    def add(self, text, number):
+        for word in text.split():
+            for end in range(1, len(word) + 1):
+                self.prefixes.setdefault(word[:end], set()).add(number)
+
+    def with_offset(self, minutes):
+        today = datetime.utcnow().date()
+        if self.offsets_day != today:
+            # Offsets move with daylight saving time; rebuilt once a day.
+            now = datetime.now(pytz.utc)
+            self.offsets = {}
+            for number, name in enumerate(self.names):
+                offset = int(now.astimezone(get_timezone(name)).utcoffset().total_seconds()) // 60
+                self.offsets.setdefault(offset, set()).add(number)
+            self.offsets_day = today
+            self.cache.clear()
+        return self.offsets.get(minutes, set())
+
+    def search(self, query, limit=AUTOCOMPLETE_LIMIT):
+        # Zone names matching every word of `query`, best first.
+        text = " ".join(query.lower().split())
+        if not text:
+            return self.popular[:limit]
+        key = (text, limit)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        # Offsets are read before folding, which would split "gmt-3" into
+        # words that match Etc/GMT-3 (UTC+3: POSIX signs are inverted).
+        groups = []
+        first = None
+        for part in text.split():
+            minutes = parse_utc_offset(part)
+            if minutes is not None:
+                groups.append(self.with_offset(minutes))
+                continue
+            for word in fold(part).split():
+                first = first or word
+                groups.append(self.prefixes.get(word, set()))
+        matches = set.intersection(*groups) if groups else set()
+        ranked = sorted(matches, key=lambda number: (
+            first is None or not self.cities[number].startswith(first), number not in self.popular_numbers, number))
+        results = [self.names[number] for number in ranked[:limit]]
+        exact = self.exact.get(" ".join(fold(text).split()))
+        if exact is not None:
+            results = [exact] + [name for name in results if name != exact][:limit - 1]
+        self.cache[key] = results
+        if len(self.cache) > TIMEZONE_SEARCH_CACHE:
+            self.cache.popitem(last=False)
+        return results
+
+    def resolve(self, text):
+        # The zone `text` names: an exact name, label or alias, or the only match.
+        exact = self.exact.get(" ".join(fold(text).split()))
+        if exact is not None:
+            return exact
+        results = self.search(text, limit=2)
+        return results[0] if len(results) == 1 else None
+
+timezone_index = TimezoneIndex()
+
+###############################################################################
+# --- Resident User Store ---
+###############################################################################
+# Seconds to wait after the first change before writing dirty users to disk.
+# Every change made inside this window is folded into the same write.
+FLUSH_DELAY = 5
+# Record fields a user's checklist is built from.
+CHECKLIST_FIELDS = {"tasks", "personal_defaults", "daily_defaults"}
+
+class UserTransaction:
+    """One user's record inside UserStore.transaction().
+
+    `user` is the current record (None if the user is not registered).
+    Mutate it in place and name the changed fields with changed(); they are
+    marked dirty when the transaction ends.
+    """
+
+    __slots__ = ("store", "user_id", "user", "fields")
+
+    def __init__(self, store, user_id):
+        self.store = store
+        self.user_id = user_id
+        self.user = store.get(user_id)
+        self.fields = set()
+
+    def changed(self, *fields):
+        self.fields.update(fields)
+
+    def put(self, record):
+        self.user = record
+        self.store.put(self.user_id, record)
+
+    def remove(self):
+        self.user = None
+        self.store.remove(self.user_id)
+
+    def commit(self):
+        if self.fields and self.user is not None:
+            self.store.mark_dirty(self.user_id, *self.fields)
+
+class UserStore:
+    """Keeps registered users in memory and writes changes behind.
+
+    With JournalStorage every user is read once at startup; with a lazy
+    storage (SQLite) users are read on first access. Commands mark the users
+    (and, where known, the fields) they change as dirty and a single flush,
+    scheduled FLUSH_DELAY seconds after the first change, writes all of them
+    together. The flush only encodes the changes on the event loop; the
+    storage writes them on the background writer thread.
+
+    On a shared storage a resident record is checked against the stored
+    revision whenever the database has changed since the last check, and
+    reloaded if another process wrote it.
+    """
+
+    def __init__(self, storage=None, flush_delay=FLUSH_DELAY):
+        self.storage = storage or JournalStorage()
+        self.flush_delay = flush_delay
+        # user id -> record, or None for a removal that has not been flushed yet.
+        self.users = self.storage.load()
+        # user id -> set of changed fields, or None when the whole record changed.
+        self.dirty = {}
+        # user id -> number of flushed writes the writer thread has not finished.
+        self.in_flight = {}
+        for user_id, record in self.users.items():
+            if upgrade_record(record):
+                # Written out with the first flush.
+                self.dirty[user_id] = None
+        # user id -> JSON text of the record as last flushed, for compaction.
+        # Only needed when the whole data set is resident.
+        self.encoded = {}
+        if not self.storage.lazy:
+            self.encoded = {user_id: encode(record) for user_id, record in self.users.items()}
+        # user id -> counter bumped whenever the user's checklist may have changed.
+        self.versions = {}
+        # user id -> lock held by an open transaction(); dropped once unused.
+        self.locks = weakref.WeakValueDictionary()
+        # Shared storage only: user id -> stored revision of the resident
+        # record, and the database version it was last checked at.
+        self.revisions = {}
+        self.checked = {}
+        self._flush_handle = None
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def get(self, user_id):
+        if user_id in self.users:
+            if self.storage.shared and user_id not in self.dirty and user_id not in self.in_flight:
+                self.revalidate(user_id)
+            return self.users.get(user_id)
+        if not self.storage.lazy:
+            return None
+        return self.load(user_id)
+
+    def load(self, user_id):
+        if self.storage.shared:
+            self.checked[user_id] = self.storage.data_version()
+            self.revisions[user_id] = self.storage.revision(user_id)
+        started = perf_counter()
+        record = self.storage.load_user(user_id)
+        metrics.observe("ssk_storage_read_seconds", perf_counter() - started, op="load_user")
+        if record is None:
+            self.users.pop(user_id, None)
+            return None
+        self.users[user_id] = record
+        changed = upgrade_record(record)
+        if changed:
+            self.mark_dirty(user_id, *changed)
+        return record
+
+    def revalidate(self, user_id):
+        version = self.storage.data_version()
+        if self.checked.get(user_id) == version:
+            return
+        self.checked[user_id] = version
+        if self.storage.revision(user_id) != self.revisions.get(user_id):
+            # Written by another process since we loaded it.
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+            self.load(user_id)
+
+    def items(self):
+        # Iterate over a copy so commands may register or remove users while a
+        # scheduled loop is awaiting a DM half-way through the scan.
+        if self.storage.lazy:
+            user_ids = set(self.storage.user_ids())
+            user_ids.update(self.users)
+            return [(user_id, record) for user_id, record in ((u, self.get(u)) for u in user_ids) if record is not None]
+        return [(user_id, record) for user_id, record in self.users.items() if record is not None]
+
+    def buddy_links(self):
+        if not self.storage.lazy:
+            return [(user_id, record) for user_id, record in self.users.items() if record and record.get("accountability_buddy")]
+        # Links made since the last flush are not in the database yet.
+        links = dict(self.storage.buddy_links())
+        for user_id in self.dirty:
+            record = self.users.get(user_id)
+            if record and record.get("accountability_buddy"):
+                links[user_id] = record
+        return list(links.items())
+
+    def tombstoned_users(self, before):
+        # Ids of users with custom tasks removed before `before` (ISO time).
+        def tombstoned(record):
+            return any(task["deleted"] is not None and task["deleted"] < before for task in record.get("tasks", []))
+        if not self.storage.lazy:
+            return [user_id for user_id, record in self.users.items() if record and tombstoned(record)]
+        user_ids = set(self.storage.tombstoned_users(before))
+        # Removals since the last flush are not in the database yet.
+        for user_id in self.dirty:
+            record = self.users.get(user_id)
+            if record and tombstoned(record):
+                user_ids.add(user_id)
+        return list(user_ids)
+
+    def point_balances(self):
+        if not self.storage.lazy:
+            return [(user_id, record) for user_id, record in self.users.items() if record is not None]
+        return self.storage.point_balances()
+
+    def schedulable_users(self):
+        # (user id, time zone) for every user who is not paused and has a time zone.
+        if not self.storage.lazy:
+            return [
+                (user_id, record["timezone"]) for user_id, record in self.users.items()
+                if record is not None and record.get("timezone") and not record.get("paused")
+            ]
+        # Unflushed changes are not in the database yet; answer those from memory.
+        unwritten = set(self.dirty)
+        unwritten.update(self.in_flight)
+        result = [(user_id, tz) for user_id, tz in self.storage.schedulable_users() if user_id not in unwritten]
+        for user_id in unwritten:
+            record = self.users.get(user_id)
+            if record is not None and record.get("timezone") and not record.get("paused"):
+                result.append((user_id, record["timezone"]))
+        return result
+
+    @asynccontextmanager
+    async def transaction(self, user_id):
+        # Serialises read-modify-write of one user. The record is read when
+        # the transaction opens, so commands that wait on a reply should open
+        # it after the reply arrives rather than hold a copy while waiting.
+        lock = self.locks.get(user_id)
+        if lock is None:
+            lock = self.locks[user_id] = asyncio.Lock()
+        async with lock:
+            txn = UserTransaction(self, user_id)
+            try:
+                yield txn
+            finally:
+                txn.commit()
+
+    def put(self, user_id, record):
+        self.users[user_id] = record
+        self.mark_dirty(user_id)
+
+    def remove(self, user_id):
+        self.users[user_id] = None
+        self.mark_dirty(user_id)
+
+    def mark_dirty(self, user_id, *fields):
+        if not fields or CHECKLIST_FIELDS.intersection(fields):
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+        if not fields:
+            self.dirty[user_id] = None
+        elif user_id not in self.dirty:
+            self.dirty[user_id] = set(fields)
+        elif self.dirty[user_id] is not None:
+            self.dirty[user_id].update(fields)
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not running inside the bot (e.g. a maintenance script): write now.
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(self.flush_delay, self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self.dirty:
+            return
+        # Encode now: the records keep changing while the writer thread works.
+        started = perf_counter()
+        lines = [encode(journal_entry(self.users, user_id, fields)) + "\n" for user_id, fields in self.dirty.items()]
+        user_ids = list(self.dirty)
+        self.dirty.clear()
+        if not self.storage.lazy:
+            for user_id in user_ids:
+                record = self.users.get(user_id)
+                if record is None:
+                    self.encoded.pop(user_id, None)
+                else:
+                    self.encoded[user_id] = encode(record)
+        for user_id in user_ids:
+            self.in_flight[user_id] = self.in_flight.get(user_id, 0) + 1
+        metrics.observe("ssk_user_flush_encode_seconds", perf_counter() - started)
+        metrics.inc("ssk_user_flush_records_total", len(lines))
+        metrics.inc("ssk_user_flush_bytes_total", sum(map(len, lines)))
+
+        def written(revisions):
+            if revisions:
+                self.revisions.update(revisions)
+            for user_id in user_ids:
+                self.in_flight[user_id] -= 1
+                if self.in_flight[user_id]:
+                    continue
+                del self.in_flight[user_id]
+                if self.users.get(user_id, False) is None and user_id not in self.dirty:
+                    # The removal is on disk now.
+                    del self.users[user_id]
+
+        write_behind(self.storage.write, lines, done=written)
+        if self.storage.journaled(len(lines)):
+            # Queued behind the journal write above, from a copy of the cache.
+            write_behind(self.storage.compact, dict(self.encoded))
+
+# Other processes read what this one writes, so share changes right away.
+user_store = UserStore(open_storage(), flush_delay=0 if PROCESS_COUNT > 1 else FLUSH_DELAY)
+
+def export_json(path=DATA_FILE):
+    # Write every user in the users.json layout, whatever the storage, e.g.
+    # to move back from "snapshot" or "sqlite" to the default storage.
+    users = dict(user_store.items())
+    save_data(users, path)
+    if os.path.abspath(path) == os.path.abspath(DATA_FILE) and os.path.exists(JOURNAL_FILE):
+        # users.json now holds everything; stale entries must not be replayed over it.
+        with open(JOURNAL_FILE, "w") as f:
+            f.flush()
+            os.fsync(f.fileno())
+    print(f"Exported {len(users)} users to {path}.")
+
+###############################################################################
+# --- Points Ledger ---
+###############################################################################
+# Every points change is appended here; the leaderboards and /history are
+# built from it. The user record keeps running totals for /points and the
+# summaries: "points" (all time) and "weekly_points" for the local week that
+# starts on "points_week", plus "last_week_points" for the week before.
+POINTS_LEDGER_FILE = "points.ledger"
+# Record fields award_points() may change.
+POINTS_FIELDS = ("points", "weekly_points", "points_week", "last_week_points")
+# Days of per-day totals and number of recent entries kept in memory per user.
+LEDGER_HISTORY_DAYS = 35
+LEDGER_RECENT = 10
+LEDGER_LOG_DELAY = 1
+
+def roll_week(user_info, today):
+    # Start a new weekly total once the user's local week has moved on.
+    current = week_start(today)
+    week = user_info.get("points_week")
+    if week == current.isoformat():
+        return
+    previous = (current - timedelta(days=7)).isoformat()
+    user_info["last_week_points"] = user_info.get("weekly_points", 0) if week == previous else 0
+    user_info["weekly_points"] = 0
+    user_info["points_week"] = current.isoformat()
+
+def points_this_week(user_info, today):
+    # Read-only: a total from an earlier week simply no longer counts.
+    if user_info.get("points_week") == week_start(today).isoformat():
+        return user_info.get("weekly_points", 0)
+    return 0
+
+def points_last_week(user_info, today):
+    current = week_start(today)
+    week = user_info.get("points_week")
+    if week == current.isoformat():
+        return user_info.get("last_week_points", 0)
+    if week == (current - timedelta(days=7)).isoformat():
+        return user_info.get("weekly_points", 0)
+    return 0
+
+def award_points(user_id, user_info, amount, reason):
+    # The only place points change. Returns the record fields to mark dirty.
+    today = user_today(user_info)
+    roll_week(user_info, today)
+    user_info["points"] = user_info.get("points", 0) + amount
+    user_info["weekly_points"] += amount
+    points_ledger.record(user_id, amount, reason, today)
+    return POINTS_FIELDS
+
+class Leaderboard:
+    """Users ordered by points, highest first, kept in a sorted list.
+
+    An update is two bisects and a list insert/delete, top(n) is a slice and
+    rank() is a single bisect, so no query scans the users.
+    """
+
+    def __init__(self):
+        self.order = []   # (-points, user id)
+        self.scores = {}  # user id -> points
+
+    def add(self, user_id, amount):
+        self.set(user_id, self.scores.get(user_id, 0) + amount)
+
+    def set(self, user_id, score):
+        self.remove(user_id)
+        self.scores[user_id] = score
+        insort(self.order, (-score, user_id))
 
-def save_data(data):
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+    def remove(self, user_id):
+        score = self.scores.pop(user_id, None)
+        if score is not None:
+            del self.order[bisect_left(self.order, (-score, user_id))]
 
-# In-memory daily log for task completions: { user_id: { "completed": [task descriptions], "daily_points": int } }
-daily_log = {}
+    def top(self, n):
+        return [(user_id, -score) for score, user_id in self.order[:n]]
+
+    def rank(self, user_id):
+        # Users with equal points share a rank.
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return bisect_left(self.order, (-score,)) + 1
+
+    def __len__(self):
+        return len(self.order)
+
+class PointsLedger:
+    """Append-only log of points changes, with aggregates kept in memory.
+
+    Each line of POINTS_LEDGER_FILE is
+
+        {"user": "<id>", "amount": 3, "reason": "...", "at": "<UTC time>", "date": "<local date>"}
+
+    or {"user": "<id>", "forget": true} when a user deregisters. The file is
+    rewritten daily (and at a start after a forget) by rewrite(), which drops
+    forgotten users and folds what no view shows any more into one opening
+    entry per user, so it grows with the users, not with every point
+    awarded. Loading builds per-day totals for the last LEDGER_HISTORY_DAYS days, the
+    last LEDGER_RECENT entries per user, an all-time leaderboard and one
+    leaderboard per (local, Friday-based) week.
+    """
+
+    def __init__(self, path=POINTS_LEDGER_FILE):
+        self.path = path
+        self.days = {}      # user id -> {local date: points}
+        self.recent = {}    # user id -> deque of recent entries
+        self.all_time = Leaderboard()
+        self.weeks = {}     # week start -> Leaderboard
+        self.log = BatchedLog(path, LEDGER_LOG_DELAY)
+
+    def load(self, balances):
+        # `balances` is only used to open a new ledger: (user id, record) pairs
+        # whose current totals become the opening entries.
+        if not os.path.exists(self.path):
+            self.open(balances)
+            return
+        last_forget = {}
+        count = 0
+        good_offset = 0
+        horizon = (datetime.utcnow().date() - timedelta(days=LEDGER_HISTORY_DAYS)).isoformat()
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn last line from a crash.
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    break
+                count += 1
+                good_offset += len(line)
+                if entry.get("forget"):
+                    last_forget[entry["user"]] = count
+                    self.drop(entry["user"])
+                else:
+                    self.apply(entry, horizon)
+        if good_offset != os.path.getsize(self.path) and not last_forget:
+            # Cut the damaged tail, or the next append would be glued onto it
+            # and every later entry lost on the following start.
+            print(f"Discarding a damaged tail of {self.path} after {count} entries.")
+            with open(self.path, "r+b") as f:
+                f.truncate(good_offset)
+                f.flush()
+                os.fsync(f.fileno())
+        if last_forget:
+            # The rewrite stops at a damaged tail too.
+            self.rewrite()
+        print(f"Loaded the points ledger: {len(self.all_time)} users.")
+
+    def rewrite(self):
+        # Replace the file with what load() needs to rebuild the same views:
+        # entries within LEDGER_HISTORY_DAYS (which covers this and last
+        # week's leaderboards and /history) and each user's last
+        # LEDGER_RECENT entries. Everything older becomes one opening entry
+        # per user; anything before a user's last forget is dropped.
+        horizon = (datetime.utcnow().date() - timedelta(days=LEDGER_HISTORY_DAYS)).isoformat()
+        entries = []
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entries.append(json.loads(line))
+                except json.decoder.JSONDecodeError:
+                    break
+        last_forget = {entry["user"]: number for number, entry in enumerate(entries) if entry.get("forget")}
+        live = [entry for number, entry in enumerate(entries)
+                if not entry.get("forget") and number > last_forget.get(entry["user"], -1)]
+        remaining = {}  # user id -> live entries not looked at yet
+        for entry in live:
+            remaining[entry["user"]] = remaining.get(entry["user"], 0) + 1
+        opening = {}
+        kept = []
+        for entry in live:
+            user_id = entry["user"]
+            remaining[user_id] -= 1
+            if entry["date"] >= horizon or remaining[user_id] < LEDGER_RECENT:
+                kept.append(entry)
+                continue
+            folded = opening.setdefault(user_id, {"user": user_id, "amount": 0, "reason": "Opening balance"})
+            folded["amount"] += entry["amount"]
+            folded["at"] = entry["at"]
+            folded["date"] = entry["date"]
+        lines = list(opening.values()) + kept
+        write_atomic(self.path, "".join(encode(entry) + "\n" for entry in lines))
+        print(f"Rewrote {self.path}: {len(entries)} entries down to {len(lines)}.")
+
+    def compact(self):
+        # Batched lines go to the writer thread first, so the rewrite queued
+        # behind them reads a complete file.
+        self.log.flush()
+        write_behind(self.rewrite)
+
+    def open(self, balances):
+        now = datetime.utcnow().isoformat()
+        lines = []
+        for user_id, record in balances:
+            today = user_today(record)
+            weekly = points_this_week(record, today)
+            earlier = record.get("points", 0) - weekly
+            if earlier:
+                opened = (record.get("registered") or "")[:10] or (week_start(today) - timedelta(days=1)).isoformat()
+                lines.append({"user": user_id, "amount": earlier, "reason": "Points earned before the ledger", "at": now, "date": opened})
+            if weekly:
+                lines.append({"user": user_id, "amount": weekly, "reason": "Points earned this week before the ledger", "at": now, "date": today.isoformat()})
+        horizon = (datetime.utcnow().date() - timedelta(days=LEDGER_HISTORY_DAYS)).isoformat()
+        for entry in lines:
+            self.apply(entry, horizon)
+        write_atomic(self.path, "".join(encode(entry) + "\n" for entry in lines))
+
+    def apply(self, entry, horizon):
+        # `horizon`: the oldest local date whose totals are kept in memory.
+        user_id = entry["user"]
+        amount = entry["amount"]
+        day = entry["date"]
+        if day >= horizon:
+            days = self.days.setdefault(user_id, {})
+            days[day] = days.get(day, 0) + amount
+            week = week_start(date.fromisoformat(day)).isoformat()
+            board = self.weeks.get(week)
+            if board is None:
+                board = self.weeks[week] = Leaderboard()
+                # Only this and last week are ever shown.
+                for old in [w for w in self.weeks if w < (date.fromisoformat(week) - timedelta(days=14)).isoformat()]:
+                    del self.weeks[old]
+            board.add(user_id, amount)
+        self.recent.setdefault(user_id, deque(maxlen=LEDGER_RECENT)).append(entry)
+        self.all_time.add(user_id, amount)
+
+    def drop(self, user_id):
+        self.days.pop(user_id, None)
+        self.recent.pop(user_id, None)
+        self.all_time.remove(user_id)
+        for board in self.weeks.values():
+            board.remove(user_id)
+
+    def record(self, user_id, amount, reason, today):
+        entry = {"user": user_id, "amount": amount, "reason": reason, "at": datetime.utcnow().isoformat(), "date": today.isoformat()}
+        horizon = (today - timedelta(days=LEDGER_HISTORY_DAYS)).isoformat()
+        self.apply(entry, horizon)
+        days = self.days[user_id]
+        if len(days) > LEDGER_HISTORY_DAYS:
+            for day in [day for day in days if day < horizon]:
+                del days[day]
+        self.log.append(entry)
+
+    def forget(self, user_id):
+        self.drop(user_id)
+        self.log.append({"user": user_id, "forget": True})
+
+    def week_board(self, week):
+        return self.weeks.get(week.isoformat()) or Leaderboard()
+
+points_ledger = PointsLedger()
+if PROCESS_INDEX == 0:
+    # Only the gateway process awards points or answers /leaderboard and /history.
+    points_ledger.load(user_store.point_balances())
+
+###############################################################################
+# --- Habit Statistics ---
+###############################################################################
+# Completions are kept in the record under "stats" as one bitset per task
+# (bit 0 = the last day the task was done, bit k = k days before that), plus
+# one for "any task done that day". Streaks and the best day are updated as
+# completions come in, so /stats never walks through history.
+STATS_DAYS = 400
+STATS_MASK = (1 << STATS_DAYS) - 1
+STATS_WINDOW = 30
+
+def mark_day(track, day):
+    # track: {"end": last day done, "bits": int, "streak": int, "best": int}
+    end = date.fromisoformat(track["end"]) if track.get("end") else None
+    if end is None or day > end:
+        gap = (day - end).days if end is not None else STATS_DAYS
+        track["streak"] = track.get("streak", 0) + 1 if gap == 1 else 1
+        track["best"] = max(track.get("best", 0), track["streak"])
+        track["bits"] = ((track.get("bits", 0) << gap) | 1) & STATS_MASK
+        track["end"] = day.isoformat()
+    elif (end - day).days < STATS_DAYS:
+        # A day before the last one (e.g. after moving time zones west).
+        track["bits"] |= 1 << (end - day).days
+
+def days_done(track, today, window=STATS_WINDOW):
+    # Days within the `window` days ending today on which the task was done.
+    if not track:
+        return 0
+    shift = (today - date.fromisoformat(track["end"])).days
+    if shift >= window:
+        return 0
+    if shift < 0:
+        return bin(track["bits"] >> -shift & ((1 << window) - 1)).count("1")
+    return bin(track["bits"] & ((1 << (window - shift)) - 1)).count("1")
+
+def current_streak(track, today):
+    # A streak survives until the end of the day after it was last extended.
+    if not track or (today - date.fromisoformat(track["end"])).days > 1:
+        return 0
+    return track["streak"]
+
+def record_completion(user_info, entry, today):
+    # Returns the changed parts of "stats" as dotted field names, so only the
+    # task's own track is journaled rather than every bitset in the record.
+    stats = user_info.setdefault("stats", {})
+    mark_day(stats.setdefault("tasks", {}).setdefault(entry.id, {}), today)
+    mark_day(stats.setdefault("days", {}), today)
+    changed = [f"stats.tasks.{entry.id}", "stats.days", "stats.day_count"]
+    day_count = stats.get("day_count")
+    if day_count and day_count["date"] == today.isoformat():
+        day_count["count"] += 1
+    else:
+        day_count = stats["day_count"] = {"date": today.isoformat(), "count": 1}
+    best_day = stats.get("best_day")
+    if best_day is None or day_count["count"] > best_day["count"]:
+        stats["best_day"] = dict(day_count)
+        changed.append("stats.best_day")
+    return changed
+
+def forget_task_stats(user_info, task_id):
+    user_info.get("stats", {}).get("tasks", {}).pop(task_id, None)
+
+###############################################################################
+# --- Checklists ---
+###############################################################################
+CHECKLIST_CACHE_SIZE = 10000
+
+class ChecklistEntry:
+    __slots__ = ("number", "id", "description", "difficulty", "source", "task_type", "task", "label")
+
+    def __init__(self, number, task_id, description, difficulty, source, task_type, task=None):
+        self.number = number
+        self.id = task_id           # "d<n>" for defaults, "c<n>" for custom tasks
+        self.description = description
+        self.difficulty = difficulty
+        self.source = source        # "default" or "custom"
+        self.task_type = task_type  # "daily" or "weekly"
+        self.task = task            # the custom task dict, None for defaults
+        if source == "default":
+            self.label = f"{description} (points: {difficulty})"
+        else:
+            self.label = f"{description} ({task_type.capitalize()}, points: {difficulty})"
+
+class Checklist:
+    """A user's numbered tasks for one day plus the set of completed numbers.
+
+    Defaults come first, then active custom tasks, so the numbers shown by
+    /list, the reminders and the summaries are the numbers /complete takes.
+    """
+
+    __slots__ = ("entries", "by_id", "completed", "date", "version", "defaults_key")
+
+    def __init__(self, user_info, today, version=0):
+        today_str = today.isoformat()
+        self.date = today_str
+        self.version = version
+        self.entries = []
+        self.completed = set()
+        daily_defaults = user_info.get("daily_defaults") or {}
+        done_defaults = set(daily_defaults.get("completed", [])) if daily_defaults.get("date") == today_str else set()
+        for position, task in enumerate(user_info.get("personal_defaults") or DEFAULT_TASKS):
+            task = normalize_default(task)
+            entry = ChecklistEntry(len(self.entries) + 1, default_task_id(position), task["description"], task.get("difficulty", 1), "default", "daily")
+            self.entries.append(entry)
+            if entry.id in done_defaults:
+                self.completed.add(entry.number)
+        # Identifies the default set, so users who picked the same defaults
+        # share rendered fragments (see default_fragment()).
+        self.defaults_key = tuple((entry.description, entry.difficulty) for entry in self.entries)
+        for task in user_info.get("tasks", []):
+            if task["deleted"] is not None:
+                continue
+            entry = ChecklistEntry(len(self.entries) + 1, task["id"], task["description"], task.get("difficulty", 2), "custom", task["type"], task)
+            self.entries.append(entry)
+            if task_completed(task, today):
+                self.completed.add(entry.number)
+        self.by_id = {entry.id: entry for entry in self.entries}
+
+    def entry(self, number):
+        if 1 <= number <= len(self.entries):
+            return self.entries[number - 1]
+        return None
+
+    def find(self, task_id):
+        return self.by_id.get(task_id)
+
+    def is_completed(self, entry):
+        return entry.number in self.completed
+
+    def completed_entries(self):
+        return [entry for entry in self.entries if entry.number in self.completed]
+
+    def pending_entries(self):
+        return [entry for entry in self.entries if entry.number not in self.completed]
+
+    def points_today(self):
+        return sum(entry.difficulty for entry in self.completed_entries())
+
+    def default_entries(self):
+        return self.entries[:len(self.defaults_key)]
+
+    def custom_entries(self):
+        return self.entries[len(self.defaults_key):]
+
+_checklists = OrderedDict()
+
+def get_checklist(user_id, user_info, today=None):
+    # Rebuilt only when the user's tasks, defaults or completions have changed
+    # (see UserStore.versions) or the user's local day has rolled over.
+    today = today or user_today(user_info)
+    version = user_store.versions.get(user_id, 0)
+    checklist = _checklists.get(user_id)
+    if checklist is None or checklist.version != version or checklist.date != today.isoformat():
+        checklist = Checklist(user_info, today, version)
+        _checklists[user_id] = checklist
+        while len(_checklists) > CHECKLIST_CACHE_SIZE:
+            _checklists.popitem(last=False)
+    _checklists.move_to_end(user_id)
+    return checklist
+
+def complete_tasks(user_id, user_info, numbers):
+    # Marks checklist numbers as completed and awards their points.
+    # Returns the response lines and the total points awarded.
+    checklist = get_checklist(user_id, user_info)
+    if "daily_defaults" not in user_info or user_info["daily_defaults"].get("date") != checklist.date:
+        user_info["daily_defaults"] = {"date": checklist.date, "completed": []}
+
+    total_points_awarded = 0
+    messages = []
+    # Only journal the custom task list when a custom task actually changed.
+    changed_fields = ["daily_defaults"]
+    for num in numbers:
+        entry = checklist.entry(num)
+        if entry is None:
+            messages.append(f"Task number {num} is invalid.")
+            continue
+        if checklist.is_completed(entry):
+            messages.append(f"{entry.source.capitalize()} task '{entry.description}' already completed.")
+            continue
+        checklist.completed.add(entry.number)
+        if entry.source == "default":
+            user_info["daily_defaults"]["completed"].append(entry.id)
+        else:
+            entry.task["completed_on"] = checklist.date
+            if "tasks" not in changed_fields:
+                changed_fields.append("tasks")
+        for field in record_completion(user_info, entry, date.fromisoformat(checklist.date)):
+            if field not in changed_fields:
+                changed_fields.append(field)
+        points_awarded = entry.difficulty
+        for field in award_points(user_id, user_info, points_awarded, f"Completed: {entry.description}"):
+            if field not in changed_fields:
+                changed_fields.append(field)
+        total_points_awarded += points_awarded
+        messages.append(f"Marked {entry.source} task '{entry.description}' as completed (+{points_awarded}).")
+    if total_points_awarded:
+        now = datetime.now(pytz.utc)
+        user_info["last_completed"] = now.isoformat()
+        changed_fields.append("last_completed")
+        if user_info.get("accountability_buddy"):
+            buddy_watch.update(user_id, now)
+    user_store.mark_dirty(user_id, *changed_fields)
+    return messages, total_points_awarded
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.dm_messages = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# SHARD_COUNT in config.json fixes the number of gateway shards; by default
+# Discord's recommendation is used.
+bot = commands.AutoShardedBot(command_prefix="!", intents=intents, shard_count=config.get("SHARD_COUNT"))
+
+###############################################################################
+# --- DM Channel Cache ---
+###############################################################################
+DM_CHANNEL_FILE = "dm_channels.json"
+DM_CHANNEL_CACHE_SIZE = 100000
+# Seconds to wait before writing newly learned DM channels to disk.
+DM_CHANNEL_SAVE_DELAY = 30
+
+class DMChannelCache:
+    """Remembers each user's DM channel id so sends skip fetch_user/create_dm.
+
+    Cached ids are turned into PartialMessageable channels, which need no
+    REST call. The least recently used entries are evicted beyond
+    DM_CHANNEL_CACHE_SIZE and an entry is dropped when Discord answers a
+    send with 403 or 404.
+    """
+
+    def __init__(self, path=process_file(DM_CHANNEL_FILE), max_size=DM_CHANNEL_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.channels = OrderedDict(load_data(path))
+        self._save_handle = None
+
+    def get(self, user_id):
+        channel_id = self.channels.get(user_id)
+        if channel_id is not None:
+            self.channels.move_to_end(user_id)
+        return channel_id
+
+    def put(self, user_id, channel_id):
+        if self.channels.get(user_id) == channel_id:
+            return
+        self.channels[user_id] = channel_id
+        self.channels.move_to_end(user_id)
+        while len(self.channels) > self.max_size:
+            self.channels.popitem(last=False)
+        self.schedule_save()
+
+    def invalidate(self, user_id):
+        if self.channels.pop(user_id, None) is not None:
+            self.schedule_save()
+
+    def schedule_save(self):
+        if self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        self._save_handle = loop.call_later(DM_CHANNEL_SAVE_DELAY, self.save)
+
+    def save(self):
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        # Copying is cheap; encoding 100k entries is not, so that happens off the loop.
+        write_behind(save_data, dict(self.channels), self.path)
+
+    async def channel_for(self, user_id, user=None):
+        # `user` may be passed when the caller already has the discord.User.
+        channel_id = self.get(user_id)
+        if channel_id is not None:
+            return bot.get_partial_messageable(channel_id, type=discord.ChannelType.private)
+        if user is None:
+            user = bot.get_user(int(user_id))
+        if user is None:
+            user = await bot.fetch_user(int(user_id))
+        dm_channel = user.dm_channel or await user.create_dm()
+        self.put(user_id, dm_channel.id)
+        return dm_channel
+
+    async def send(self, user_id, *args, user=None, **kwargs):
+        # Every DM that opens a channel goes through here, so a stale entry
+        # is dropped wherever it turns up. Returns the sent message.
+        cached = self.get(user_id) is not None
+        channel = await self.channel_for(user_id, user)
+        try:
+            return await channel.send(*args, **kwargs)
+        except discord.NotFound:
+            self.invalidate(user_id)
+            if not cached:
+                raise
+            # The remembered channel is gone; open a fresh one once.
+            channel = await self.channel_for(user_id, user)
+            return await channel.send(*args, **kwargs)
+        except discord.Forbidden:
+            self.invalidate(user_id)
+            raise
+
+dm_channels = DMChannelCache()
+
+###############################################################################
+# --- Timer Wheel ---
+###############################################################################
+# Deadlines of pending conversations (buddy codes and the like) live in one
+# hashed timing wheel instead of one sleeping coroutine or wait_for timeout
+# each. Slots are one second wide.
+TIMER_SLOTS = 512
+
+def now_ts():
+    # Wall-clock seconds, so deadlines can be saved and survive a restart.
+    return datetime.now(pytz.utc).timestamp()
+
+class TimerWheel:
+    """Hashed timing wheel: schedule and cancel are O(1) dict operations and
+    each tick only looks at the slots of the seconds that have passed.
+
+    A deadline more than TIMER_SLOTS seconds away simply stays in its slot
+    for extra turns of the wheel. Callbacks get the key they were scheduled
+    under and must not block.
+    """
+
+    def __init__(self, slots=TIMER_SLOTS):
+        self.slots = [{} for _ in range(slots)]
+        self.where = {}  # key -> slot index
+        self.current = int(now_ts())
+
+    def schedule(self, key, deadline, callback):
+        self.cancel(key)
+        index = max(int(deadline) + 1, self.current + 1) % len(self.slots)
+        self.slots[index][key] = (deadline, callback)
+        self.where[key] = index
+
+    def cancel(self, key):
+        index = self.where.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def tick(self):
+        now = now_ts()
+        while self.current < int(now):
+            self.current += 1
+            slot = self.slots[self.current % len(self.slots)]
+            due = [(key, callback) for key, (deadline, callback) in slot.items() if deadline <= now]
+            for key, callback in due:
+                del slot[key]
+                del self.where[key]
+                try:
+                    callback(key)
+                except Exception as e:
+                    print(f"Error in timer {key}: {e}")
+
+    def __len__(self):
+        return len(self.where)
+
+timer_wheel = TimerWheel()
+
+@tasks.loop(seconds=1)
+@metrics.timed("ssk_loop_seconds", loop="tick_timer_wheel")
+async def tick_timer_wheel():
+    timer_wheel.tick()
+
+###############################################################################
+# --- Conversations ---
+###############################################################################
+CONVERSATION_FILE = "conversations.journal"
+CONVERSATION_LOG_DELAY = 1
+
+class Conversations:
+    """Multi-step DM conversations kept as data instead of waiting coroutines.
+
+    Each open conversation is a small dict keyed by "<user id>:<channel id>":
+
+        {"flow": "register", "step": "name", "data": {...}, "expires": <unix time>}
+
+    route_direct_message() finds it with one dict lookup and passes the
+    reply to the handler registered with @conversations.step(flow, step);
+    buttons and menus pass their value through answer() the same way.
+    Deadlines live in the timer wheel and call the flow's
+    @conversations.timeout handler, which either moves on or finishes.
+
+    Handlers should advance() or finish() before awaiting anything, so a
+    second message arriving meanwhile is not taken as the same answer.
+
+    Every change is appended to CONVERSATION_FILE, which process 0 replays
+    and compacts at startup, so a restart resumes each conversation at its
+    step.
+    """
+
+    def __init__(self, path=CONVERSATION_FILE):
+        self.path = path
+        self.handlers = {}  # (flow, step) -> async handler(key, state, answer)
+        self.timeouts = {}  # flow -> async handler(key, state)
+        self.states = {}
+        self.log = BatchedLog(path, CONVERSATION_LOG_DELAY)
+        self._tasks = set()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    # Torn last line from a crash.
+                    break
+                if entry.get("state") is None:
+                    self.states.pop(entry["key"], None)
+                else:
+                    self.states[entry["key"]] = entry["state"]
+        write_atomic(self.path, "".join(encode({"key": key, "state": state}) + "\n" for key, state in self.states.items()))
+        for key, state in self.states.items():
+            # Conversations that timed out while the bot was down expire on the first tick.
+            timer_wheel.schedule(("conversation", key), state["expires"], self.expire)
+
+    def step(self, flow, step):
+        def decorator(handler):
+            self.handlers[(flow, step)] = handler
+            return handler
+        return decorator
+
+    def timeout(self, flow):
+        def decorator(handler):
+            self.timeouts[flow] = handler
+            return handler
+        return decorator
+
+    @staticmethod
+    def key(user_id, channel_id):
+        return f"{user_id}:{channel_id}"
+
+    @staticmethod
+    def channel(key):
+        return bot.get_partial_messageable(int(key.split(":")[1]), type=discord.ChannelType.private)
+
+    def start(self, user_id, channel_id, flow, step, ttl, data=None):
+        # Replaces any other conversation the user has open in this channel.
+        key = self.key(user_id, channel_id)
+        self.states[key] = {"flow": flow, "step": step, "data": data or {}, "expires": 0}
+        self.advance(key, step, ttl)
+        return key
+
+    def advance(self, key, step, ttl):
+        state = self.states[key]
+        state["step"] = step
+        state["expires"] = now_ts() + ttl
+        timer_wheel.schedule(("conversation", key), state["expires"], self.expire)
+        self.log.append({"key": key, "state": state})
+
+    def update(self, key, **data):
+        # Stores partial answers (e.g. menu picks) without changing step.
+        state = self.states[key]
+        state["data"].update(data)
+        self.log.append({"key": key, "state": state})
+
+    def finish(self, key):
+        if self.states.pop(key, None) is not None:
+            timer_wheel.cancel(("conversation", key))
+            self.log.append({"key": key, "state": None})
+
+    async def handle(self, message):
+        # Returns True when the DM was an answer in an open conversation.
+        return await self.answer(message.author.id, message.channel.id, message.content.strip())
+
+    async def answer(self, user_id, channel_id, answer, step=None):
+        # `step`, if given, must match the conversation's current step.
+        key = self.key(user_id, channel_id)
+        state = self.states.get(key)
+        if state is None or (step is not None and state["step"] != step):
+            return False
+        flow, step = state["flow"], state["step"]
+        handler = self.handlers.get((flow, step))
+        if handler is None:
+            return False
+        started = perf_counter()
+        try:
+            await handler(key, state, answer)
+        finally:
+            metrics.observe("ssk_conversation_step_seconds", perf_counter() - started, flow=flow, step=step)
+        return True
+
+    def expire(self, timer_key):
+        key = timer_key[1]
+        state = self.states.get(key)
+        if state is None:
+            return
+        task = asyncio.create_task(self.run_timeout(key, state))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run_timeout(self, key, state):
+        handler = self.timeouts.get(state["flow"])
+        try:
+            if handler is not None:
+                await handler(key, state)
+        finally:
+            if self.states.get(key) is state and state["expires"] <= now_ts():
+                # The handler neither moved on nor finished.
+                self.finish(key)
+
+conversations = Conversations()
+if PROCESS_INDEX == 0:
+    # Only the gateway process receives DMs; a worker rewriting the shared
+    # file would drop what process 0 appended since.
+    conversations.load()
 
 ###############################################################################
 # --- UI Components for Time Zone Selection ---
 ###############################################################################
+# Components are persistent: their custom_ids start with "ssk:" and are
+# handled by the views and dynamic items registered in setup_hook, so a
+# message's menus and buttons keep working after a restart. Sent copies are
+# stopped right away (see send_view) so the view store does not keep one
+# per message.
+MENU_EXPIRED = "This menu is no longer active."
+
+async def send_view(send, *args, view, **kwargs):
+    result = await send(*args, view=view, **kwargs)
+    view.stop()
+    return result
+
 class TimezoneSelect(discord.ui.Select):
     def __init__(self):
-        options = [
-            discord.SelectOption(label="Eastern Time (US)", value="America/New_York"),
-            discord.SelectOption(label="Central Time (US)", value="America/Chicago"),
-            discord.SelectOption(label="Mountain Time (US)", value="America/Denver"),
-            discord.SelectOption(label="Pacific Time (US)", value="America/Los_Angeles"),
-            discord.SelectOption(label="Greenwich Mean Time", value="Etc/Greenwich"),
-            discord.SelectOption(label="London", value="Europe/London"),
-            discord.SelectOption(label="Paris", value="Europe/Paris"),
-            discord.SelectOption(label="Tokyo", value="Asia/Tokyo")
-        ]
-        super().__init__(placeholder="Choose your time zone...", min_values=1, max_values=1, options=options)
+        # Other zones can be typed as the answer instead; see register_timezone.
+        options = [discord.SelectOption(label=label, value=tz_name) for label, tz_name in POPULAR_TIMEZONES[:AUTOCOMPLETE_LIMIT]]
+        super().__init__(placeholder="Choose your time zone...", min_values=1, max_values=1, options=options, custom_id="ssk:timezone")
 
     async def callback(self, interaction: discord.Interaction):
-        # Store the selected time zone in the view for retrieval.
-        self.view.value = self.values[0]
-        self.view.stop()
+        # The choice is the answer to the registration's "timezone" step.
+        await interaction.response.defer()
+        if not await conversations.answer(interaction.user.id, interaction.channel_id, self.values[0], step="timezone"):
+            await interaction.followup.send(MENU_EXPIRED, ephemeral=True)
 
 class TimezoneView(discord.ui.View):
-    def __init__(self, timeout=60):
-        super().__init__(timeout=timeout)
+    # Persistent: the copy registered in setup_hook answers every message's menu.
+    def __init__(self):
+        super().__init__(timeout=None)
         self.add_item(TimezoneSelect())
-        self.value = None
+
+###############################################################################
+# --- UI Components for Picking Tasks at Registration ---
+###############################################################################
+class RegistrationTaskSelect(discord.ui.Select):
+    # Values are the task numbers shown in the registration list.
+    def __init__(self, part, placeholder, first, tasks):
+        options = [
+            discord.SelectOption(label=f"{number}. {TASK_CATALOG[task_id]['description']}"[:100], value=str(number))
+            for number, task_id in enumerate(tasks, start=first)
+        ]
+        super().__init__(placeholder=placeholder, min_values=0, max_values=min(10, len(options)),
+                         options=options, custom_id=f"ssk:register:{part}")
+        self.part = part
+
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+        key = conversations.key(interaction.user.id, interaction.channel_id)
+        state = conversations.states.get(key)
+        if state is None or state["step"] != "tasks":
+            await interaction.followup.send(MENU_EXPIRED, ephemeral=True)
+            return
+        conversations.update(key, **{self.part: [int(value) for value in self.values]})
+
+class RegistrationTaskButton(discord.ui.Button):
+    # Sends `answer` to the "tasks" step, as if the user had typed it.
+    def __init__(self, label, answer, style):
+        super().__init__(label=label, style=style, custom_id=f"ssk:register:{answer}")
+        self.answer = answer
+
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+        if not await conversations.answer(interaction.user.id, interaction.channel_id, self.answer, step="tasks"):
+            await interaction.followup.send(MENU_EXPIRED, ephemeral=True)
+
+class RegistrationTasksView(discord.ui.View):
+    # Persistent, like TimezoneView. Picks from both menus are kept in the
+    # conversation until "Done" is pressed.
+    def __init__(self):
+        super().__init__(timeout=None)
+        self.add_item(RegistrationTaskSelect("defaults", "Pick from the everyday basics...", 1, DEFAULT_TASKS))
+        self.add_item(RegistrationTaskSelect("extras", "Pick from the extras...", len(DEFAULT_TASKS) + 1, REGISTRATION_EXTRA_TASKS))
+        self.add_item(RegistrationTaskButton("Done", "done", discord.ButtonStyle.primary))
+        self.add_item(RegistrationTaskButton("Use the defaults", "default", discord.ButtonStyle.secondary))
+
+###############################################################################
+# --- UI Components for Completing Tasks ---
+###############################################################################
+# Discord allows at most 25 buttons on a message.
+CHECKLIST_BUTTONS = 25
+
+class CompleteTaskButton(discord.ui.DynamicItem[discord.ui.Button], template=r"ssk:done:(?P<user>\d+):(?P<day>\d{4}-\d{2}-\d{2}):(?P<task>[dc]\d+)"):
+    """One press completes one task: the custom_id carries the user, the
+    checklist date and the task id, so nothing has to be parsed or looked up
+    beyond the user's cached checklist."""
+
+    def __init__(self, user_id, day, task, label="Done"):
+        super().__init__(discord.ui.Button(label=label, style=discord.ButtonStyle.secondary,
+                                           custom_id=self.custom_id_for(user_id, day, task)))
+        self.user_id = user_id
+        self.day = day
+        self.task = task
+
+    @staticmethod
+    def custom_id_for(user_id, day, task):
+        return f"ssk:done:{user_id}:{day}:{task}"
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item, match):
+        return cls(match["user"], match["day"], match["task"], item.label)
+
+    @metrics.timed("ssk_component_seconds", component="complete_task")
+    async def callback(self, interaction: discord.Interaction):
+        user_id = self.user_id
+        if str(interaction.user.id) != user_id:
+            await interaction.response.send_message("These buttons belong to someone else.", ephemeral=True)
+            return
+        async with user_store.transaction(user_id) as txn:
+            if txn.user is None:
+                message = "Not registered. Use /register first."
+            else:
+                checklist = get_checklist(user_id, txn.user)
+                entry = checklist.find(self.task)
+                if checklist.date != self.day:
+                    message = f"These buttons are for {self.day}. Use /list for today's tasks."
+                elif entry is None:
+                    message = "That task is no longer on your list."
+                else:
+                    messages, total_points_awarded = complete_tasks(user_id, txn.user, [entry.number])
+                    messages.append(f"Total points awarded: {total_points_awarded}.")
+                    message = "\n".join(messages)
+        await interaction.response.send_message(message, ephemeral=True)
+
+def checklist_buttons(user_id, checklist):
+    # [label, custom_id] for the first pending tasks; plain lists so they can
+    # be stored with a queued delivery.
+    return [
+        [str(entry.number), CompleteTaskButton.custom_id_for(user_id, checklist.date, entry.id)]
+        for entry in checklist.pending_entries()[:CHECKLIST_BUTTONS]
+    ]
+
+def buttons_view(buttons):
+    # Presses are handled by CompleteTaskButton, matched on the custom_id.
+    view = discord.ui.View(timeout=None)
+    for label, custom_id in buttons:
+        view.add_item(discord.ui.Button(label=label, style=discord.ButtonStyle.secondary, custom_id=custom_id))
+    return view
 
 ###############################################################################
 # /register Command: Registers a new user and sends initial DM instructions.
@@ -124,119 +2678,132 @@ class TimezoneView(discord.ui.View):
 @bot.tree.command(name="register", description="Register with Selfcare Sidekick.")
 async def register(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    data = load_data()
-    if user_id in data:
+    if user_id in user_store:
         await interaction.response.send_message("You are already registered. Please check your DMs for details.", ephemeral=True)
         return
 
     await interaction.response.send_message("Check your DMs to complete registration!", ephemeral=True)
-    try:
-        dm_channel = await interaction.user.create_dm()
-        # Ask for the user's preferred name.
-        await dm_channel.send("Welcome to Selfcare Sidekick! What would you like to be called? Please reply with your preferred name.")
-        def check(m): 
-            return m.author == interaction.user and m.channel == dm_channel
-        name_msg = await bot.wait_for('message', check=check, timeout=120)
-        preferred_name = name_msg.content.strip()
-        registration_date = datetime.utcnow().isoformat()
-
-        # Ask for time zone using a dropdown.
-        view = TimezoneView(timeout=60)
-        await dm_channel.send("Please select your time zone from the dropdown below:", view=view)
-        await view.wait()
-        timezone = view.value
-        if not timezone:
-            await dm_channel.send("No time zone selected. You can set your time zone later with /settimezone.")
-            timezone = None
-
-        # Define default tasks with a points value.
-        original_defaults = [
-            {"description": "Rise and shine - enjoy a refreshing glass of water!", "difficulty": 1},
-            {"description": "Splash your face and greet the day with a smile.", "difficulty": 1},
-            {"description": "Brush your teefs until they sparkle.", "difficulty": 1},
-            {"description": "Hop in the shower if you're feeling a bit groggy.", "difficulty": 1},
-            {"description": "Quickly brush your hair for a neat look.", "difficulty": 1},
-            {"description": "Change into fresh undies and a comfy tee.", "difficulty": 1},
-            {"description": "Fuel up with a healthy meal or snack.", "difficulty": 1},
-            {"description": "Take a light walk or stretch to get moving.", "difficulty": 1},
-            {"description": "Do something fun that makes your heart sing.", "difficulty": 1},
-            {"description": "Check in with your mood and give yourself a high-five.", "difficulty": 1}
-        ]
-        additional_tasks = [
-            {"description": "Meditate for 5 magical minutes.", "difficulty": 2},
-            {"description": "Write one thing you're grateful for.", "difficulty": 2},
-            {"description": "Drink another glass of water - hydrate like a hero!", "difficulty": 1},
-            {"description": "Take 5 deep, mindful breaths.", "difficulty": 1},
-            {"description": "Step outside and soak up some sunshine.", "difficulty": 1},
-            {"description": "Play your favorite tune and dance a bit.", "difficulty": 2},
-            {"description": "Read a few pages of a good book.", "difficulty": 2},
-            {"description": "Do a quick, gentle stretch.", "difficulty": 1},
-            {"description": "Tidy up a small corner for a clear mind.", "difficulty": 2},
-            {"description": "Smile at yourself in the mirror.", "difficulty": 1},
-            {"description": "Whip up a tasty healthy snack.", "difficulty": 2},
-            {"description": "Take a short break from screens.", "difficulty": 1},
-            {"description": "Enjoy a warm cup of tea or coffee.", "difficulty": 1},
-            {"description": "Send a quick thank-you to someone.", "difficulty": 1},
-            {"description": "Jot down one positive thought.", "difficulty": 1},
-            {"description": "Do a 2-minute breathing exercise.", "difficulty": 1},
-            {"description": "Celebrate one small win today.", "difficulty": 2},
-            {"description": "Try a brief mindfulness exercise.", "difficulty": 2},
-            {"description": "Doodle something fun.", "difficulty": 2},
-            {"description": "Reach out with a kind word to a friend.", "difficulty": 1}
-        ]
-        available_tasks = original_defaults + additional_tasks
+    # Ask for the user's preferred name. The conversation is keyed by the
+    # channel the question actually reached.
+    message = await dm_channels.send(
+        user_id, "Welcome to Selfcare Sidekick! What would you like to be called? Please reply with your preferred name.",
+        user=interaction.user
+    )
+    conversations.start(user_id, message.channel.id, "register", "name", 120,
+                         {"registered": datetime.utcnow().isoformat()})
 
-        # Build the numbered list string, showing the points value.
-        tasks_list_str = "\n".join(
-            [f"{i+1}. {task['description']} (points: {task['difficulty']})" for i, task in enumerate(available_tasks)]
-        )
-        prompt_text = (
-            "Please select your first 10 tasks from the list by entering the numbers separated by commas (e.g., '1,3,5,...').\n"
-            "Or simply reply with 'Default' to use the default set.\n\n" +
-            tasks_list_str
-        )
-        await dm_channel.send(prompt_text)
-        selection_msg = await bot.wait_for('message', check=check, timeout=120)
-        selection = selection_msg.content.strip()
-        if selection.lower() == "default":
-            personal_defaults = original_defaults
+@conversations.step("register", "name")
+async def register_name(key, state, answer):
+    state["data"]["name"] = answer
+    conversations.advance(key, "timezone", 120)
+    # Ask for time zone using a dropdown.
+    await send_view(conversations.channel(key).send,
+                    "Please select your time zone from the dropdown below, or reply with your city or time zone "
+                    "(e.g. 'Lisbon' or 'America/Toronto') if it isn't listed:", view=TimezoneView())
+
+@conversations.step("register", "timezone")
+async def register_timezone(key, state, answer):
+    # `answer` is a menu value, a typed reply, or None when the step timed out.
+    tz_name = timezone_index.resolve(answer) if answer else None
+    if answer and tz_name is None:
+        suggestions = timezone_index.search(answer, limit=5)
+        conversations.advance(key, "timezone", 120)
+        if suggestions:
+            await conversations.channel(key).send("Which one did you mean? Reply with its name:\n" + "\n".join(f"- {name}" for name in suggestions))
+        else:
+            await conversations.channel(key).send(f"I couldn't find a time zone for \"{answer}\". Try the name of a nearby city.")
+        return
+    state["data"]["timezone"] = tz_name
+    conversations.advance(key, "tasks", 300)
+    dm_channel = conversations.channel(key)
+    if not tz_name:
+        await dm_channel.send("No time zone selected. You can set your time zone later with /settimezone.")
+
+    # Build the numbered list string, showing the points value.
+    available_tasks = DEFAULT_TASKS + REGISTRATION_EXTRA_TASKS
+    tasks_list_str = "\n".join(
+        [f"{i+1}. {TASK_CATALOG[task_id]['description']} (points: {TASK_CATALOG[task_id]['difficulty']})"
+         for i, task_id in enumerate(available_tasks)]
+    )
+    prompt_text = (
+        "Please select your first 10 tasks from the list using the menus below and press **Done**.\n"
+        "Or press **Use the defaults** to use the default set. You can also reply with the numbers separated by commas (e.g., '1,3,5,...').\n\n" +
+        tasks_list_str
+    )
+    await send_view(dm_channel.send, prompt_text, view=RegistrationTasksView())
+
+@conversations.step("register", "tasks")
+async def register_tasks(key, state, answer):
+    # `answer` is "done" or "default" from RegistrationTasksView, or typed numbers.
+    # An invalid pick leaves the step open so the user can try again.
+    dm_channel = conversations.channel(key)
+    user_id = key.split(":")[0]
+    data = state["data"]
+    available_tasks = DEFAULT_TASKS + REGISTRATION_EXTRA_TASKS
+    if answer.lower() == "default":
+        personal_defaults = list(DEFAULT_TASKS)
+    else:
+        if answer.lower() == "done":
+            numbers = data.get("defaults", []) + data.get("extras", [])
         else:
             try:
-                numbers = [int(n.strip()) for n in selection.split(",")]
-                if len(set(numbers)) != 10 or any(n < 1 or n > len(available_tasks) for n in numbers):
-                    await dm_channel.send("Invalid selection. Please select exactly 10 unique numbers from the list. Try /register again.")
-                    return
-                personal_defaults = [available_tasks[n-1] for n in numbers]
+                numbers = [int(n.strip()) for n in answer.split(",")]
             except ValueError:
-                await dm_channel.send("Invalid input format. Use comma-separated numbers or 'Default'.")
+                await dm_channel.send("Invalid input format. Use the menus, comma-separated numbers or 'Default'.")
                 return
+        if any(n < 1 or n > len(available_tasks) for n in numbers):
+            await dm_channel.send("Invalid selection. Please only use numbers from the list.")
+            return
+        if len(set(numbers)) != 10:
+            await dm_channel.send(f"You picked {len(set(numbers))} tasks. Please select exactly 10 unique tasks from the list.")
+            return
+        personal_defaults = [available_tasks[n-1] for n in numbers]
+    conversations.finish(key)
 
-        # Initialize user data, including personal defaults and daily tracker.
-        data[user_id] = {
-            "name": preferred_name,
-            "registered": registration_date,
-            "points": 10,
-            "weekly_points": 10,
+    # Initialize user data, including personal defaults and daily tracker.
+    timezone = data.get("timezone")
+    async with user_store.transaction(user_id) as txn:
+        if txn.user is not None:
+            # A second /register finished first.
+            await dm_channel.send("You are already registered.")
+            return
+        txn.put({
+            "name": data["name"],
+            "registered": data["registered"],
+            "points": 0,
+            "weekly_points": 0,
             "tasks": [],  # Custom tasks added later.
+            "next_task_id": 1,
             "personal_defaults": personal_defaults,
-            "daily_defaults": {"date": datetime.utcnow().date().isoformat(), "completed": []},
+            "catalog_version": TASK_CATALOG_VERSION,
+            "daily_defaults": {"date": user_today({"timezone": timezone}).isoformat(), "completed": []},
             "last_journal": "",
             "timezone": timezone
-        }
-        save_data(data)
-        tasks_chosen = "\n".join(
-            [f"- {task['description']} (points: {task['difficulty']})" for task in personal_defaults]
-        )
-        instructions = (
-            f"Thanks {preferred_name}, you are now registered with Selfcare Sidekick and have been gifted **10 points**!\n\n"
-            "Your personal default tasks for daily self-care:\n" +
-            tasks_chosen +
-            "\n\nUse `/complete` to mark tasks as done, `/add` to add custom tasks, `/remove` to remove tasks, and `/points` to check your points.\n"
-            "Try `/journal` for a daily journal prompt. Have a great day!"
-        )
-        await dm_channel.send(instructions)
-    except asyncio.TimeoutError:
-        await dm_channel.send("Registration timed out. Please try again with /register.")
+        })
+        # Already covered by the whole-record write from put().
+        award_points(user_id, txn.user, 10, "Welcome gift for registering")
+    reminder_scheduler.refresh(user_id)
+    tasks_chosen = "\n".join(
+        [f"- {TASK_CATALOG[task_id]['description']} (points: {TASK_CATALOG[task_id]['difficulty']})" for task_id in personal_defaults]
+    )
+    instructions = (
+        f"Thanks {data['name']}, you are now registered with Selfcare Sidekick and have been gifted **10 points**!\n\n"
+        "Your personal default tasks for daily self-care:\n" +
+        tasks_chosen +
+        "\n\nUse `/complete` to mark tasks as done, `/add` to add custom tasks, `/remove` to remove tasks, and `/points` to check your points.\n"
+        "Try `/journal` for a daily journal prompt. Have a great day!"
+    )
+    await dm_channel.send(instructions)
+
+@conversations.timeout("register")
+async def register_timed_out(key, state):
+    if state["step"] == "timezone":
+        # The time zone is optional; carry on without one.
+        await register_timezone(key, state, None)
+        return
+    conversations.finish(key)
+    await conversations.channel(key).send("Registration timed out. Please try again with /register.")
+
 
 ###############################################################################
 # /list Command: View Your Tasks (with strike-through for completed tasks)
@@ -244,94 +2811,34 @@ async def register(interaction: discord.Interaction):
 @bot.tree.command(name="list", description="View your list of tasks for today.")
 async def list_tasks(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    data = load_data()
-    if user_id not in data:
+    user = user_store.get(user_id)
+    if user is None:
         await interaction.response.send_message("You are not registered. Use /register to get started.", ephemeral=True)
         return
 
-    today_str = datetime.utcnow().date().isoformat()
-    
-    # Format personal default tasks.
-    personal_defaults = data[user_id].get("personal_defaults", [])
-    formatted_defaults = []
-    base_defaults = []
-    default_points = []
-    for task in personal_defaults:
-        if isinstance(task, dict):
-            base = task["description"]
-            formatted = f"{base} (points: {task['difficulty']})"
-            formatted_defaults.append(formatted)
-            base_defaults.append(base)
-            default_points.append(task["difficulty"])
-        else:
-            # If stored as plain strings.
-            formatted_defaults.append(task)
-            base_defaults.append(task)
-            default_points.append(1)
-    
-    # Retrieve completed default tasks stored in JSON (raw descriptions).
-    completed_defaults = []
-    if "daily_defaults" in data[user_id] and data[user_id]["daily_defaults"].get("date") == today_str:
-        completed_defaults = data[user_id]["daily_defaults"].get("completed", [])
-    
-    # Format custom tasks.
-    custom_tasks_raw = [t for t in data[user_id].get("tasks", []) if t["deleted"] is None]
-    formatted_custom = []
-    base_custom = []
-    for t in custom_tasks_raw:
-        diff = t.get("difficulty", 2)
-        base = t["description"]
-        formatted = f"{base} ({t['type'].capitalize()}, points: {diff})"
-        formatted_custom.append(formatted)
-        base_custom.append(base)
-    
-    # For custom tasks, build completed list (formatted) for tasks marked complete.
-    completed_custom = []
-    for t in custom_tasks_raw:
-        if t.get("is_completed"):
-            diff = t.get("difficulty", 2)
-            base = t["description"]
-            completed_custom.append(f"{base} ({t['type'].capitalize()}, points: {diff})")
-    
-    # Combine default and custom tasks for full checklist.
-    checklist = formatted_defaults + formatted_custom
-    # Combine raw base descriptions for defaults and custom tasks.
-    base_checklist = base_defaults + base_custom
-    
-    # Build the list of completed tasks.
-    # For defaults, match by base description.
-    completed = []
-    for base in completed_defaults:
-        # Look up the formatted string corresponding to the base in defaults.
-        for i, base_val in enumerate(base_defaults):
-            if base_val == base:
-                completed.append(formatted_defaults[i])
-                break
-    # Add completed custom tasks.
-    completed.extend(completed_custom)
-    
-    # Determine tasks that are not completed.
-    not_completed = [task for task in checklist if task not in completed]
-    
-    # Build response lines.
-    response_lines = ["Here are your tasks for today:"]
-    for idx, task in enumerate(checklist, start=1):
-        # Determine points value: for defaults, use stored value; for custom tasks, assume default is 2 if not provided.
-        if idx <= len(formatted_defaults):
-            points = default_points[idx - 1]
-        else:
-            points = 2
-        if task in completed:
-            line = f"{idx}. ~~{task}~~ (+{points})"
-        else:
-            line = f"{idx}. {task}"
-        response_lines.append(line)
-    
-    message = "\n".join(response_lines)
-    await interaction.response.send_message(message, ephemeral=True)
+    checklist = get_checklist(user_id, user)
+
+    def render():
+        # Build response lines.
+        response_lines = ["Here are your tasks for today:"]
+        for entry in checklist.entries:
+            if checklist.is_completed(entry):
+                line = f"{entry.number}. ~~{entry.label}~~ (+{entry.difficulty})"
+            else:
+                line = f"{entry.number}. {entry.label}"
+            response_lines.append(line)
+        return "\n".join(response_lines)
+
+    message = cached_body("list", user_id, checklist, render)
+    # One button per pending task completes it without /complete.
+    buttons = checklist_buttons(user_id, checklist)
+    if buttons:
+        await send_view(interaction.response.send_message, message, view=buttons_view(buttons), ephemeral=True)
+    else:
+        await interaction.response.send_message(message, ephemeral=True)
 
 ###############################################################################
-# /add Command: Add a Custom Task (with is_completed field)
+# /add Command: Add a Custom Task (with completed_on field)
 ###############################################################################
 @bot.tree.command(name="add", description="Add a custom task.")
 @app_commands.describe(
@@ -345,32 +2852,33 @@ async def add(interaction: discord.Interaction, task_type: str, description: str
         await interaction.response.send_message("Invalid task type. Specify 'daily' or 'weekly'.", ephemeral=True)
         return
     user_id = str(interaction.user.id)
-    data = load_data()
-    if user_id not in data:
-        await interaction.response.send_message("Not registered. Use /register first.", ephemeral=True)
-        return
 
     # Set default difficulty if not provided.
     if difficulty is None:
         difficulty = 1 if task_type == "daily" else 2
 
-    added_date = datetime.utcnow().isoformat()
-    task_entry = {
-        "description": description,
-        "type": task_type,
-        "added": added_date,
-        "deleted": None,
-        "is_completed": False,
-        "difficulty": difficulty
-    }
-    existing_tasks = [t for t in data[user_id]["tasks"] if t["deleted"] is None]
-    data[user_id]["tasks"].append(task_entry)
-    gift_text = ""
-    if len(existing_tasks) == 0:
-        data[user_id]["points"] += 5
-        data[user_id]["weekly_points"] += 5
-        gift_text = " Bonus: 5 extra points for adding your first custom task!"
-    save_data(data)
+    async with user_store.transaction(user_id) as txn:
+        user = txn.user
+        if user is None:
+            await interaction.response.send_message("Not registered. Use /register first.", ephemeral=True)
+            return
+        added_date = datetime.utcnow().isoformat()
+        task_entry = {
+            "id": new_task_id(user),
+            "description": description,
+            "type": task_type,
+            "added": added_date,
+            "deleted": None,
+            "completed_on": None,
+            "difficulty": difficulty
+        }
+        existing_tasks = [t for t in user["tasks"] if t["deleted"] is None]
+        user["tasks"].append(task_entry)
+        txn.changed("tasks", "next_task_id")
+        gift_text = ""
+        if len(existing_tasks) == 0:
+            txn.changed(*award_points(user_id, user, 5, "Bonus for adding your first custom task"))
+            gift_text = " Bonus: 5 extra points for adding your first custom task!"
     await interaction.response.send_message(f"Task added: '{description}' as a {task_type} task with points: {difficulty}.{gift_text}", ephemeral=True)
 
 ###############################################################################
@@ -379,11 +2887,11 @@ async def add(interaction: discord.Interaction, task_type: str, description: str
 @bot.tree.command(name="remove", description="Remove a custom task.")
 async def remove(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    data = load_data()
-    if user_id not in data:
+    user = user_store.get(user_id)
+    if user is None:
         await interaction.response.send_message("You are not registered. Use /register to register first.", ephemeral=True)
         return
-    tasks_list = [t for t in data[user_id]["tasks"] if t["deleted"] is None]
+    tasks_list = [t for t in user["tasks"] if t["deleted"] is None]
     if not tasks_list:
         await interaction.response.send_message("You have no custom tasks to remove.", ephemeral=True)
         return
@@ -396,33 +2904,42 @@ async def remove(interaction: discord.Interaction):
         msg += f"{idx}. {task['description']} (Type: {task['type']})\n"
     msg += "Reply with the number of the task you want to remove."
 
-    try:
-        dm_channel = await interaction.user.create_dm()
-        await dm_channel.send(msg)
-
-        def check(m):
-            return m.author == interaction.user and m.channel == dm_channel
+    message = await dm_channels.send(user_id, msg, user=interaction.user)
+    conversations.start(user_id, message.channel.id, "remove", "choose", 60, {"tasks": [t["id"] for t in tasks_list]})
 
-        response = await bot.wait_for('message', check=check, timeout=60)
-        try:
-            num = int(response.content.strip())
-            if num < 1 or num > len(tasks_list):
-                await dm_channel.send("Invalid number. Operation cancelled.")
-                return
-        except ValueError:
-            await dm_channel.send("Invalid input. Operation cancelled.")
+@conversations.step("remove", "choose")
+async def remove_choose(key, state, answer):
+    conversations.finish(key)
+    dm_channel = conversations.channel(key)
+    user_id = key.split(":")[0]
+    choices = state["data"]["tasks"]
+    try:
+        num = int(answer)
+        if num < 1 or num > len(choices):
+            await dm_channel.send("Invalid number. Operation cancelled.")
             return
+    except ValueError:
+        await dm_channel.send("Invalid input. Operation cancelled.")
+        return
 
-        task_to_remove = tasks_list[num - 1]
+    # Look the chosen task up again in the current record; the list was
+    # built when the conversation started.
+    task_id = choices[num - 1]
+    async with user_store.transaction(user_id) as txn:
+        entry = get_checklist(user_id, txn.user).find(task_id) if txn.user is not None else None
+        if entry is None:
+            await dm_channel.send("That task no longer exists. Operation cancelled.")
+            return
+        task_to_remove = entry.task
         task_to_remove["deleted"] = datetime.utcnow().isoformat()
-        save_data(data)
-        await dm_channel.send(f"Task '{task_to_remove['description']}' removed.")
-        await interaction.followup.send("Task removal processed. Check your DMs for confirmation.", ephemeral=True)
-    except asyncio.TimeoutError:
-        try:
-            await interaction.followup.send("Task removal timed out.", ephemeral=True)
-        except Exception as e:
-            print(f"Error sending timeout message: {e}")
+        forget_task_stats(txn.user, task_id)
+        txn.changed("tasks", "stats")
+    await dm_channel.send(f"Task '{task_to_remove['description']}' removed.")
+
+@conversations.timeout("remove")
+async def remove_timed_out(key, state):
+    conversations.finish(key)
+    await conversations.channel(key).send("Task removal timed out.")
 
 
 ###############################################################################
@@ -432,69 +2949,21 @@ async def remove(interaction: discord.Interaction):
 @app_commands.describe(task_numbers="Comma-separated list of task numbers from your checklist (e.g., '6,7,8')")
 async def complete(interaction: discord.Interaction, task_numbers: str):
     user_id = str(interaction.user.id)
-    data = load_data()
-    if user_id not in data:
+    if user_id not in user_store:
         await interaction.response.send_message("Not registered. Use /register first.", ephemeral=True)
         return
 
-    today_str = datetime.utcnow().date().isoformat()
-    personal_defaults = data[user_id].get("personal_defaults")
-    if not personal_defaults:
-        personal_defaults = [
-            {"description": "Rise and shine - enjoy a refreshing glass of water!", "difficulty": 1},
-            {"description": "Splash your face and greet the day with a smile.", "difficulty": 1},
-            {"description": "Brush your teefs until they sparkle.", "difficulty": 1},
-            {"description": "Hop in the shower if you're feeling a bit groggy.", "difficulty": 1},
-            {"description": "Quickly brush your hair for a neat look.", "difficulty": 1},
-            {"description": "Change into fresh undies and a comfy tee.", "difficulty": 1},
-            {"description": "Fuel up with a healthy meal or snack.", "difficulty": 1},
-            {"description": "Take a light walk or stretch to get moving.", "difficulty": 1},
-            {"description": "Do something fun that makes your heart sing.", "difficulty": 1},
-            {"description": "Check in with your mood and give yourself a high-five.", "difficulty": 1}
-        ]
-    default_tasks = [{"description": task["description"], "difficulty": task["difficulty"], "source": "default"} for task in personal_defaults]
-    custom_tasks_raw = [t for t in data[user_id].get("tasks", []) if t["deleted"] is None]
-    custom_tasks = [{"description": f"{t['description']} ({t['type'].capitalize()}, points: {t.get('difficulty', 2)})", "source": "custom", "ref": t} for t in custom_tasks_raw]
-    checklist = default_tasks + custom_tasks
-
-    if "daily_defaults" not in data[user_id] or data[user_id]["daily_defaults"].get("date") != today_str:
-        data[user_id]["daily_defaults"] = {"date": today_str, "completed": []}
-
     try:
         numbers = [int(n.strip()) for n in task_numbers.split(",")]
     except ValueError:
         await interaction.response.send_message("Invalid format. Use a comma-separated list of numbers.", ephemeral=True)
         return
 
-    total_points_awarded = 0
-    messages = []
-    for num in numbers:
-        if num < 1 or num > len(checklist):
-            messages.append(f"Task number {num} is invalid.")
-            continue
-        task = checklist[num - 1]
-        if task.get("source") == "default":
-            if task["description"] in data[user_id]["daily_defaults"]["completed"]:
-                messages.append(f"Default task '{task['description']}' already completed.")
-            else:
-                data[user_id]["daily_defaults"]["completed"].append(task["description"])
-                points_awarded = task["difficulty"]
-                data[user_id]["points"] += points_awarded
-                data[user_id]["weekly_points"] += points_awarded
-                total_points_awarded += points_awarded
-                messages.append(f"Marked default task '{task['description']}' as completed (+{points_awarded}).")
-        else:
-            ref = task.get("ref")
-            if ref.get("is_completed"):
-                messages.append(f"Custom task '{ref['description']}' already completed.")
-            else:
-                ref["is_completed"] = True
-                points_awarded = ref.get("difficulty", 2)
-                data[user_id]["points"] += points_awarded
-                data[user_id]["weekly_points"] += points_awarded
-                total_points_awarded += points_awarded
-                messages.append(f"Marked custom task '{ref['description']}' as completed (+{points_awarded}).")
-    save_data(data)
+    async with user_store.transaction(user_id) as txn:
+        if txn.user is None:
+            await interaction.response.send_message("Not registered. Use /register first.", ephemeral=True)
+            return
+        messages, total_points_awarded = complete_tasks(user_id, txn.user, numbers)
     messages.append(f"Total points awarded: {total_points_awarded}.")
     final_message = "\n".join(messages)
     await interaction.response.send_message(final_message, ephemeral=True)
@@ -505,88 +2974,166 @@ async def complete(interaction: discord.Interaction, task_numbers: str):
 ###############################################################################
 # /Buddy Command: Allows a user to register an accountability buddy
 ###############################################################################
+BUDDY_REQUEST_FILE = "buddy_requests.json"
+# Seconds a code stays valid, and seconds the buddy then has to answer yes or no.
+BUDDY_CODE_TTL = 300
+BUDDY_CONFIRM_TTL = 120
+
+class BuddyPairings:
+    """Pending /buddy requests, indexed by code and by the answering buddy.
+
+    A code DM'd to the bot and the buddy's yes/no reply are both resolved
+    with a dict lookup from the single DM handler (route_direct_message)
+    instead of one wait_for predicate per request. Expiries are kept in the
+    timer wheel, and the pending requests are saved to BUDDY_REQUEST_FILE
+    so they survive a restart:
+
+        {"<code>": {"inviter": "<id>", "expires": <unix time>, "buddy": "<id>", "buddy_name": "..."}}
+
+    "buddy" and "buddy_name" are only present once someone has sent the code.
+    """
+
+    def __init__(self, path=BUDDY_REQUEST_FILE):
+        self.path = path
+        self.requests = load_data(path)
+        self.by_inviter = {}  # inviter id -> code
+        self.by_buddy = {}    # id of the user asked to confirm -> code
+        for code, request in self.requests.items():
+            self.index(code, request)
+
+    def index(self, code, request):
+        self.by_inviter[request["inviter"]] = code
+        if request.get("buddy"):
+            self.by_buddy[request["buddy"]] = code
+        # Requests that expired while the bot was down fire on the first tick.
+        timer_wheel.schedule(("buddy", code), request["expires"], self.expire)
+
+    def new_code(self):
+        # Random 9-digit code in the format XXX-XXX-XXX, never one in use.
+        while True:
+            digits = f"{secrets.randbelow(10 ** 9):09d}"
+            code = f"{digits[:3]}-{digits[3:6]}-{digits[6:]}"
+            if code not in self.requests:
+                return code
+
+    def create(self, inviter):
+        # One open request per inviter; a new /buddy replaces the old code.
+        old = self.by_inviter.get(inviter)
+        if old is not None:
+            self.drop(old)
+        code = self.new_code()
+        self.requests[code] = {"inviter": inviter, "expires": now_ts() + BUDDY_CODE_TTL}
+        self.index(code, self.requests[code])
+        self.save()
+        return code
+
+    def drop(self, code):
+        request = self.requests.pop(code, None)
+        if request is None:
+            return None
+        timer_wheel.cancel(("buddy", code))
+        if self.by_inviter.get(request["inviter"]) == code:
+            del self.by_inviter[request["inviter"]]
+        if request.get("buddy") and self.by_buddy.get(request["buddy"]) == code:
+            del self.by_buddy[request["buddy"]]
+        self.save()
+        return request
+
+    def save(self):
+        write_behind(save_data, {code: dict(request) for code, request in self.requests.items()}, self.path)
+
+    def notify(self, kind, code, request, user_id, content):
+        # Messages to someone other than the sender go through the delivery queue.
+        key = f"buddy-{kind}:{code}:{int(request['expires'])}:{user_id}"
+        delivery_queue.enqueue(key, user_id, content, datetime.now(pytz.utc))
+
+    async def handle(self, message):
+        # Returns True when the DM was part of a buddy request.
+        user_id = str(message.author.id)
+        text = message.content.strip()
+        code = self.by_buddy.get(user_id)
+        if code is not None and text.lower() in ("yes", "no"):
+            await self.answer(code, message, text.lower() == "yes")
+            return True
+        request = self.requests.get(text)
+        if request is None or request.get("buddy") or request["inviter"] == user_id:
+            return False
+        if code is not None:
+            await message.channel.send("Please answer the buddy request you already have first by replying 'yes' or 'no'.")
+            return True
+        await self.claim(text, request, message)
+        return True
+
+    async def claim(self, code, request, message):
+        buddy_id = str(message.author.id)
+        request["buddy"] = buddy_id
+        request["buddy_name"] = message.author.name
+        request["expires"] = now_ts() + BUDDY_CONFIRM_TTL
+        self.index(code, request)
+        self.save()
+        # They just messaged us, so their DM channel is the one the code arrived in.
+        dm_channels.put(buddy_id, message.channel.id)
+        await message.channel.send(
+            "You've received a buddy request code. By replying 'yes', you agree to be the accountability buddy for the requesting user. "
+            "As an accountability buddy, if they don't complete any tasks in 7 days, you'll receive a reminder to check in on them. "
+            "Reply 'yes' to accept or 'no' to decline."
+        )
+
+    async def answer(self, code, message, accepted):
+        request = self.drop(code)
+        inviter = request["inviter"]
+        buddy_name = request.get("buddy_name") or message.author.name
+        if not accepted:
+            await message.channel.send("You have declined the buddy request.")
+            self.notify("answer", code, request, inviter, f"Unfortunately, {buddy_name} has declined to be your accountability buddy.")
+            return
+        async with user_store.transaction(inviter) as txn:
+            if txn.user is None:
+                await message.channel.send("Sorry, that buddy request is no longer valid.")
+                return
+            txn.user["accountability_buddy"] = request["buddy"]
+            txn.user["buddy_since"] = datetime.now(pytz.utc).isoformat()
+            txn.changed("accountability_buddy", "buddy_since")
+            buddy_watch.update(inviter, last_activity(txn.user))
+        await message.channel.send("Thank you! You are now registered as an accountability buddy.")
+        self.notify("answer", code, request, inviter, f"{buddy_name} has accepted your accountability buddy request!")
+
+    def expire(self, key):
+        code = key[1]
+        request = self.drop(code)
+        if request is None:
+            return
+        if request.get("buddy"):
+            self.notify("expired", code, request, request["buddy"], "The buddy request timed out without an answer.")
+            self.notify("expired", code, request, request["inviter"], "Buddy request expired. Your buddy didn't confirm in time.")
+        else:
+            self.notify("expired", code, request, request["inviter"], "Buddy request expired. No one responded in time.")
+
+buddy_pairings = BuddyPairings()
+
 @bot.tree.command(name="buddy", description="Request an accountability buddy with a unique code.")
 async def buddy(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    data = load_data()
-    if user_id not in data:
+    if user_id not in user_store:
         await interaction.response.send_message("You are not registered. Use /register first.", ephemeral=True)
         return
 
-    # Generate a unique 9-digit code in the format XXX-XXX-XXX.
-    code_digits = [str(random.randint(0, 9)) for _ in range(9)]
-    code = f"{''.join(code_digits[:3])}-{''.join(code_digits[3:6])}-{''.join(code_digits[6:9])}"
-    
-    # Store the pending buddy request with a 5-minute expiry.
-    expiry_time = datetime.utcnow() + timedelta(minutes=5)
-    buddy_requests[code] = {"inviter": user_id, "expires": expiry_time}
-    
-    # Inform the inviter (user 1) of the generated code.
+    code = buddy_pairings.create(user_id)
     await interaction.response.send_message(
         f"Your buddy request code is **{code}**. Share this code with someone you trust. They have 5 minutes to DM me this code to become your accountability buddy.",
         ephemeral=True
     )
-    
-    # Define a check for incoming DM messages with the code.
-    def code_check(message):
-        return (
-            message.content.strip() == code and
-            str(message.author.id) != user_id and
-            isinstance(message.channel, discord.DMChannel)
-        )
-    
-    try:
-        # Wait up to 5 minutes for another user (user 2) to DM the code.
-        message = await bot.wait_for('message', check=code_check, timeout=300)
-        buddy_user_id = str(message.author.id)
-        
-        # Attempt to fetch user 2.
-        buddy_user = bot.get_user(int(buddy_user_id))
-        if buddy_user is None:
-            buddy_user = await bot.fetch_user(int(buddy_user_id))
-        if buddy_user is None:
-            raise Exception("Unable to fetch buddy user.")
-            
-        # DM user 2 with an explanation and request confirmation.
-        buddy_dm = await buddy_user.create_dm()
-        prompt_msg = (
-            "You've received a buddy request code. By replying 'yes', you agree to be the accountability buddy for the requesting user. "
-            "As an accountability buddy, if they don't complete any tasks in 7 days, you'll receive a reminder to check in on them. "
-            "Reply 'yes' to accept or 'no' to decline."
-        )
-        await buddy_dm.send(prompt_msg)
-        
-        # Wait for user 2's confirmation.
-        def confirm_check(m):
-            return (
-                m.author.id == int(buddy_user_id) and
-                m.channel == buddy_dm and
-                m.content.strip().lower() in ["yes", "no"]
-            )
-        confirmation = await bot.wait_for('message', check=confirm_check, timeout=120)
-        response = confirmation.content.strip().lower()
-        
-        # Use interaction.user directly for the inviter.
-        inviter_dm = await interaction.user.create_dm()
-        
-        if response == "yes":
-            data[user_id]["accountability_buddy"] = buddy_user_id
-            save_data(data)
-            await buddy_dm.send("Thank you! You are now registered as an accountability buddy.")
-            await inviter_dm.send(f"{buddy_user.name} has accepted your accountability buddy request!")
-        else:
-            await buddy_dm.send("You have declined the buddy request.")
-            await inviter_dm.send(f"Unfortunately, {buddy_user.name} has declined to be your accountability buddy.")
-        
-        # Remove the pending request.
-        if code in buddy_requests:
-            del buddy_requests[code]
-    except asyncio.TimeoutError:
-        if code in buddy_requests:
-            del buddy_requests[code]
-        inviter_dm = await interaction.user.create_dm()
-        await inviter_dm.send("Buddy request expired. No one responded in time.")
-        await interaction.followup.send("Buddy request expired. No one joined as your accountability buddy.", ephemeral=True)
+
+###############################################################################
+# Direct Messages: One Handler Routes Every DM
+###############################################################################
+@bot.listen("on_message")
+async def route_direct_message(message):
+    if message.author.bot or message.guild is not None:
+        return
+    if await conversations.handle(message):
+        return
+    await buddy_pairings.handle(message)
 
 
 
@@ -597,15 +3144,15 @@ async def buddy(interaction: discord.Interaction):
 @bot.tree.command(name="journal", description="Write a short journal entry on a given prompt or your own topic.")
 async def journal(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    data = load_data()
+    user = user_store.get(user_id)
     
-    if user_id not in data:
+    if user is None:
         await interaction.response.send_message("You are not registered. Please use /register to get started.", ephemeral=True)
         return
 
-    # Check if user has journaled today. We'll store the date as ISO date (YYYY-MM-DD).
-    today_str = datetime.utcnow().date().isoformat()
-    last_journal = data[user_id].get("last_journal", "")
+    # Check if user has journaled today. We'll store the local date as ISO date (YYYY-MM-DD).
+    today_str = user_today(user).isoformat()
+    last_journal = user.get("last_journal", "")
     if last_journal == today_str:
         await interaction.response.send_message("You've already journaled today. Try again tomorrow!", ephemeral=True)
         return
@@ -622,27 +3169,45 @@ async def journal(interaction: discord.Interaction):
     )
     await interaction.response.send_message(instructions, ephemeral=True)
     
-    try:
-        # Open DM channel and prompt for the journal entry.
-        dm_channel = await interaction.user.create_dm()
-        await dm_channel.send(
-            "Please write your journal entry. Remember, this is private and not stored anywhere.\n"
-            "When you're done, just send your entry as a message here."
-        )
-        def check(m):
-            return m.author == interaction.user and m.channel == dm_channel
-        msg = await bot.wait_for('message', check=check, timeout=900)  # 15 minute timeout
-        
+    # Open DM channel and prompt for the journal entry; the user has 15 minutes.
+    message = await dm_channels.send(
+        user_id,
+        "Please write your journal entry. Remember, this is private and not stored anywhere.\n"
+        "When you're done, just send your entry as a message here.",
+        user=interaction.user
+    )
+    conversations.start(user_id, message.channel.id, "journal", "entry", 900, {"date": today_str})
+
+@conversations.step("journal", "entry")
+async def journal_entry_received(key, state, answer):
+    # Only the fact that the user wrote something is kept, never the entry.
+    conversations.finish(key)
+    dm_channel = conversations.channel(key)
+    user_id = key.split(":")[0]
+    today_str = state["data"]["date"]
+
+    # Re-check against the current record: the user may have deregistered
+    # or journaled from another /journal while we were waiting.
+    points_awarded = 5
+    async with user_store.transaction(user_id) as txn:
+        user = txn.user
+        if user is None:
+            return
+        if user.get("last_journal", "") == today_str:
+            await dm_channel.send("Thank you for journaling! You've already been awarded points for today.")
+            return
+
         # Award 5 points for journaling.
-        points_awarded = 5
-        data[user_id]["points"] += points_awarded
-        data[user_id]["weekly_points"] = data[user_id].get("weekly_points", 0) + points_awarded
-        data[user_id]["last_journal"] = today_str
-        save_data(data)
-        
-        await dm_channel.send(f"Thank you for journaling! You've been awarded {points_awarded} points for today.")
-    except asyncio.TimeoutError:
-        await dm_channel.send("Journal entry timed out. Please try again later when you have a moment.")
+        txn.changed(*award_points(user_id, user, points_awarded, "Journal entry"))
+        user["last_journal"] = today_str
+        txn.changed("last_journal")
+
+    await dm_channel.send(f"Thank you for journaling! You've been awarded {points_awarded} points for today.")
+
+@conversations.timeout("journal")
+async def journal_timed_out(key, state):
+    conversations.finish(key)
+    await conversations.channel(key).send("Journal entry timed out. Please try again later when you have a moment.")
 
 
 ###############################################################################
@@ -651,8 +3216,7 @@ async def journal(interaction: discord.Interaction):
 @bot.tree.command(name="deregister", description="Remove all your data from Selfcare Sidekick. This cannot be undone!")
 async def deregister(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    data = load_data()
-    if user_id not in data:
+    if user_id not in user_store:
         await interaction.response.send_message("You are not registered.", ephemeral=True)
         return
 
@@ -660,23 +3224,30 @@ async def deregister(interaction: discord.Interaction):
         "WARNING: This will permanently remove all your data. If you register again, you will start over with 0 points.\n"
         "Please confirm by replying with 'yes' in DM.", ephemeral=True
     )
-    try:
-        dm_channel = await interaction.user.create_dm()
-        await dm_channel.send("Please confirm that you want to deregister by replying with 'yes'.")
-        def check(m):
-            return m.author == interaction.user and m.channel == dm_channel
-        response = await bot.wait_for('message', check=check, timeout=60)
-        if response.content.strip().lower() == "yes":
-            del data[user_id]
-            save_data(data)
-            await dm_channel.send("Your data has been permanently removed. We're sorry to see you go!")
-            await interaction.followup.send("You have been deregistered.", ephemeral=True)
-        else:
-            await dm_channel.send("Deregistration cancelled.")
-            await interaction.followup.send("Deregistration cancelled.", ephemeral=True)
-    except asyncio.TimeoutError:
-        await interaction.response.send_message("Deregistration timed out.", ephemeral=True)
-        
+    message = await dm_channels.send(user_id, "Please confirm that you want to deregister by replying with 'yes'.", user=interaction.user)
+    conversations.start(user_id, message.channel.id, "deregister", "confirm", 60)
+
+@conversations.step("deregister", "confirm")
+async def deregister_confirm(key, state, answer):
+    conversations.finish(key)
+    dm_channel = conversations.channel(key)
+    user_id = key.split(":")[0]
+    if answer.lower() != "yes":
+        await dm_channel.send("Deregistration cancelled.")
+        return
+    async with user_store.transaction(user_id) as txn:
+        txn.remove()
+    points_ledger.forget(user_id)
+    buddy_watch.discard(user_id)
+    reminder_scheduler.refresh(user_id)
+    dm_channels.invalidate(user_id)
+    await dm_channel.send("Your data has been permanently removed. We're sorry to see you go!")
+
+@conversations.timeout("deregister")
+async def deregister_timed_out(key, state):
+    conversations.finish(key)
+    await conversations.channel(key).send("Deregistration timed out.")
+
 ###############################################################################
 # Crisis Function: Provides user with mental health and suicide prevention resources
 ###############################################################################
@@ -703,13 +3274,13 @@ async def crisis(interaction: discord.Interaction):
 @bot.tree.command(name="points", description="Check your total and weekly points.")
 async def points(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    data = load_data()
-    if user_id not in data:
+    user = user_store.get(user_id)
+    if user is None:
         await interaction.response.send_message("You are not registered. Please use /register to get started.", ephemeral=True)
         return
 
-    total = data[user_id].get("points", 0)
-    weekly = data[user_id].get("weekly_points", 0)
+    total = user.get("points", 0)
+    weekly = points_this_week(user, user_today(user))
     message = (
         "Your points:\n"
         f"- Total Points: **{total}**\n"
@@ -717,354 +3288,1051 @@ async def points(interaction: discord.Interaction):
     )
     await interaction.response.send_message(message, ephemeral=True)
     
+###############################################################################
+# Leaderboard and History: Rankings and Recent Points from the Points Ledger
+###############################################################################
+LEADERBOARD_SIZE = 10
+
+@bot.tree.command(name="leaderboard", description="See who has earned the most points.")
+@app_commands.describe(period="Rank by this week's points or all-time points.")
+@app_commands.choices(period=[
+    app_commands.Choice(name="This week", value="week"),
+    app_commands.Choice(name="All time", value="all")
+])
+async def leaderboard(interaction: discord.Interaction, period: app_commands.Choice[str] = None):
+    user_id = str(interaction.user.id)
+    user = user_store.get(user_id)
+    if user is None:
+        await interaction.response.send_message("You are not registered. Please use /register to get started.", ephemeral=True)
+        return
+
+    if period is None or period.value == "week":
+        board = points_ledger.week_board(week_start(user_today(user)))
+        title = "This week's leaderboard:"
+    else:
+        board = points_ledger.all_time
+        title = "All-time leaderboard:"
+
+    lines = [title]
+    for rank, (member_id, score) in enumerate(board.top(LEADERBOARD_SIZE), start=1):
+        member = user_store.get(member_id)
+        name = member["name"] if member else "Someone"
+        lines.append(f"{rank}. {name} - {score} points")
+    if len(lines) == 1:
+        lines.append("No points earned yet. Complete a task to get on the board!")
+    rank = board.rank(user_id)
+    if rank is None:
+        lines.append("\nYou have no points on this board yet.")
+    else:
+        lines.append(f"\nYour rank: **{rank}** of {len(board)}.")
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+@bot.tree.command(name="history", description="See the points you earned recently.")
+async def history(interaction: discord.Interaction):
+    user_id = str(interaction.user.id)
+    user = user_store.get(user_id)
+    if user is None:
+        await interaction.response.send_message("You are not registered. Please use /register to get started.", ephemeral=True)
+        return
+
+    today = user_today(user)
+    days = points_ledger.days.get(user_id, {})
+    lines = [f"This week: **{points_this_week(user, today)}** points", "", "**Last 7 days:**"]
+    for offset in range(7):
+        day = today - timedelta(days=offset)
+        lines.append(f"{day.strftime('%a %b %d')}: {days.get(day.isoformat(), 0)} points")
+    recent = points_ledger.recent.get(user_id)
+    if recent:
+        lines += ["", "**Recent points:**"]
+        lines += [f"+{entry['amount']} {entry['reason']} ({entry['date']})" for entry in reversed(recent)]
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+###############################################################################
+# /stats Command: Streaks and Completion Rates from the Habit Statistics
+###############################################################################
+@bot.tree.command(name="stats", description="See your streaks and how often you did each task lately.")
+async def stats(interaction: discord.Interaction):
+    user_id = str(interaction.user.id)
+    user = user_store.get(user_id)
+    if user is None:
+        await interaction.response.send_message("You are not registered. Please use /register to get started.", ephemeral=True)
+        return
+
+    today = user_today(user)
+    user_stats = user.get("stats", {})
+    days = user_stats.get("days")
+    registered = (user.get("registered") or "")[:10]
+    # Only count days since registering, so new users aren't shown as 1/30.
+    window = STATS_WINDOW
+    if registered:
+        window = max(1, min(window, (today - date.fromisoformat(registered)).days + 1))
+
+    lines = [
+        f"**Your self-care stats (last {window} days):**",
+        f"Days with at least one task done: {days_done(days, today, window)}/{window}",
+        f"Current streak: {current_streak(days, today)} days (best: {days['best'] if days else 0})",
+    ]
+    best_day = user_stats.get("best_day")
+    if best_day:
+        lines.append(f"Best day: {best_day['date']} with {best_day['count']} tasks done")
+    lines += ["", "**Per task:**"]
+    task_stats = user_stats.get("tasks", {})
+    for entry in get_checklist(user_id, user).entries:
+        track = task_stats.get(entry.id)
+        done = days_done(track, today, window)
+        if entry.task_type == "weekly":
+            lines.append(f"- {entry.description}: done {done} times")
+        else:
+            lines.append(
+                f"- {entry.description}: {done}/{window} days ({round(100 * done / window)}%), "
+                f"streak {current_streak(track, today)} (best: {track['best'] if track else 0})"
+            )
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
 ###############################################################################
 # Pause/Unpause Functions: Allows users to take a break from the reminders.
 ###############################################################################
 @bot.tree.command(name="pause", description="Pause daily reminders.")
 async def pause(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    data = load_data()
-    if user_id not in data:
-        await interaction.response.send_message("You are not registered. Use /register first.", ephemeral=True)
-        return
-    data[user_id]["paused"] = True
-    save_data(data)
+    async with user_store.transaction(user_id) as txn:
+        if txn.user is None:
+            await interaction.response.send_message("You are not registered. Use /register first.", ephemeral=True)
+            return
+        txn.user["paused"] = True
+        txn.changed("paused")
+    reminder_scheduler.refresh(user_id)
     await interaction.response.send_message("Your reminders have been paused.", ephemeral=True)
 
 @bot.tree.command(name="unpause", description="Resume daily reminders.")
 async def unpause(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    data = load_data()
-    if user_id not in data:
-        await interaction.response.send_message("You are not registered. Use /register first.", ephemeral=True)
-        return
-    data[user_id]["paused"] = False
-    save_data(data)
+    async with user_store.transaction(user_id) as txn:
+        if txn.user is None:
+            await interaction.response.send_message("You are not registered. Use /register first.", ephemeral=True)
+            return
+        txn.user["paused"] = False
+        txn.changed("paused")
+    reminder_scheduler.refresh(user_id)
     await interaction.response.send_message("Your reminders have been resumed.", ephemeral=True)
 
 ###############################################################################
 # Settimezone - allows users to set timezone to get reminders in their local time.
 ###############################################################################
 @bot.tree.command(name="settimezone", description="Set your local time zone.")
-@app_commands.describe(timezone="Select your local time zone from the list.")
-@app_commands.choices(timezone=[
-    app_commands.Choice(name="Eastern Time (US)", value="America/New_York"),
-    app_commands.Choice(name="Central Time (US)", value="America/Chicago"),
-    app_commands.Choice(name="Mountain Time (US)", value="America/Denver"),
-    app_commands.Choice(name="Pacific Time (US)", value="America/Los_Angeles"),
-    app_commands.Choice(name="Greenwich Mean Time", value="Etc/Greenwich"),
-    app_commands.Choice(name="London", value="Europe/London"),
-    app_commands.Choice(name="Paris", value="Europe/Paris"),
-    app_commands.Choice(name="Tokyo", value="Asia/Tokyo")
-])
-async def settimezone(interaction: discord.Interaction, timezone: app_commands.Choice[str]):
-    data = load_data()
-    user_id = str(interaction.user.id)
-    if user_id not in data:
-        await interaction.response.send_message("You are not registered. Use /register first.", ephemeral=True)
+@app_commands.describe(timezone="Start typing your city, region or UTC offset (e.g. 'Lisbon' or 'UTC+2') and pick from the list.")
+async def settimezone(interaction: discord.Interaction, timezone: str):
+    tz_name = timezone_index.resolve(timezone)
+    if tz_name is None:
+        suggestions = timezone_index.search(timezone, limit=5)
+        message = f"I couldn't find the time zone \"{timezone}\". Please pick one from the list as you type."
+        if suggestions:
+            message += " Did you mean " + ", ".join(suggestions) + "?"
+        await interaction.response.send_message(message, ephemeral=True)
         return
-    data[user_id]["timezone"] = timezone.value
-    save_data(data)
-    await interaction.response.send_message(f"Your time zone has been set to {timezone.name} ({timezone.value}).", ephemeral=True)
+    user_id = str(interaction.user.id)
+    async with user_store.transaction(user_id) as txn:
+        if txn.user is None:
+            await interaction.response.send_message("You are not registered. Use /register first.", ephemeral=True)
+            return
+        txn.user["timezone"] = tz_name
+        txn.changed("timezone")
+    reminder_scheduler.refresh(user_id)
+    await interaction.response.send_message(f"Your time zone has been set to {tz_name} (currently {utc_offset_label(tz_name)}).", ephemeral=True)
+
+@settimezone.autocomplete("timezone")
+async def settimezone_autocomplete(interaction: discord.Interaction, current: str):
+    return [
+        app_commands.Choice(name=f"{tz_name.replace('_', ' ')} ({utc_offset_label(tz_name)})", value=tz_name)
+        for tz_name in timezone_index.search(current)
+    ]
 
 
 ###############################################################################
-# Nightly Summary: DM Each Registered User Their Daily Task Summary at Night
+# Render Cache: Reuse Message Text Until the Checklist Changes
 ###############################################################################
-@tasks.loop(seconds=60)
-async def nightly_summary():
-    await bot.wait_until_ready()
-    data = load_data()
-    now_utc = datetime.utcnow()
-    for user_id, user_info in data.items():
-        if user_info.get("paused"):
-            print(f"User {user_id} is paused; skipping nightly summary DM.")
-            continue
-        tz_str = user_info.get("timezone")
-        if not tz_str:
-            # User hasn't set a timezone; skip sending localized messages.
-            continue
-        try:
-            tz = pytz.timezone(tz_str)
-        except Exception as e:
-            print(f"Invalid timezone for user {user_id}: {tz_str}")
-            continue
-        now_local = datetime.now(tz)
-        # If it is exactly 23:00 (11 PM) local time, send the summary.
-        if now_local.hour == 23 and now_local.minute == 0:
-            try:
-                user = bot.get_user(int(user_id))
-                if user is None:
-                    user = await bot.fetch_user(int(user_id))
-                dm_channel = await user.create_dm()
-            except Exception as e:
-                print(f"Error fetching DM channel for user {user_id}: {e}")
-                continue
+RENDER_CACHE_SIZE = 50000
 
-            # (Use your existing formatting code for the summary message)
-            today_str = datetime.utcnow().date().isoformat()
-            # Format personal defaults.
-            personal_defaults = user_info.get("personal_defaults", [])
-            if personal_defaults and isinstance(personal_defaults[0], dict):
-                formatted_defaults = [f"{task['description']} (points: {task['difficulty']})" for task in personal_defaults]
-            else:
-                formatted_defaults = personal_defaults
-
-            # Retrieve completed default tasks.
-            completed_defaults = []
-            if "daily_defaults" in user_info and user_info["daily_defaults"].get("date") == today_str:
-                completed_defaults = user_info["daily_defaults"].get("completed", [])
-
-            # Format custom tasks.
-            custom_tasks_raw = [t for t in user_info.get("tasks", []) if t["deleted"] is None]
-            custom_tasks = [f"{t['description']} ({t['type'].capitalize()}, points: {t.get('difficulty', 2)})" for t in custom_tasks_raw]
-            # Completed custom tasks.
-            completed_custom = [f"{t['description']} ({t['type'].capitalize()}, points: {t.get('difficulty', 2)})" for t in custom_tasks_raw if t.get("is_completed")]
-
-            # Combine tasks.
-            all_tasks = formatted_defaults + custom_tasks
-            completed = completed_defaults + completed_custom
-
-            # For strike-through, we compare base descriptions.
-            def extract_description(task_str):
-                return task_str.split(" (")[0].strip()
-
-            completed_descriptions = {extract_description(task) for task in completed}
-            not_completed = [task for task in all_tasks if extract_description(task) not in completed_descriptions]
-
-            # Calculate today's points.
-            daily_points = 0
-            if personal_defaults and isinstance(personal_defaults[0], dict):
-                for task in personal_defaults:
-                    if task["description"] in completed_defaults:
-                        daily_points += task.get("difficulty", 1)
-            else:
-                daily_points += len(completed_defaults)
-            for t in custom_tasks_raw:
-                if t.get("is_completed"):
-                    daily_points += t.get("difficulty", 2)
-
-            summary = "Here is your nightly summary:\n\n"
-            summary += "**Completed Tasks:**\n"
-            summary += "\n".join(f"- {task}" for task in completed) if completed else "None\n"
-            summary += "\n\n**Uncompleted Tasks:**\n"
-            summary += "\n".join(f"- {task}" for task in not_completed) if not_completed else "None\n"
-            summary += f"\n\nTotal Points for Today: {daily_points}\n"
-
-            print(f"Attempting to send nightly DM to {user_info['name']} (ID: {user_id})")
+class RenderCache:
+    """Bounded LRU of rendered message text.
+
+    Whole bodies are keyed by (event, user id, checklist version, date), so a
+    body is rebuilt only after that user's checklist changes. The default-task
+    part of a message is keyed by the default set instead and shared by every
+    user who picked the same defaults.
+    """
+
+    def __init__(self, max_size=RENDER_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        text = self.entries.get(key)
+        if text is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return text
+        self.misses += 1
+        text = self.entries[key] = render()
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return text
+
+render_cache = RenderCache()
+
+def default_fragment(checklist, style, completed_numbers=()):
+    # Rendered default-task lines, shared between users with the same defaults.
+    def render():
+        defaults = checklist.default_entries()
+        if style == "morning":
+            return "\n".join(f"{entry.number}. {entry.description} (points: {entry.difficulty})" for entry in defaults)
+        if style == "numbered":
+            return "\n".join(f"{entry.number}. {entry.label}" for entry in defaults)
+        # "done"/"pending": the nightly summary's bullet lists.
+        want_done = style == "done"
+        return "\n".join(f"- {entry.label}" for entry in defaults if (entry.number in completed_numbers) == want_done)
+    return render_cache.get_or_render((style, checklist.defaults_key, completed_numbers), render)
+
+def cached_body(event, user_id, checklist, render):
+    return render_cache.get_or_render((event, user_id, checklist.version, checklist.date), render)
+
+###############################################################################
+# Nightly Summary: Build a Registered User's Daily Task Summary for the Night
+###############################################################################
+def render_nightly_summary(user_id, user_info, local_date):
+    checklist = get_checklist(user_id, user_info, local_date)
+
+    def render():
+        completed_defaults = tuple(sorted(n for n in checklist.completed if n <= len(checklist.defaults_key)))
+        customs = checklist.custom_entries()
+        completed = [default_fragment(checklist, "done", completed_defaults)]
+        completed += [f"- {entry.label}" for entry in customs if checklist.is_completed(entry)]
+        not_completed = [default_fragment(checklist, "pending", completed_defaults)]
+        not_completed += [f"- {entry.label}" for entry in customs if not checklist.is_completed(entry)]
+        completed_text = "\n".join(line for line in completed if line)
+        not_completed_text = "\n".join(line for line in not_completed if line)
+        return (
+            "Here is your nightly summary:\n\n"
+            "**Completed Tasks:**\n" + (completed_text or "None\n") +
+            "\n\n**Uncompleted Tasks:**\n" + (not_completed_text or "None\n") +
+            f"\n\nTotal Points for Today: {checklist.points_today()}\n"
+        )
+    return cached_body("nightly", user_id, checklist, render)
+
+
+###############################################################################
+# Morning Reminder: Build a Registered User's 8am Message with Today's Tasks
+###############################################################################
+def render_morning_reminder(user_id, user_info, local_date):
+    # Numbers match the checklist so they can be passed straight to /complete.
+    checklist = get_checklist(user_id, user_info, local_date)
+
+    def render():
+        customs = checklist.custom_entries()
+        daily_custom = [entry for entry in customs if entry.task_type == "daily"]
+        weekly_custom = [entry for entry in customs if entry.task_type == "weekly"]
+        lines = [
+            f"Good morning {user_info['name']}!\n\nHere are your tasks for today:\n\n**Daily Tasks:**",
+            default_fragment(checklist, "morning"),
+        ]
+        if daily_custom:
+            lines.append("\n**Your Custom Daily Tasks:**")
+            lines.extend(f"{entry.number}. {entry.description} (points: {entry.difficulty})" for entry in daily_custom)
+        if weekly_custom:
+            lines.append("\n**Your Weekly Tasks:**")
+            lines.extend(f"{entry.number}. {entry.description} (points: {entry.difficulty})" for entry in weekly_custom)
+        return "\n".join(lines) + "\n"
+    return cached_body("morning", user_id, checklist, render)
+
+###############################################################################
+# Weekly Summary: Build a Registered User's Friday 5pm Message with Their Weekly Points
+###############################################################################
+def render_weekly_summary(user_id, user_info, local_date):
+    checklist = get_checklist(user_id, user_info, local_date)
+    total_points = user_info.get("points", 0)
+    # The summary goes out on Friday afternoon, after the points week (which
+    # starts on Friday, like weekly tasks) has rolled over.
+    weekly_points = points_last_week(user_info, local_date)
+
+    # The points change every week, so only the task list is cached.
+    def render_tasks():
+        if not checklist.entries:
+            return "No tasks found.\n"
+        lines = [default_fragment(checklist, "numbered")]
+        lines += [f"{entry.number}. {entry.label}" for entry in checklist.custom_entries()]
+        return "\n".join(line for line in lines if line) + "\n"
+
+    message = (
+        f"Happy Friday, {user_info['name']}!\n\n"
+        f"This past week, you've earned **{weekly_points}** points.\n"
+        f"Your total points so far are **{total_points}**.\n\n"
+        "Here are your current tasks:\n" +
+        cached_body("weekly", user_id, checklist, render_tasks) +
+        "\nKeep up the great work!"
+    )
+    return message
+
+###############################################################################
+# Delivery Queue: Durable, De-duplicated Scheduled DMs Sent by a Worker Pool
+###############################################################################
+DELIVERY_FILE = "deliveries.journal"
+# Concurrent senders. discord.py keeps each DM channel in its own rate-limit
+# bucket and waits out 429s per route; DELIVERY_RATE keeps the pool as a whole
+# under Discord's global limit of 50 requests per second.
+DELIVERY_WORKERS = 8
+DELIVERY_RATE = 40
+# A job that could not be sent within this long of its due time is dropped.
+DELIVERY_GRACE = timedelta(hours=2)
+DELIVERY_MAX_ATTEMPTS = 5
+# Seconds between batched writes of the delivery journal.
+DELIVERY_LOG_DELAY = 1
+# Seconds between rewrites of the delivery journal without old entries.
+DELIVERY_COMPACT_INTERVAL = 24 * 3600
+
+def delivery_key(event, user_id, local_date):
+    return f"{event}:{user_id}:{local_date.isoformat()}"
+
+class RateLimiter:
+    """Token bucket shared by all delivery workers."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = None
+        self.lock = None
+
+    async def acquire(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self.updated is not None:
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.updated = loop.time()
+            self.tokens -= 1
+
+class DeliveryQueue:
+    """Persistent queue of scheduled DMs keyed by (event, user, local date).
+
+    Every enqueue and every finished job is appended to DELIVERY_FILE, so
+    pending jobs survive a restart and a key that was already queued or sent
+    is never queued again. The log is written in batches every
+    DELIVERY_LOG_DELAY seconds; a crash inside that window can repeat a send
+    but never lose one. Once a day (and at startup) keys too old to be
+    queued again are forgotten and the log is rewritten without them.
+    """
+
+    def __init__(self, path=process_file(DELIVERY_FILE), workers=DELIVERY_WORKERS, rate=DELIVERY_RATE, grace=DELIVERY_GRACE):
+        self.path = path
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.grace = grace
+        self.jobs = {}       # key -> pending job
+        self.finished = {}   # key -> due time (ISO) of a sent or abandoned job
+        self.queue = None
+        self.log = BatchedLog(path, DELIVERY_LOG_DELAY)
+        self._tasks = []
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    # Torn last line from a crash.
+                    break
+                if entry["op"] == "enqueue":
+                    self.jobs[entry["job"]["key"]] = entry["job"]
+                else:
+                    self.jobs.pop(entry["key"], None)
+                    self.finished[entry["key"]] = entry["due"]
+        self.prune()
+        self.rewrite(self.jobs.values(), self.finished)
+
+    def prune(self):
+        # Forget finished keys whose event can no longer be queued again.
+        horizon = (datetime.now(pytz.utc) - 2 * self.grace - timedelta(days=1)).isoformat()
+        self.finished = {key: due for key, due in self.finished.items() if due >= horizon}
+
+    def rewrite(self, jobs, finished):
+        # Replace the log with only what is still needed for de-duplication.
+        lines = [{"op": "enqueue", "job": job} for job in jobs]
+        lines += [{"op": "done", "key": key, "due": due} for key, due in finished.items()]
+        write_atomic(self.path, "".join(encode(line) + "\n" for line in lines))
+
+    def compact(self):
+        self.prune()
+        # Batched lines go to the writer thread first; the rewrite queued
+        # behind them is encoded there, from copies.
+        self.log.flush()
+        write_behind(self.rewrite, [dict(job) for job in self.jobs.values()], dict(self.finished))
+
+    async def run_compaction(self, interval=DELIVERY_COMPACT_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.compact()
+
+    def seen(self, key):
+        return key in self.jobs or key in self.finished
+
+    def enqueue(self, key, user_id, content, due, buttons=None):
+        # `buttons` are [label, custom_id] pairs, see checklist_buttons().
+        if self.seen(key):
+            return False
+        job = {"key": key, "user": user_id, "content": content, "due": due.isoformat()}
+        if buttons:
+            job["buttons"] = buttons
+        self.jobs[key] = job
+        self.log.append({"op": "enqueue", "job": job})
+        if self.queue is not None:
+            self.queue.put_nowait(key)
+        return True
+
+    def finish(self, key):
+        job = self.jobs.pop(key, None)
+        if job is None:
+            return
+        self.finished[key] = job["due"]
+        self.log.append({"op": "done", "key": key, "due": job["due"]})
+
+    def start(self):
+        if self._tasks:
+            return
+        self.queue = asyncio.Queue()
+        for job in sorted(self.jobs.values(), key=lambda job: job["due"]):
+            self.queue.put_nowait(job["key"])
+        self._tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self.run_compaction()))
+
+    async def worker(self):
+        while True:
+            key = await self.queue.get()
+            job = self.jobs.get(key)
+            if job is None:
+                continue
+            event = key.split(":", 1)[0]
+            due = datetime.fromisoformat(job["due"])
+            if due + self.grace < datetime.now(pytz.utc):
+                print(f"Dropping {key}: missed its delivery window.")
+                metrics.inc("ssk_dms_failed_total", event=event, reason="missed")
+                self.finish(key)
+                continue
+            await self.limiter.acquire()
+            started = perf_counter()
             try:
-                await dm_channel.send(summary)
-                print(f"Nightly summary DM sent to {user_info['name']}")
+                await self.deliver(job)
+                metrics.observe("ssk_dm_send_seconds", perf_counter() - started, event=event)
+                self.finish(key)
+                metrics.inc("ssk_dms_sent_total", event=event)
+                # How far behind its due time the burst got to this DM.
+                metrics.observe("ssk_dm_delay_seconds", (datetime.now(pytz.utc) - due).total_seconds(), event=event)
+            except (discord.Forbidden, discord.NotFound) as e:
+                # DMs closed or the account is gone; retrying will not help.
+                print(f"Error sending DM for {key}: {e}")
+                metrics.inc("ssk_dms_failed_total", event=event, reason="forbidden")
+                self.finish(key)
             except Exception as e:
-                print(f"Error sending DM to user {user_id}: {e}")
+                attempts = job.get("attempts", 0) + 1
+                job["attempts"] = attempts
+                metrics.inc("ssk_dm_errors_total", event=event)
+                if attempts >= DELIVERY_MAX_ATTEMPTS:
+                    print(f"Giving up on {key} after {attempts} attempts: {e}")
+                    metrics.inc("ssk_dms_failed_total", event=event, reason="gave_up")
+                    self.finish(key)
+                    continue
+                backoff = min(300, 2 ** attempts)
+                print(f"Error sending DM for {key} (attempt {attempts}), retrying in {backoff}s: {e}")
+                asyncio.get_running_loop().call_later(backoff, self.queue.put_nowait, key)
+
+    async def deliver(self, job):
+        if job.get("buttons"):
+            await send_view(partial(dm_channels.send, job["user"]), job["content"], view=buttons_view(job["buttons"]))
+        else:
+            await dm_channels.send(job["user"], job["content"])
 
+delivery_queue = DeliveryQueue()
 
 ###############################################################################
-# Morning Reminder: DM Each Registered User at 8am with Today's Tasks
+# Reminder Scheduler: Fire Each Event Once per Time Zone Instead of Scanning Users
 ###############################################################################
-@tasks.loop(seconds=60)
-async def morning_reminder():
-    await bot.wait_until_ready()
-    data = load_data()
-    now_utc = datetime.utcnow()
-    for user_id, user_info in data.items():
-        # Skip if user is paused or no timezone is set.
-        if user_info.get("paused"):
-            print(f"User {user_id} is paused; skipping DM.")
-            continue
-        tz_str = user_info.get("timezone")
-        if not tz_str:
-            # If the user hasn't set a time zone, skip them.
-            continue
-        try:
-            tz = pytz.timezone(tz_str)
-        except Exception as e:
-            print(f"Invalid timezone for user {user_id}: {tz_str}")
+# Event name -> (local weekday or None for every day, local hour, local minute, renderer)
+# Renderers get the local date the event fired for, not the date at send
+# time, so a summary caught up after midnight still describes its own day.
+REMINDER_EVENTS = {
+    "morning": (None, 8, 0, render_morning_reminder),
+    "nightly": (None, 23, 0, render_nightly_summary),
+    "weekly": (4, 17, 0, render_weekly_summary),
+}
+# Events whose message gets a completion button for each pending task.
+BUTTON_EVENTS = {"morning"}
+
+def next_fire_time(tz, weekday, hour, minute, after):
+    # Next UTC instant strictly after `after` when the local clock in tz shows
+    # hour:minute (on `weekday`, if given). DST gaps and overlaps resolve to a
+    # single instant, so an event never fires twice or not at all on those days.
+    day = after.astimezone(tz).date()
+    for offset in range(8):
+        candidate_day = day + timedelta(days=offset)
+        if weekday is not None and candidate_day.weekday() != weekday:
             continue
+        local = tz.normalize(tz.localize(datetime.combine(candidate_day, time(hour, minute)), is_dst=False))
+        fire = local.astimezone(pytz.utc)
+        if fire > after:
+            return fire
+    raise ValueError("No fire time within a week")
+
+class ReminderScheduler:
+    """Groups users by time zone and sleeps until the next (zone, event) is due.
+
+    Only the users in the bucket that fires are visited, and their messages
+    are handed to the delivery queue rather than sent inline. Registering, changing time zone, pausing and deregistering just move one
+    user between buckets via refresh(). Only users this process owns (see
+    owns_user) are scheduled; with several processes, follow() picks up the
+    changes other processes made to this process's users.
+    """
 
-        # Get the current local time for the user.
-        now_local = datetime.now(tz)
-        # For testing, you might check for a specific minute; here, we send at 8:00 AM local time.
-        if now_local.hour == 8 and now_local.minute == 0:
+    def __init__(self, events=REMINDER_EVENTS):
+        self.events = events
+        self.buckets = {}      # time zone name -> set of user ids
+        self.user_zones = {}   # user id -> time zone name
+        self.heap = []         # (fire time in UTC, time zone name, event name)
+        self.scheduled = set() # (time zone name, event name) pairs present in the heap
+        self.wakeup = None     # set when an earlier entry is pushed; created in run()
+        # Buckets created before this instant are scheduled from it, so events
+        # missed while the bot was down are still delivered on startup.
+        self.catch_up_from = None
+
+    def load(self, schedulable_users, catch_up_from=None):
+        self.catch_up_from = catch_up_from
+        for user_id, tz_name in schedulable_users:
+            if owns_user(user_id):
+                self.update_user(user_id, tz_name)
+        self.catch_up_from = None
+
+    def apply_changes(self, changed):
+        # changed: (user id, time zone, paused) as stored, see scan_changes().
+        for user_id, tz_name, paused in changed:
+            if not owns_user(user_id):
+                continue
+            if user_id in user_store.dirty or user_id in user_store.in_flight:
+                # Not written yet; this process's copy is newer.
+                self.refresh(user_id)
+                continue
+            wanted = tz_name if tz_name and not paused else None
+            if self.user_zones.get(user_id) != wanted:
+                self.update_user(user_id, wanted)
+
+    async def follow(self, interval, since):
+        # `since`: the last change already reflected in the buckets. Only the
+        # users written after it are read, never the whole table.
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
             try:
-                user = bot.get_user(int(user_id))
-                if user is None:
-                    user = await bot.fetch_user(int(user_id))
-                dm_channel = await user.create_dm()
-            except Exception as e:
-                print(f"Error fetching DM channel for user {user_id}: {e}")
+                since, changed = await loop.run_in_executor(None, user_store.storage.scan_changes, since)
+            except sqlite3.Error as e:
+                print(f"Error reading changed users: {e}")
                 continue
+            self.apply_changes(changed)
 
-            # Format the message as before.
-            personal_defaults = user_info.get("personal_defaults", [])
-            if personal_defaults and isinstance(personal_defaults[0], dict):
-                formatted_defaults = [f"{task['description']} (points: {task['difficulty']})" for task in personal_defaults]
-            else:
-                formatted_defaults = personal_defaults
+    def refresh(self, user_id):
+        if not owns_user(user_id):
+            # Picked up by the owning process's follow().
+            return
+        user_info = user_store.get(user_id)
+        if user_info is None or user_info.get("paused"):
+            self.update_user(user_id, None)
+        else:
+            self.update_user(user_id, user_info.get("timezone"))
 
-            daily_custom = [
-                f"{t['description']} (points: {t.get('difficulty', 2)})"
-                for t in user_info.get("tasks", [])
-                if t["deleted"] is None and t["type"] == "daily"
-            ]
-            weekly_custom = [
-                f"{t['description']} (points: {t.get('difficulty', 2)})"
-                for t in user_info.get("tasks", [])
-                if t["deleted"] is None and t["type"] == "weekly"
-            ]
-            message = f"Good morning {user_info['name']}!\n\nHere are your tasks for today:\n\n**Daily Tasks:**\n"
-            for idx, task in enumerate(formatted_defaults, start=1):
-                message += f"{idx}. {task}\n"
-            if daily_custom:
-                message += "\n**Your Custom Daily Tasks:**\n"
-                for idx, task in enumerate(daily_custom, start=1):
-                    message += f"{idx}. {task}\n"
-            if weekly_custom:
-                message += "\n**Your Weekly Tasks:**\n"
-                for idx, task in enumerate(weekly_custom, start=1):
-                    message += f"{idx}. {task}\n"
-            print(f"Attempting to send DM to {user_info['name']} (ID: {user_id})")
-            try:
-                await dm_channel.send(message)
-                print(f"DM sent to {user_info['name']}")
-            except Exception as e:
-                print(f"Error sending DM to user {user_id}: {e}")
+    def update_user(self, user_id, tz_name):
+        old = self.user_zones.pop(user_id, None)
+        if old is not None:
+            bucket = self.buckets[old]
+            bucket.discard(user_id)
+            if not bucket:
+                # Its heap entries are dropped when they come due.
+                del self.buckets[old]
+        if not tz_name:
+            return
+        try:
+            get_timezone(tz_name)
+        except pytz.UnknownTimeZoneError:
+            print(f"Invalid timezone for user {user_id}: {tz_name}")
+            return
+        self.buckets.setdefault(tz_name, set()).add(user_id)
+        self.user_zones[user_id] = tz_name
+        after = self.catch_up_from or datetime.now(pytz.utc)
+        for event in self.events:
+            if (tz_name, event) not in self.scheduled:
+                self.schedule(tz_name, event, after)
+
+    def schedule(self, tz_name, event, after):
+        weekday, hour, minute, _ = self.events[event]
+        fire = next_fire_time(get_timezone(tz_name), weekday, hour, minute, after)
+        if self.wakeup is not None and (not self.heap or fire < self.heap[0][0]):
+            self.wakeup.set()
+        heapq.heappush(self.heap, (fire, tz_name, event))
+        self.scheduled.add((tz_name, event))
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            fire, tz_name, event = self.heap[0]
+            delay = (fire - datetime.now(pytz.utc)).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.heap)
+            self.scheduled.discard((tz_name, event))
+            bucket = self.buckets.get(tz_name)
+            if not bucket:
+                continue
+            self.schedule(tz_name, event, fire)
+            started = perf_counter()
+            await self.dispatch(event, tz_name, fire, list(bucket))
+            # Per (zone, event) firing; the 08:00 and 23:00 bursts are the sum over zones.
+            metrics.observe("ssk_reminder_dispatch_seconds", perf_counter() - started, event=event)
+
+    async def dispatch(self, event, tz_name, fire, user_ids):
+        render = self.events[event][3]
+        local_date = fire.astimezone(get_timezone(tz_name)).date()
+        for count, user_id in enumerate(user_ids, start=1):
+            key = delivery_key(event, user_id, local_date)
+            if delivery_queue.seen(key):
+                continue
+            user_info = user_store.get(user_id)
+            if user_info is None or user_info.get("paused"):
+                continue
+            buttons = checklist_buttons(user_id, get_checklist(user_id, user_info, local_date)) if event in BUTTON_EVENTS else None
+            if delivery_queue.enqueue(key, user_id, render(user_id, user_info, local_date), fire, buttons):
+                metrics.inc("ssk_reminders_queued_total", event=event)
+            if count % 500 == 0:
+                # Let interactions run between slices of a large bucket.
+                await asyncio.sleep(0)
+
+reminder_scheduler = ReminderScheduler()
+
+# Seconds between checks for users other processes changed, when running as several processes.
+SCHEDULE_SYNC_INTERVAL = 60
+
+async def run_scheduled_messages():
+    delivery_queue.start()
+    # Read before the full scan, so no change made during it is missed.
+    since = user_store.storage.last_change() if PROCESS_COUNT > 1 else None
+    reminder_scheduler.load(user_store.schedulable_users(), datetime.now(pytz.utc) - DELIVERY_GRACE)
+    if PROCESS_COUNT > 1:
+        await asyncio.gather(reminder_scheduler.run(), reminder_scheduler.follow(SCHEDULE_SYNC_INTERVAL, since))
+    else:
+        await reminder_scheduler.run()
+
+@tasks.loop(count=1)
+async def run_reminder_scheduler():
+    await bot.wait_until_ready()
+    buddy_watch.load((user_id, last_activity(record)) for user_id, record in user_store.buddy_links())
+    await asyncio.gather(run_scheduled_messages(), buddy_watch.run())
 
 ###############################################################################
-# Weekly Summary: DM Each Registered User on Friday at 5pm with Their Weekly Points
+# Buddy Check-ins: Nudge a Buddy When Their Partner Has Been Inactive a Week
 ###############################################################################
-@tasks.loop(seconds=60)
-async def weekly_summary():
-    await bot.wait_until_ready()
-    data = load_data()
-    for user_id, user_info in data.items():
-        if user_info.get("paused"):
-            print(f"User {user_id} is paused; skipping weekly summary DM.")
-            continue
-        tz_str = user_info.get("timezone")
-        if not tz_str:
-            continue
-        try:
-            tz = pytz.timezone(tz_str)
-        except Exception as e:
-            print(f"Invalid timezone for user {user_id}: {tz_str}")
-            continue
-        now_local = datetime.now(tz)
-        # Check if it is Friday at 17:00 (5 PM) local time.
-        if now_local.weekday() == 4 and now_local.hour == 17 and now_local.minute == 0:
-            try:
-                user = bot.get_user(int(user_id))
-                if user is None:
-                    user = await bot.fetch_user(int(user_id))
-                dm_channel = await user.create_dm()
-            except Exception as e:
-                print(f"Error fetching DM channel for user {user_id}: {e}")
+BUDDY_INACTIVITY = timedelta(days=7)
+
+class BuddyWatch:
+    """Min-heap of (deadline, user id) for users with an accountability buddy.
+
+    A user's deadline is their last completion (or the day the buddy joined)
+    plus BUDDY_INACTIVITY. The heap holds one entry per user: a completion
+    only moves the deadline in `deadlines`, and an entry that comes due
+    early is pushed back with the current deadline, so the heap grows with
+    the watched users rather than the completions. Updates and checks cost
+    at most O(log n) and only users actually crossing the threshold are
+    looked at. Nudges go through the delivery queue; a user who stays
+    inactive nudges their buddy again every BUDDY_INACTIVITY.
+
+    Runs in the gateway process only, since that is where completions and
+    buddy links happen.
+    """
+
+    def __init__(self, inactivity=BUDDY_INACTIVITY):
+        self.inactivity = inactivity
+        self.heap = []
+        self.deadlines = {}  # user id -> current deadline
+        self.queued = {}     # user id -> deadline of the user's live heap entry
+        self.wakeup = None   # created in run()
+
+    def load(self, links):
+        # links: (user id, last activity as an aware UTC datetime)
+        for user_id, last_active in links:
+            self.deadlines[user_id] = last_active + self.inactivity
+        self.queued = dict(self.deadlines)
+        self.heap = [(deadline, user_id) for user_id, deadline in self.deadlines.items()]
+        heapq.heapify(self.heap)
+
+    def update(self, user_id, last_active):
+        deadline = last_active + self.inactivity
+        self.deadlines[user_id] = deadline
+        queued = self.queued.get(user_id)
+        if queued is not None and queued <= deadline:
+            # The entry already in the heap comes due first and is re-pushed then.
+            return
+        # No entry yet, or the deadline moved earlier; the later entry is
+        # skipped when it comes due.
+        self.queued[user_id] = deadline
+        if self.wakeup is not None and (not self.heap or deadline < self.heap[0][0]):
+            self.wakeup.set()
+        heapq.heappush(self.heap, (deadline, user_id))
+
+    def discard(self, user_id):
+        self.deadlines.pop(user_id, None)
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            deadline, user_id = self.heap[0]
+            delay = (deadline - datetime.now(pytz.utc)).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
                 continue
+            heapq.heappop(self.heap)
+            if self.queued.get(user_id) != deadline:
+                # Replaced by an earlier entry for the same user.
+                continue
+            del self.queued[user_id]
+            current = self.deadlines.get(user_id)
+            if current is None:
+                # The buddy link is gone.
+                continue
+            if current > deadline:
+                # Moved on by a completion since it was pushed.
+                self.queued[user_id] = current
+                heapq.heappush(self.heap, (current, user_id))
+                continue
+            self.check(user_id, deadline)
 
-            personal_defaults = user_info.get("personal_defaults", [])
-            if personal_defaults and isinstance(personal_defaults[0], dict):
-                formatted_defaults = [f"{task['description']} (points: {task['difficulty']})" for task in personal_defaults]
-            else:
-                formatted_defaults = personal_defaults
+    def check(self, user_id, deadline):
+        user_info = user_store.get(user_id)
+        if user_info is None or not user_info.get("accountability_buddy"):
+            self.discard(user_id)
+            return
+        # Re-arm first: the next nudge is one more inactivity period away
+        # (counted from now if the bot was down when this one came due).
+        now = datetime.now(pytz.utc)
+        self.update(user_id, max(deadline, now))
+        if user_info.get("paused"):
+            # Taking a break from reminders; don't check up on them either.
+            return
+        key = delivery_key("buddy", user_id, user_today(user_info))
+        if delivery_queue.seen(key):
+            return
+        days = (now - last_activity(user_info)).days
+        content = (
+            f"Hi! Your accountability buddy {user_info['name']} hasn't completed any self-care tasks in {days} days. "
+            "Maybe send them a message and see how they're doing?"
+        )
+        delivery_queue.enqueue(key, user_info["accountability_buddy"], content, now)
 
-            custom_tasks_raw = [t for t in user_info.get("tasks", []) if t["deleted"] is None]
-            formatted_custom = [
-                f"{t['description']} ({t['type'].capitalize()}, points: {t.get('difficulty', 2)})"
-                for t in custom_tasks_raw
-            ]
-            tasks_list = formatted_defaults + formatted_custom
-            total_points = user_info.get("points", 0)
-            weekly_points = user_info.get("weekly_points", 0)
-
-            message = (
-                f"Happy Friday, {user_info['name']}!\n\n"
-                f"This week, you've earned **{weekly_points}** points.\n"
-                f"Your total points so far are **{total_points}**.\n\n"
-                "Here are your current tasks:\n"
-            )
-            if tasks_list:
-                for idx, task in enumerate(tasks_list, start=1):
-                    message += f"{idx}. {task}\n"
-            else:
-                message += "No tasks found.\n"
-            message += "\nKeep up the great work!"
+def last_activity(user_info):
+    # Last completion, else when the buddy joined, else registration.
+    stamp = user_info.get("last_completed") or user_info.get("buddy_since") or user_info.get("registered")
+    if not stamp:
+        return datetime.now(pytz.utc)
+    moment = datetime.fromisoformat(stamp)
+    if moment.tzinfo is None:
+        moment = pytz.utc.localize(moment)
+    return moment
+
+buddy_watch = BuddyWatch()
 
-            try:
-                await dm_channel.send(message)
-                print(f"Weekly summary DM sent to {user_info['name']} (ID: {user_id})")
-            except Exception as e:
-                print(f"Failed to send weekly summary DM to {user_id}: {e}")
-            
-            # Reset weekly points.
-            user_info["weekly_points"] = 0
-    save_data(data)
-    
 ###############################################################################
-# Reset Custom Task Completion for Daily Tasks (runs at midnight)
+# Event Loop Lag: Detect Anything That Blocks the Loop
 ###############################################################################
-@tasks.loop(time=time(hour=0, minute=0))
-async def reset_daily_custom_tasks():
-    await bot.wait_until_ready()
-    data = load_data()
-    changed = False
-    # Reset custom daily tasks
-    for user_id, user_info in data.items():
-        for task in user_info.get("tasks", []):
-            if task["deleted"] is None and task["type"] == "daily" and task.get("is_completed"):
-                task["is_completed"] = False
-                changed = True
-        # Reset default task completions stored in "daily_defaults"
-        if "daily_defaults" in user_info:
-            # Always update the date and empty the list for the new day.
-            user_info["daily_defaults"] = {"date": datetime.utcnow().date().isoformat(), "completed": []}
-            changed = True
-    if changed:
-        save_data(data)
+# How often the monitor wakes up, the lag a single wake-up may show before it
+# counts as a stall, and how often the figures are reported and reset.
+LOOP_LAG_INTERVAL = 0.05
+LOOP_LAG_BUDGET = 0.005
+LOOP_LAG_REPORT = 3600
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeping task.
+
+    Any blocking call (disk I/O, encoding a big document, a slow render)
+    delays the next wake-up by as long as it runs, so max_lag bounds the
+    longest stall since the last report and `stalls` counts wake-ups later
+    than LOOP_LAG_BUDGET.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, budget=LOOP_LAG_BUDGET, report_every=LOOP_LAG_REPORT):
+        self.interval = interval
+        self.budget = budget
+        self.report_every = report_every
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    def record(self, lag):
+        metrics.observe("ssk_event_loop_lag_seconds", lag)
+        self.samples += 1
+        if lag > self.budget:
+            self.stalls += 1
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+    def snapshot(self):
+        return {"samples": self.samples, "stalls": self.stalls, "max_lag_ms": round(self.max_lag * 1000, 1)}
 
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_report = loop.time() + self.report_every
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            self.record(max(0.0, now - started - self.interval))
+            if now >= next_report:
+                stats = self.snapshot()
+                print(f"Event loop lag: max {stats['max_lag_ms']} ms, {stats['stalls']} of {stats['samples']} wake-ups over {self.budget * 1000:g} ms.")
+                self.reset()
+                next_report = now + self.report_every
+
+loop_lag = LoopLagMonitor()
+
+@tasks.loop(count=1)
+async def run_loop_lag_monitor():
+    await loop_lag.run()
 
 ###############################################################################
-# Reset Custom Task Completion for Weekly Tasks (runs on Friday at midnight)
+# Task Tombstones: Purge Removed Custom Tasks
 ###############################################################################
-@tasks.loop(time=time(hour=0, minute=0))
-async def reset_weekly_custom_tasks():
-    await bot.wait_until_ready()
-    # Check if today is Friday (weekday() returns 4 for Friday)
-    if datetime.utcnow().weekday() == 4:
-        data = load_data()
-        changed = False
-        for user_id, user_info in data.items():
-            for task in user_info["tasks"]:
-                if task["deleted"] is None and task["type"] == "weekly" and task.get("is_completed"):
-                    task["is_completed"] = False
-                    changed = True
-        if changed:
-            save_data(data)
+# /remove only marks a task deleted; a day-by-day sweep drops tasks removed
+# more than TASK_TOMBSTONE_DAYS ago so records stop growing. Task ids come
+# from a counter (see new_task_id), so a purged task's id is never reused.
+TASK_TOMBSTONE_DAYS = 7
+
+def purge_deleted_tasks(user_info, before):
+    # Returns True if any task was dropped.
+    tasks_kept = [task for task in user_info.get("tasks", []) if task["deleted"] is None or task["deleted"] >= before]
+    if len(tasks_kept) == len(user_info.get("tasks", [])):
+        return False
+    user_info["tasks"] = tasks_kept
+    return True
+
+@tasks.loop(hours=24)
+@metrics.timed("ssk_loop_seconds", loop="run_tombstone_purge")
+async def run_tombstone_purge():
+    before = (datetime.utcnow() - timedelta(days=TASK_TOMBSTONE_DAYS)).isoformat()
+    purged = 0
+    for count, user_id in enumerate(user_store.tombstoned_users(before), start=1):
+        async with user_store.transaction(user_id) as txn:
+            if txn.user is not None and purge_deleted_tasks(txn.user, before):
+                txn.changed("tasks")
+                purged += 1
+        if count % 500 == 0:
+            await asyncio.sleep(0)
+    if purged:
+        print(f"Purged removed tasks from {purged} users.")
+
+@tasks.loop(hours=24)
+async def compact_points_ledger():
+    # Skips the run at startup, which comes right after load() read the file.
+    if compact_points_ledger.current_loop:
+        points_ledger.compact()
 
 ###############################################################################
-# Bot Ready and Command Sync
+# Metrics: Command Timings, the Prometheus Endpoint and /metrics
 ###############################################################################
-# (Remember to start these loops in your on_ready handler.)
+# With "METRICS_PORT" in config.json, the figures collected in `metrics` are
+# served at http://METRICS_HOST:METRICS_PORT/metrics in Prometheus text
+# format; each extra process (see PROCESS_INDEX) listens on the next port up.
+# /metrics shows a summary to the user ids in "ADMIN_IDS".
+METRICS_PORT = config.get("METRICS_PORT")
+METRICS_HOST = config.get("METRICS_HOST", "127.0.0.1")
+ADMIN_IDS = {str(user_id) for user_id in config.get("ADMIN_IDS", [])}
+
+metrics.gauge("ssk_deliveries_pending", lambda: len(delivery_queue.jobs))
+metrics.gauge("ssk_users_resident", lambda: len(user_store.users))
+metrics.gauge("ssk_conversations_open", lambda: len(conversations.states))
+metrics.gauge("ssk_timers_pending", lambda: len(timer_wheel))
+
+async def stamp_interaction(interaction: discord.Interaction):
+    # The tree calls this before every slash command; the completion and
+    # error handlers below time the command from here.
+    interaction.extras["started"] = perf_counter()
+    return True
+
+bot.tree.interaction_check = stamp_interaction
+
+def command_finished(interaction, outcome):
+    name = interaction.command.qualified_name if interaction.command else "unknown"
+    started = interaction.extras.get("started")
+    if started is not None:
+        metrics.observe("ssk_command_seconds", perf_counter() - started, command=name)
+    metrics.inc("ssk_commands_total", command=name, outcome=outcome)
+    return name
+
 @bot.event
-async def on_ready():
-    print(f"Logged in as {bot.user}")
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    command_finished(interaction, "ok")
+
+@bot.tree.error
+async def on_app_command_error(interaction: discord.Interaction, error):
+    name = command_finished(interaction, "error")
+    print(f"Error in /{name}: {error!r}")
+    traceback.print_exception(error)
+
+async def serve_metrics(request):
+    return web.Response(body=metrics.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def start_metrics_server():
+    if not METRICS_PORT:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", serve_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = int(METRICS_PORT) + PROCESS_INDEX
+    await web.TCPSite(runner, METRICS_HOST, port).start()
+    print(f"Serving metrics on http://{METRICS_HOST}:{port}/metrics")
+
+def metrics_summary():
+    def seconds(bound):
+        return f"{bound:g}s" if bound != float("inf") else f"over {METRIC_BUCKETS[-1]:g}s"
+
+    lines = [f"**Metrics since {metrics.started:%Y-%m-%d %H:%M} UTC** (process {PROCESS_INDEX} of {PROCESS_COUNT})"]
+    lag = loop_lag.snapshot()
+    lines.append(f"Event loop this hour: max lag {lag['max_lag_ms']} ms, {lag['stalls']} of {lag['samples']} wake-ups over {loop_lag.budget * 1000:g} ms.")
+    lines.append("**Commands** (p50 / p95 at most):")
+    for name, count, p50, p95, _ in metrics.latencies("ssk_command_seconds", "command")[:10]:
+        lines.append(f"- /{name}: {count} calls, {seconds(p50)} / {seconds(p95)}")
+    lines.append("**Reminder bursts** (one firing per time zone):")
+    for event, count, p50, p95, slowest in metrics.latencies("ssk_reminder_dispatch_seconds", "event"):
+        lines.append(f"- {event}: {count} firings, {seconds(p50)} / {seconds(p95)}, slowest at most {seconds(slowest)}")
+    sent = metrics.counter_totals("ssk_dms_sent_total", "event")
+    failed = metrics.counter_totals("ssk_dms_failed_total", "event")
+    lines.append(f"**DMs** ({len(delivery_queue.jobs)} pending):")
+    for event in sorted(set(sent) | set(failed)):
+        lines.append(f"- {event}: {sent.get(event, 0)} sent, {failed.get(event, 0)} failed")
+    written = metrics.counter_totals("ssk_storage_write_bytes_total", "file")
+    if written:
+        lines.append("**Written:** " + ", ".join(f"{name} {size / 1024:,.1f} KiB" for name, size in sorted(written.items())))
+    text = "\n".join(lines)
+    # Discord's message limit.
+    return text if len(text) <= 2000 else text[:1997] + "..."
+
+@bot.tree.command(name="metrics", description="Show command latencies, event loop lag and reminder deliveries (bot admins only).")
+@app_commands.default_permissions(administrator=True)
+async def show_metrics(interaction: discord.Interaction):
+    if str(interaction.user.id) not in ADMIN_IDS:
+        await interaction.response.send_message("Only the bot's admins can see its metrics.", ephemeral=True)
+        return
+    await interaction.response.send_message(metrics_summary(), ephemeral=True)
+
+###############################################################################
+# Bot Setup and Command Sync
+###############################################################################
+# Global command syncs are heavily rate-limited, so the tree is only synced
+# when its fingerprint differs from the one recorded after the last sync.
+# Delete COMMAND_SYNC_FILE to force a sync.
+COMMAND_SYNC_FILE = "command_tree.json"
+
+def command_tree_fingerprint():
+    # Hash of the payload tree.sync() would upload.
+    payload = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands()), key=lambda command: command["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+async def sync_command_tree():
+    state = {"application_id": str(bot.application_id), "fingerprint": command_tree_fingerprint()}
+    if os.path.exists(COMMAND_SYNC_FILE):
+        try:
+            with open(COMMAND_SYNC_FILE, "r") as f:
+                if json.load(f) == state:
+                    print("Commands unchanged since the last sync.")
+                    return
+        except (OSError, json.decoder.JSONDecodeError) as e:
+            print(f"Ignoring {COMMAND_SYNC_FILE}: {e}")
     try:
         synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} commands.")
     except Exception as e:
         print(e)
-    if not nightly_summary.is_running() :
-        nightly_summary.start()
-    if not morning_reminder.is_running():
-        morning_reminder.start()
-    if not weekly_summary.is_running() :
-        weekly_summary.start()
-    if not reset_daily_custom_tasks.is_running():
-        reset_daily_custom_tasks.start()
-    if not reset_weekly_custom_tasks.is_running() :
-        reset_weekly_custom_tasks.start()
+        return
+    print(f"Synced {len(synced)} commands.")
+    write_behind(write_atomic, COMMAND_SYNC_FILE, encode(state))
+
+# setup_hook runs once per process, right after login; on_ready fires again
+# after every gateway reconnect, so it does nothing but log.
+@bot.event
+async def setup_hook():
+    await start_metrics_server()
+    if PROCESS_INDEX != 0:
+        # Worker processes (see run_worker) only send scheduled messages.
+        return
+    # Route presses on components sent before a restart.
+    bot.add_dynamic_items(CompleteTaskButton)
+    bot.add_view(TimezoneView())
+    bot.add_view(RegistrationTasksView())
+    await sync_command_tree()
+    run_reminder_scheduler.start()
+    run_loop_lag_monitor.start()
+    tick_timer_wheel.start()
+    run_tombstone_purge.start()
+    compact_points_ledger.start()
+
+@bot.event
+async def on_ready():
+    print(f"Logged in as {bot.user}")
 
 
 ###############################################################################
 # Run the Bot
 ###############################################################################
-bot.run(config["TOKEN"])
+async def run_worker():
+    # Processes other than 0 never connect to the gateway: sending DMs to
+    # their users only needs the REST API.
+    async with bot:
+        await bot.login(config["TOKEN"])
+        print(f"Process {PROCESS_INDEX} of {PROCESS_COUNT}: sending scheduled messages for its users.")
+        await asyncio.gather(run_scheduled_messages(), loop_lag.run())
+
+# Only when run as a script, so the benchmarks can import this file.
+if __name__ == "__main__":
+    try:
+        if sys.argv[1:2] == ["--export-json"]:
+            export_json(*sys.argv[2:3])
+        elif PROCESS_INDEX == 0:
+            bot.run(config["TOKEN"])
+        else:
+            asyncio.run(run_worker())
+    finally:
+        # Persist anything still waiting for the write-behind flush.
+        user_store.flush()
+        points_ledger.log.flush()
+        conversations.log.flush()
+        delivery_queue.log.flush()
+        dm_channels.save()
+        disk_writer.shutdown()
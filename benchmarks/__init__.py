@@ -0,0 +1,13 @@
+"""
+Benchmarks for Selfcare Sidekick.
+
+Generates synthetic user populations and times the bot's hot paths against
+them (loading and saving users.json, /list, /complete and the reminder
+events). Run from the repository root:
+
+    python -m benchmarks                          # 1k, 10k and 100k users
+    python -m benchmarks --sizes 1000 --output results.json
+    python -m benchmarks.generate 10000 users.json
+
+Results are written as JSON so runs from different versions can be compared.
+"""
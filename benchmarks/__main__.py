@@ -0,0 +1,72 @@
+"""
+Runs the benchmarks for each population size and writes one JSON report.
+
+    python -m benchmarks [--sizes 1000 10000 100000] [--repeat 3] [--storage json] [--output results.json]
+
+Each size runs in a child process (benchmarks.runner); the bot's own output
+goes to stderr so the report can be piped.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Selfcare Sidekick against synthetic users.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--legacy", type=float, default=0.2, help="share of records in older formats")
+    parser.add_argument("--sample", type=int, default=None, help="users per /list and /complete run")
+    parser.add_argument("--storage", choices=["json", "sqlite", "snapshot"], default="json")
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        "revision": git_revision(),
+        "started": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "legacy": args.legacy,
+        "storage": args.storage,
+        "results": [],
+    }
+    for size in args.sizes:
+        print(f"Benchmarking {size} users...", file=sys.stderr)
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        command = [sys.executable, "-m", "benchmarks.runner", "--size", str(size), "--repeat", str(args.repeat),
+                   "--seed", str(args.seed), "--legacy", str(args.legacy), "--storage", args.storage, "--output", path]
+        if args.sample:
+            command += ["--sample", str(args.sample)]
+        try:
+            subprocess.run(command, cwd=ROOT, stdout=sys.stderr, check=True)
+            with open(path) as f:
+                report["results"].append(json.load(f))
+        finally:
+            os.remove(path)
+
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Wrote {args.output}.", file=sys.stderr)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Synthetic users.json generator.
+
+The population mixes what a long-running bot accumulates: users spread over
+many time zones, paused users and users without a time zone, custom tasks
+(some soft-deleted), accountability buddies, and records in the older
+formats upgrade_record() converts (copied or plain-string defaults, tasks
+without ids, completions stored by description).
+
+    python -m benchmarks.generate 10000 users.json [--seed 0] [--legacy 0.2]
+"""
+
+import argparse
+import ast
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+BOT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Selfcare Sidekick.py")
+
+# (time zone, weight); None is a user who skipped the time zone menu.
+TIMEZONE_MIX = [
+    ("America/New_York", 30),
+    ("America/Chicago", 15),
+    ("America/Los_Angeles", 15),
+    ("America/Denver", 5),
+    ("Europe/London", 10),
+    ("Europe/Paris", 8),
+    ("Asia/Tokyo", 5),
+    ("Asia/Kolkata", 4),
+    ("Australia/Sydney", 3),
+    ("America/Sao_Paulo", 3),
+    (None, 2),
+]
+
+CUSTOM_TASK_WORDS = ["Walk", "Stretch", "Call", "Read", "Write", "Tidy", "Water", "Plants", "Mom", "Journal", "Breathe", "Cook"]
+
+def load_catalog(path=BOT_FILE):
+    # The bot's TASK_CATALOG, read from the source so the bot doesn't have to
+    # be loaded, split like DEFAULT_TASKS and REGISTRATION_EXTRA_TASKS.
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == "TASK_CATALOG" for target in node.targets):
+            catalog = ast.literal_eval(node.value)
+            ids = list(catalog)
+            return catalog, ids[:10], ids[10:]
+    raise RuntimeError(f"TASK_CATALOG not found in {path}")
+
+def generate_users(count, seed=0, legacy=0.2, now=None, catalog=None):
+    """Return a users.json dict with `count` users.
+
+    `legacy` is the share of records written in the older formats.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.utcnow()
+    catalog, default_ids, extra_ids = catalog or load_catalog()
+    zones, weights = zip(*TIMEZONE_MIX)
+    user_ids = set()
+    while len(user_ids) < count:
+        user_ids.add(str(rng.randrange(10 ** 17, 10 ** 18)))
+    user_ids = sorted(user_ids)
+
+    users = {}
+    for user_id in user_ids:
+        is_legacy = rng.random() < legacy
+        registered = now - timedelta(days=rng.randrange(0, 400), seconds=rng.randrange(86400))
+        # Within a couple of days of today, so the checklist paths see
+        # both current and stale completions.
+        day = (now - timedelta(days=rng.choice([0, 0, 0, 2]))).date().isoformat()
+
+        picks = default_ids if rng.random() < 0.6 else rng.sample(default_ids + extra_ids, 10)
+        if is_legacy:
+            kind = rng.random()
+            if kind < 0.2:
+                # Early registrations: plain strings worth 1 point.
+                personal_defaults = [catalog[task_id]["description"] for task_id in picks]
+            else:
+                personal_defaults = [dict(catalog[task_id]) for task_id in picks]
+        else:
+            personal_defaults = list(picks)
+        done = rng.sample(range(10), rng.randrange(0, 6))
+        if is_legacy:
+            completed = [catalog[picks[i]]["description"] for i in done]
+        else:
+            completed = [f"d{i + 1}" for i in done]
+
+        tasks = []
+        for number in range(1, rng.choice([0, 0, 1, 2, 3, 5, 8]) + 1):
+            task_type = "weekly" if rng.random() < 0.3 else "daily"
+            added = registered + timedelta(days=rng.randrange(0, 30))
+            task = {
+                "description": f"{rng.choice(CUSTOM_TASK_WORDS)} {rng.choice(CUSTOM_TASK_WORDS).lower()} #{number}",
+                "type": task_type,
+                "added": added.isoformat(),
+                "deleted": (added + timedelta(days=rng.randrange(1, 60))).isoformat() if rng.random() < 0.25 else None,
+                "difficulty": rng.choice([1, 2, 3]),
+            }
+            if is_legacy:
+                task["is_completed"] = rng.random() < 0.3
+            else:
+                task["id"] = f"c{number}"
+                task["completed_on"] = day if rng.random() < 0.3 else None
+            tasks.append(task)
+
+        points = rng.randrange(0, 2000)
+        record = {
+            "name": f"User {user_id[-4:]}",
+            "registered": registered.isoformat(),
+            "points": points,
+            "weekly_points": min(points, rng.randrange(0, 80)),
+            "tasks": tasks,
+            "personal_defaults": personal_defaults,
+            "daily_defaults": {"date": day, "completed": completed},
+            "last_journal": day if rng.random() < 0.2 else "",
+            "timezone": rng.choices(zones, weights)[0],
+            "paused": rng.random() < 0.1,
+        }
+        if not is_legacy:
+            record["next_task_id"] = len(tasks) + 1
+            record["catalog_version"] = 1
+            today = now.date()
+            record["points_week"] = (today - timedelta(days=(today.weekday() - 4) % 7)).isoformat()
+        users[user_id] = record
+
+    # Pair up a few users as accountability buddies.
+    for _ in range(count // 20):
+        a, b = rng.sample(user_ids, 2)
+        users[a]["accountability_buddy"] = b
+        users[a]["last_completed"] = (now - timedelta(days=rng.randrange(0, 10))).isoformat() + "+00:00"
+    return users
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic users.json.")
+    parser.add_argument("count", type=int)
+    parser.add_argument("path", nargs="?", default="users.json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--legacy", type=float, default=0.2, help="share of records in older formats")
+    args = parser.parse_args()
+    with open(args.path, "w") as f:
+        json.dump(generate_users(args.count, args.seed, args.legacy), f)
+    print(f"Wrote {args.count} users to {args.path}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Times one population size against a fresh copy of the bot.
+
+The bot keeps its state in module globals, so every size runs in its own
+process (see benchmarks.__main__) and its own scratch directory:
+
+    python -m benchmarks.runner --size 10000 --output result.json [--storage snapshot]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime
+
+import pytz
+
+from benchmarks.generate import BOT_FILE, generate_users
+
+def load_bot(path=BOT_FILE):
+    # The file name has a space in it, so it is loaded by path.
+    spec = importlib.util.spec_from_file_location("selfcare_sidekick", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def summarize(runs):
+    return {"runs": runs, "first": runs[0], "min": min(runs), "median": statistics.median(runs)}
+
+def timed(func, repeat, setup=None):
+    runs = []
+    for i in range(repeat):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        func(i)
+        runs.append(time.perf_counter() - start)
+    return summarize(runs)
+
+async def timed_async(func, repeat, setup=None):
+    runs = []
+    for i in range(repeat):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        await func(i)
+        runs.append(time.perf_counter() - start)
+    return summarize(runs)
+
+class FakeResponse:
+    # Stands in for interaction.response; the message is built but not sent.
+    async def send_message(self, content=None, **kwargs):
+        self.content = content
+
+async def drain(bot):
+    # Wait for the writer thread, twice: a finished flush may queue a
+    # compaction from its done callback.
+    loop = asyncio.get_running_loop()
+    for _ in range(2):
+        await loop.run_in_executor(bot.disk_writer, lambda: None)
+        await asyncio.sleep(0)
+
+def fake_interaction(user_id):
+    return types.SimpleNamespace(user=types.SimpleNamespace(id=int(user_id)), response=FakeResponse(), channel_id=None)
+
+async def run_scenarios(bot, size, repeat, sample):
+    results = {}
+    user_ids = sorted(user_id for user_id, _ in bot.user_store.items())
+    # Distinct users per repeat, so every run of /list and /complete starts cold.
+    slices = [user_ids[i * sample:(i + 1) * sample] for i in range(repeat)]
+
+    results["load_data"] = timed(lambda i: bot.load_data(bot.DATA_FILE), repeat)
+    data = bot.load_data(bot.DATA_FILE)
+    results["save_data"] = timed(lambda i: bot.save_data(data, "bench_save.json"), repeat)
+
+    async def list_users(i, warm=False):
+        for user_id in slices[0 if warm else i]:
+            await bot.list_tasks.callback(fake_interaction(user_id))
+    results["list"] = await timed_async(list_users, repeat)
+    results["list_warm"] = await timed_async(lambda i: list_users(i, warm=True), repeat)
+
+    async def complete_users(i):
+        for user_id in slices[i]:
+            await bot.complete.callback(fake_interaction(user_id), "1,2,3")
+    results["complete"] = await timed_async(complete_users, repeat)
+
+    # Encoding the users /complete left dirty; the write itself is on the writer thread.
+    results["flush"] = timed(lambda i: bot.user_store.flush(), 1)
+    await drain(bot)
+
+    # One firing of each reminder event in every time zone, with cold caches
+    # as it is once a day.
+    start = time.perf_counter()
+    bot.reminder_scheduler.load(bot.user_store.schedulable_users())
+    results["scheduler_load"] = summarize([time.perf_counter() - start])
+    now = datetime.now(pytz.utc)
+
+    def cold(i):
+        bot._checklists.clear()
+        bot.render_cache.entries.clear()
+        bot.delivery_queue.jobs.clear()
+        bot.delivery_queue.finished.clear()
+
+    for event in bot.REMINDER_EVENTS:
+        async def fire(i, event=event):
+            for tz_name, bucket in list(bot.reminder_scheduler.buckets.items()):
+                await bot.reminder_scheduler.dispatch(event, tz_name, now, list(bucket))
+        results[f"reminder_{event}"] = await timed_async(fire, repeat, cold)
+
+    bot.user_store.flush()
+    await drain(bot)
+    return results
+
+def run_size(size, repeat=3, seed=0, legacy=0.2, sample=None, storage="json"):
+    sample = sample or max(1, min(1000, size // repeat))
+    workdir = tempfile.mkdtemp(prefix=f"ssk-bench-{size}-")
+    os.chdir(workdir)
+    with open("config.json", "w") as f:
+        json.dump({"TOKEN": "benchmark", "STORAGE": storage}, f)
+    start = time.perf_counter()
+    users = generate_users(size, seed, legacy)
+    generated = time.perf_counter() - start
+    with open("users.json", "w") as f:
+        json.dump(users, f)
+    del users
+    users_json_bytes = os.path.getsize("users.json")
+
+    start = time.perf_counter()
+    bot = load_bot()
+    startup = time.perf_counter() - start
+
+    results = {"generate": summarize([generated]), "startup": summarize([startup])}
+    results.update(asyncio.run(run_scenarios(bot, size, repeat, sample)))
+    bot.disk_writer.shutdown()
+
+    # A second start, from what the first one left on disk (the snapshot
+    # storage imports users.json on its first start only).
+    start = time.perf_counter()
+    bot = load_bot()
+    results["restart"] = summarize([time.perf_counter() - start])
+    bot.disk_writer.shutdown()
+    os.chdir(os.path.dirname(BOT_FILE))
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "size": size,
+        "storage": storage,
+        "sample": sample,
+        "repeat": repeat,
+        "users_json_bytes": users_json_bytes,
+        "timings": results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark one population size.")
+    parser.add_argument("--size", type=int, required=True)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--legacy", type=float, default=0.2)
+    parser.add_argument("--sample", type=int, default=None, help="users per /list and /complete run")
+    parser.add_argument("--storage", choices=["json", "sqlite", "snapshot"], default="json")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    result = run_size(args.size, args.repeat, args.seed, args.legacy, args.sample, args.storage)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=4)
+
+if __name__ == "__main__":
+    main()